@@ -5,8 +5,18 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 import io
-import mysql.connector
 import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import edv_analytics
+import edv_db
+import edv_engine
+import edv_export
+import edv_perf
+import edv_valuation
 
 # ============================================================================
 # CONFIGURACIÓN DE STREAMLIT
@@ -132,63 +142,276 @@ def login_page():
 # CONEXIÓN A BASE DE DATOS
 # ============================================================================
 
+@st.cache_resource
+def get_db_pool():
+    """Crea el pool de conexiones MySQL compartido por todo el proceso"""
+    return edv_db.ConnectionPool.from_config(st.secrets["mysql"])
+
+@contextmanager
 def get_db_connection():
-    """Establece conexión con MySQL"""
+    """Presta una conexión del pool (se devuelve al salir del bloque with)"""
     try:
-        db_config = st.secrets["mysql"]
-        
-        connection = mysql.connector.connect(
-            host=db_config["host"],
-            user=db_config["user"],
-            password=db_config["password"],
-            database=db_config["database"]
-        )
-        return connection
+        pool = get_db_pool()
+        with edv_perf.span("get_db_connection"):
+            connection = pool.acquire()
     except KeyError as e:
         st.error(f"❌ Error: Falta configuración en secrets.toml: {e}")
-        return None
+        yield None
+        return
     except Exception as e:
         st.error(f"❌ Error de conexión a BD: {e}")
+        yield None
+        return
+    
+    try:
+        yield connection
+    finally:
+        pool.release(connection)
+
+def get_app_config(key, default):
+    """Lee una opción de la sección [app] de secrets.toml"""
+    try:
+        return st.secrets["app"].get(key, default)
+    except (KeyError, FileNotFoundError):
+        return default
+
+@st.cache_resource
+def get_delta_store():
+    """Selecciones cacheadas compartidas por todas las sesiones del proceso"""
+    return edv_db.DeltaStore(max_entries=32, refresh_seconds=30, full_reload_seconds=3600,
+                             float_dtype=get_app_config("float_dtype", "float64"),
+                             columns=edv_db.columns_for_groups([]))
+
+@st.cache_resource
+def get_shared_dataset():
+    """Tabla completa publicada en un fichero Arrow mapeado, compartida por todos los procesos del host"""
+    return edv_db.SharedDataset(get_app_config("snapshot_path", edv_db.SNAPSHOT_PATH))
+
+def _save_snapshot(frame):
+    """Publica la tabla completa tras cada cambio detectado"""
+    get_shared_dataset().publish(frame)
+
+@st.cache_resource
+def get_snapshot_frame():
+    """Tabla completa servida desde el snapshot compartido (None si no hay pyarrow)"""
+    if not edv_db.snapshot_available():
         return None
+    frame = edv_db.DeltaFrame(refresh_seconds=300, float_dtype=get_app_config("float_dtype", "float64"))
+    get_shared_dataset().sync(frame)
+    return frame
+
+def revalidate_in_background(frame, on_change=None):
+    """Lanza la revalidación contra MySQL sin bloquear la página"""
+    try:
+        frame.refresh_in_background(get_db_pool(), on_change=on_change)
+    except Exception:
+        pass
+
+def get_data_version(sectors, years):
+    """Versión de los datos de una selección (clave para cachés derivadas)"""
+    frame = get_delta_store().get(tuple(sorted(sectors)), tuple(sorted(years)))
+    return (frame.version, *frame.watermark())
+
+def get_row_watermark(sectors, years):
+    """Marca de las filas (máximo id, última modificación), igual para todas las selecciones"""
+    return get_delta_store().get(tuple(sorted(sectors)), tuple(sorted(years))).watermark()
 
 @st.cache_data(ttl=300)
-def load_data_from_db():
-    """Carga todos los datos de la BD"""
-    conn = get_db_connection()
-    if conn is None:
+def load_filter_options():
+    """Carga solo las listas de sectores y años para los filtros"""
+    try:
+        with get_db_connection() as conn:
+            if conn is None:
+                return None
+            return edv_db.fetch_filter_options(conn)
+    except Exception as e:
+        st.error(f"❌ Error al cargar filtros: {e}")
         return None
+
+def load_filtered_data(sectors, years, groups=()):
+    """Carga solo los registros de los sectores y años seleccionados.
+    
+    La selección se mantiene en memoria y se refresca con deltas (filas nuevas
+    o modificadas) en lugar de recargarla entera. De cada fila solo se leen los
+    grupos de columnas pedidos (`groups`); los que falten se añaden después. En
+    un proceso nuevo se sirve primero desde el snapshot local y se revalida en
+    segundo plano. El DataFrame devuelto es compartido entre sesiones: no
+    modificarlo in situ.
+    """
+    snapshot = get_snapshot_frame()
+    if snapshot is not None:
+        # Versión publicada por otro proceso: se adopta sin consultar MySQL
+        get_shared_dataset().sync(snapshot)
+        if snapshot.is_stale():
+            revalidate_in_background(snapshot, on_change=_save_snapshot)
+    
+    frame = get_delta_store().get(sectors, years)
+    if frame.df is None and snapshot is not None and snapshot.df is not None:
+        snapshot_index = snapshot.attach("index", edv_db.SectorYearIndex.from_frame)
+        frame.seed(snapshot_index.take(snapshot.df, sectors, years), snapshot.watermark())
     
+    if frame.missing_groups(groups):
+        edv_perf.count("grups: miss")
+        try:
+            frame.require_groups(groups, get_db_pool())
+        except Exception as e:
+            st.error(f"❌ Error al cargar columnas: {e}")
+    
+    if frame.df is not None and not frame.validated:
+        edv_perf.count("dades: snapshot")
+        revalidate_in_background(frame)
+        return frame.df
+    if not frame.is_stale():
+        edv_perf.count("dades: hit")
+        return frame.df
+    
+    edv_perf.count("dades: miss")
     try:
-        query = """
-            SELECT 
-                id, sector, codigo_actuacion, nom_actuacio, municipi, any,
-                Codi_Actuacio, Tipus_actuacio, Sol_sistemes, Sol_zones, Total_ambit,
-                Sol_viari, Sostre_zones, edificabilitat_bruta, Sostre_residencial,
-                Nombre_dhabitatges, Hipotesis, E1__Programacio, E2__Adquisicio,
-                E3__Planejament, E4__Projecte_durbanitzacio, E5__Projecte_de_reparcellacio,
-                E6__Execucio_obres, E7__Comercialitzacio, E8__Compte_liquidacio_definitiva,
-                E9__Tancament_darrera_venda, Incasol, Altres_propietaris, Sol_amb_drets,
-                Sol_sense_drets, Titular_Adm__Act_, pct_drets_Adm__Act_, Total_Ingressos,
-                Cessio_Administracio_actuant, despesa_comercialitzacio, Aprofitament_privats,
-                Obres_durbanitzacio, Connexions_i_canons, Indemnitzacions, Gestio,
-                Despesa_a_assumir_Adm__Act_, Despesa_total, Calcul_dinamic_Taxa_aplicada,
-                Calcul_dinamic_Valor_residual_sol, Calcul_dinamic_Valor_unitari,
-                Calcul_dinamic_Temps_mig_retorn, Calcul_estatic_Taxa_aplicada,
-                Calcul_estatic_Valor_residual_sol, Calcul_estatic_Valor_unitari,
-                Calcul_estatic_Temps_mig_retorn
-            FROM edv_fitxes
-            ORDER BY sector, any DESC
-        """
-        df = pd.read_sql(query, conn)
-        conn.close()
-        
-        # Eliminar columnas duplicadas
-        df = df.loc[:, ~df.columns.duplicated()]
-        
-        return df
+        with get_db_connection() as conn:
+            if conn is None:
+                return frame.df
+            with edv_perf.span("load_filtered_data"):
+                frame.refresh(conn)
+        return frame.df
     except Exception as e:
         st.error(f"❌ Error al cargar datos: {e}")
+        return frame.df
+
+@st.cache_resource
+def get_cube_cache():
+    """Cubo sector × any compartido por todas las sesiones del proceso"""
+    return edv_analytics.CubeCache(refresh_seconds=60)
+
+def load_sector_year_cube(df_fallback=None):
+    """Devuelve el cubo sector × any (o uno calculado sobre df_fallback sin BD)"""
+    cache = get_cube_cache()
+    edv_perf.count("cub: miss" if cache.is_stale() else "cub: hit")
+    if cache.is_stale():
+        try:
+            with get_db_connection() as conn:
+                if conn is not None:
+                    cache.refresh(conn)
+        except Exception as e:
+            st.warning(f"⚠️ No s'ha pogut actualitzar el cub d'agregats: {e}")
+    if cache.cube is None and df_fallback is not None:
+        return edv_analytics.SectorYearCube.from_frame(df_fallback)
+    return cache.cube
+
+@st.cache_resource
+def get_export_cache():
+    """Ficheros exportados reutilizables mientras no cambien los datos"""
+    directory = get_app_config("export_dir", os.path.join(tempfile.gettempdir(), "edv_exports"))
+    return edv_export.ExportCache(directory, max_entries=20)
+
+@st.cache_resource
+def get_derived_cache():
+    """Resultados derivados de cada selección (sub-frames, estadísticos), por versión de datos"""
+    return edv_analytics.DerivedFrameCache(max_bytes=int(get_app_config("derived_cache_mb", 256)) * 1024 ** 2,
+                                           max_entries=128)
+
+def derived_frame(sectors, years, name, params, factory):
+    """Devuelve factory() cacheado por (versión de datos, sectores, años, vista, parámetros)"""
+    sectors, years = tuple(sorted(sectors)), tuple(sorted(years))
+    key = (get_data_version(sectors, years), sectors, years, name, params)
+    return get_derived_cache().get_or_compute(key, factory)
+
+@st.cache_resource
+def get_figure_cache():
+    """Figuras Plotly ya construidas, por versión de datos y parámetros de la vista"""
+    return edv_analytics.DerivedFrameCache(max_bytes=int(get_app_config("figure_cache_mb", 64)) * 1024 ** 2,
+                                           max_entries=64, name="figures")
+
+def cached_figure(sectors, years, view, params, factory):
+    """Devuelve la figura de factory() sin reconstruirla si solo cambian widgets ajenos al gráfico"""
+    sectors, years = tuple(sorted(sectors)), tuple(sorted(years))
+    key = (get_data_version(sectors, years), view, sectors, years, params)
+
+    def build():
+        with edv_perf.span("figura"):
+            return factory()
+
+    return get_figure_cache().get_or_compute(key, build)
+
+@st.cache_resource
+def get_perf_history():
+    """Últimos reruns del proceso para los percentiles del panel de rendimiento"""
+    return edv_perf.PerfHistory(maxlen=500)
+
+def log_rerun(recorder):
+    """Cierra el registro del rerun y lo añade al log JSON lines rotativo"""
+    try:
+        logger = edv_perf.get_logger(get_app_config("perf_log", "logs/perf.jsonl"))
+    except OSError:
+        logger = None
+    return edv_perf.finish_rerun(recorder, get_perf_history(), logger)
+
+def load_phase_matrix(sectors, years, df_fallback=None):
+    """Matriz uint8 de fases E1..E9 mantenida junto a la selección cargada.
+    
+    None si faltan columnas de fases (p.ej. falló su carga): ausentes contarían como 0.
+    """
+    frame = get_delta_store().get(tuple(sorted(sectors)), tuple(sorted(years)))
+    df = frame.df if frame.df is not None else df_fallback
+    if df is None or not set(edv_db.PHASE_COLUMNS).issubset(df.columns):
         return None
+    if frame.df is None:
+        return edv_analytics.PhaseMatrix.from_frame(df)
+    return frame.attach("phases", edv_analytics.PhaseMatrix.from_frame)
+
+@st.cache_resource
+def get_monte_carlo_cache():
+    """Resultados Monte Carlo por (ficha, marca de filas, parámetros)"""
+    return edv_valuation.MonteCarloCache(max_entries=200_000)
+
+def select_rows(df, selected_sectors, selected_years, sectors=None, years=None):
+    """Subconjunto (sectors, years) de la selección cargada usando su índice de bloques"""
+    frame = get_delta_store().get(tuple(sorted(selected_sectors)), tuple(sorted(selected_years)))
+    if frame.df is None:
+        return edv_db.filter_frame(df, sectors, years)
+    index = frame.attach("index", edv_db.SectorYearIndex.from_frame)
+    return index.take(df, sectors, years)
+
+def load_covariance_accumulators(sectors, years, columns):
+    """Acumuladores de covarianza mantenidos junto a la selección cargada"""
+    frame = get_delta_store().get(tuple(sorted(sectors)), tuple(sorted(years)))
+    if frame.df is None:
+        return None
+    columns = list(columns)
+    # Uno por frame con todas las columnas candidatas (cada vista elige un subconjunto):
+    # si cambian las columnas se suelta el anterior para que deje de recibir deltas
+    accumulators = frame.derived.get("covariance")
+    if accumulators is not None and accumulators.columns != columns:
+        frame.detach("covariance")
+    return frame.attach("covariance", lambda df: edv_analytics.CovarianceAccumulators.from_frame(df, columns))
+
+def load_analytics_engine(sectors, years):
+    """Motor SQL embebido con la selección cargada (None si analytics_engine = "pandas")"""
+    name = get_app_config("analytics_engine", "pandas")
+    if name == "pandas":
+        return None
+    frame = get_delta_store().get(tuple(sorted(sectors)), tuple(sorted(years)))
+    if frame.df is None:
+        return None
+    threads = get_app_config("analytics_threads", None)
+    key = ("engine", name)
+    # require_groups añade columnas sin pasar por apply_delta: con otras columnas se rehace el motor
+    # (el anterior se suelta; su conexión se cierra cuando ninguna sesión lo usa)
+    engine = frame.derived.get(key)
+    if engine is not None and engine.columns != edv_engine.engine_columns(frame.df):
+        frame.detach(key)
+    return frame.attach(key, lambda df: edv_engine.create_engine(name, df, threads=threads))
+
+# Grupos de columnas que necesita cada vista (los identificadores siempre se cargan)
+NUMERIC_GROUPS = ["info_sector", "propietat", "edv_sector", "calcul"]
+VIEW_GROUPS = {
+    "🏠 Visió General": ["edv_sector"],
+    "📈 Comparar Sectors": NUMERIC_GROUPS,
+    "🔍 Análisi Individual": list(edv_db.COLUMN_GROUPS),
+    "📊 Estadístics": NUMERIC_GROUPS,
+    "🧭 Fases EDV": ["info_edv"],
+    "📐 Escenaris de Taxa": ["propietat", "edv_sector", "calcul"],
+    "📥 Exportar": list(edv_db.COLUMN_GROUPS),
+}
 
 # ============================================================================
 # FUNCIONES AUXILIARES
@@ -200,7 +423,38 @@ def get_numeric_columns(df):
 
 def get_categorical_columns(df):
     """Obtiene las columnas categóricas"""
-    return df.select_dtypes(include=['object']).columns.tolist()
+    return df.select_dtypes(include=['object', 'category']).columns.tolist()
+
+def show_chart(fig):
+    """st.plotly_chart con su tiempo de serialización medido"""
+    with edv_perf.span("plotly_chart"):
+        st.plotly_chart(fig, use_container_width=True)
+
+def show_perf_panel(container, record):
+    """Panel de rendimiento (solo admin): tramos de este rerun, p95 y pool"""
+    with container.expander("⏱️ Rendiment"):
+        st.caption(f"Aquest rerun: **{record['total_ms']:.0f} ms**")
+        spans = pd.DataFrame([{"Tram": name, "Crides": values["calls"], "ms": values["ms"]}
+                              for name, values in record["spans"].items()])
+        if not spans.empty:
+            st.dataframe(spans.sort_values("ms", ascending=False), hide_index=True, use_container_width=True)
+        
+        if record["counters"]:
+            st.caption("Memòria cau: " + " · ".join(f"{name} = {n}" for name, n in sorted(record["counters"].items())))
+        
+        percentiles = get_perf_history().percentiles()
+        if percentiles:
+            st.caption("Darrers reruns del procés")
+            history = pd.DataFrame.from_dict(percentiles, orient="index").round(1)
+            st.dataframe(history.sort_values("p95_ms", ascending=False), use_container_width=True)
+        
+        derived = get_derived_cache().stats()
+        st.caption(f"Frames derivats: {derived['entries']} entrades · {derived['bytes'] / 1024 ** 2:.1f} MB")
+        
+        try:
+            st.caption("Pool de connexions: " + " · ".join(f"{k} = {v}" for k, v in get_db_pool().stats().items()))
+        except Exception:
+            pass
 
 def safe_show_dataframe(df, height=300):
     """Muestra DataFrame de forma segura"""
@@ -208,35 +462,121 @@ def safe_show_dataframe(df, height=300):
         st.dataframe(df, use_container_width=True, height=height)
     except Exception as e:
         st.warning(f"Error mostrando tabla: {e}")
-        st.write(df)
+        st.write(df.head(edv_db.PAGE_SIZE))
+
+PAGE_SIZES = [25, 50, 100, 250]
+NATURAL_ORDER = "(sector, any)"
+
+def paginated_table(key, columns, df=None, sectors=None, years=None, default_columns=None, order_key=None):
+    """Taula paginada per keyset sobre (sector, any, id).
+    
+    Les pàgines surten del frame en memòria (df) o, si no hi és o li falten
+    columnes, de MySQL amb els filtres sectors/years. Només es renderitzen les
+    files de la pàgina. `order_key` identifica el contingut de df per reaprofitar
+    l'ordenació entre reruns.
+    """
+    col1, col2, col3, col4 = st.columns([4, 2, 1, 1])
+    with col1:
+        shown = st.multiselect("Columnes:", columns, default=default_columns or columns[:10], key=f"{key}_columns")
+    with col2:
+        sort_choice = st.selectbox("Ordenar per:", [NATURAL_ORDER] + columns, key=f"{key}_sort")
+    with col3:
+        descending = st.checkbox("Descendent", key=f"{key}_desc", disabled=sort_choice == NATURAL_ORDER)
+    with col4:
+        page_size = st.selectbox("Files:", PAGE_SIZES, index=1, key=f"{key}_size")
+    
+    # Con df solo se ordena por sus columnas; sin él, por columnas de edv_fitxes (irán al ORDER BY)
+    keys = edv_db.page_keys(None if sort_choice == NATURAL_ORDER else sort_choice, descending,
+                            allowed=edv_db.EDV_COLUMNS if df is None else columns)
+    from_frame = df is not None and set(shown) <= set(df.columns)
+    
+    # Los cursores (última clave de cada página vista) se reinician al cambiar orden, tamaño o datos
+    signature = (tuple(keys), page_size, order_key, from_frame)
+    state = st.session_state.get(f"{key}_pages")
+    if state is None or state["signature"] != signature:
+        state = {"signature": signature, "cursors": [None]}
+        st.session_state[f"{key}_pages"] = state
+    after = state["cursors"][-1]
+    
+    with perf.span("taula paginada"):
+        if from_frame:
+            order = None
+            if order_key is not None:
+                order = derived_frame(sectors or [], years or [], ("ordre", key, order_key), tuple(keys),
+                                      lambda: edv_db.keyset_order(df, keys))
+            page, next_cursor = edv_db.page_from_frame(df, keys, after, page_size, order=order)
+        else:
+            with get_db_connection() as conn:
+                if conn is None:
+                    return
+                page, next_cursor = edv_db.read_page(conn, shown, sectors, years, keys, after, page_size,
+                                                     float_dtype=get_app_config("float_dtype", "float64"))
+    
+    st.dataframe(page[shown], use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        if st.button("◀️ Anterior", key=f"{key}_prev", disabled=len(state["cursors"]) == 1):
+            state["cursors"].pop()
+            st.rerun()
+    with col2:
+        if st.button("Següent ▶️", key=f"{key}_next", disabled=next_cursor is None):
+            state["cursors"].append(next_cursor)
+            st.rerun()
+    with col3:
+        st.caption(f"Pàgina {len(state['cursors'])} · {len(page)} files")
 
 def insert_new_record(data):
     """Inserta un nuevo registro en la BD"""
-    conn = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            return False, "❌ No se pudo conectar a la BD"
-        
-        cursor = conn.cursor()
-        
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(['%s'] * len(data))
-        values = tuple(data.values())
-        
-        query = f"INSERT INTO edv_fitxes ({columns}) VALUES ({placeholders})"
-        
-        cursor.execute(query, values)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            if conn is None:
+                return False, "❌ No se pudo conectar a la BD"
+            
+            cursor = conn.cursor()
+            
+            columns = ', '.join(data.keys())
+            placeholders = ', '.join(['%s'] * len(data))
+            values = tuple(data.values())
+            
+            query = f"INSERT INTO edv_fitxes ({columns}) VALUES ({placeholders})"
+            
+            cursor.execute(query, values)
+            conn.commit()
+            cursor.close()
         
         return True, "✅ Registro insertado correctamente"
     except Exception as e:
-        if conn:
-            conn.close()
         return False, f"❌ Error al insertar: {str(e)}"
 
+def upsert_new_records(records):
+    """Inserta o actualiza un lote de registros en una sola transacción"""
+    try:
+        with get_db_connection() as conn:
+            if conn is None:
+                return False, "❌ No se pudo conectar a la BD"
+            affected = edv_db.upsert_records(conn, records)
+        
+        return True, f"✅ Lote guardado: {len(records)} registros ({affected} filas afectadas)"
+    except Exception as e:
+        return False, f"❌ Error al guardar el lote (no se ha guardado ningún registro): {str(e)}"
+
+# Columnas de la graella d'entrada per lots (mismas que el formulario)
+GRID_TEXT_COLUMNS = ['sector', 'codigo_actuacion', 'nom_actuacio', 'municipi', 'Codi_Actuacio',
+                     'Tipus_actuacio', 'Hipotesis', 'Titular_Adm__Act_']
+GRID_NUMERIC_COLUMNS = ['any', 'Sol_sistemes', 'Sol_zones', 'Total_ambit', 'Sol_viari', 'Sostre_zones',
+                        'edificabilitat_bruta', 'Sostre_residencial', 'Nombre_dhabitatges',
+                        'Total_Ingressos', 'Cessio_Administracio_actuant', 'despesa_comercialitzacio',
+                        'Aprofitament_privats', 'Obres_durbanitzacio', 'Connexions_i_canons',
+                        'Indemnitzacions', 'Gestio', 'Despesa_total']
+
+def bulk_entry_template(rows=5):
+    """Graella buida per introduir diversos registres"""
+    template = pd.DataFrame({column: pd.Series([None] * rows, dtype='object') for column in GRID_TEXT_COLUMNS})
+    for column in GRID_NUMERIC_COLUMNS:
+        template[column] = pd.Series([np.nan] * rows, dtype='float64')
+    return template
+
 # ============================================================================
 # INTERFAZ PRINCIPAL
 # ============================================================================
@@ -250,6 +590,9 @@ if not is_logged_in():
     login_page()
     st.stop()
 
+# Registro de tiempos de este rerun (panel de rendimiento y logs/perf.jsonl)
+perf = edv_perf.start_rerun(user=st.session_state.username)
+
 # ============================================================================
 # INTERFAZ PRINCIPAL (USUARIO LOGUEADO)
 # ============================================================================
@@ -271,6 +614,9 @@ with st.sidebar:
         else:
             st.markdown('<span class="admin-badge" style="background-color: #2196F3;">USER</span>', unsafe_allow_html=True)
     
+    # Se rellena al final del rerun, cuando ya se conocen todos los tiempos
+    perf_panel = st.container() if is_admin() else None
+    
     st.divider()
     
     # Botón cerrar sesión
@@ -280,10 +626,18 @@ with st.sidebar:
         st.session_state.user_role = None
         st.rerun()
 
-# Cargar datos
-df = load_data_from_db()
+# Cargar solo las opciones de filtro; los registros se cargan ya filtrados
+with perf.span("load_filter_options"):
+    filter_options = load_filter_options()
+
+if filter_options is None:
+    # BD no disponible: se trabaja con el snapshot local si existe
+    snapshot = get_snapshot_frame()
+    if snapshot is not None and snapshot.df is not None:
+        filter_options = edv_db.filter_options_from_frame(snapshot.df)
+        st.warning("⚠️ Sense connexió a la base de dades: es mostren les dades del darrer snapshot local")
 
-if df is None or df.empty:
+if filter_options is None or not filter_options["sectors"]:
     st.error("❌ No s'han pogut caregar les dades de la base de dades")
 else:
     # ========================================================================
@@ -294,14 +648,15 @@ else:
         
         # Opciones según rol
         if is_admin():
-            view_options = ["🏠 Visió General", "📈 Comparar Sectors", "🔍 Análisi Individual", "📊 Estadístics", "📥 Exportar", "➕ Afegir Registre"]
+            view_options = ["🏠 Visió General", "📈 Comparar Sectors", "🔍 Análisi Individual", "📊 Estadístics", "🧭 Fases EDV", "📐 Escenaris de Taxa", "📥 Exportar", "➕ Afegir Registre"]
         else:
-            view_options = ["🏠 Visió General", "📈 Comparar Sectors", "🔍 Análisi Individual", "📊 Estadístics", "📥 Exportar"]
+            view_options = ["🏠 Visió General", "📈 Comparar Sectors", "🔍 Análisi Individual", "📊 Estadístics", "🧭 Fases EDV", "📐 Escenaris de Taxa", "📥 Exportar"]
         
         view_mode = st.radio(
             "Mode de visualització:",
             view_options
         )
+        perf.meta["view_mode"] = view_mode
         
         st.divider()
         
@@ -309,26 +664,39 @@ else:
         if view_mode != "➕ Afegir Registre":
             st.subheader("Filtres")
             
-            all_sectors = sorted(df['sector'].unique().tolist())
+            all_sectors = filter_options["sectors"]
             selected_sectors = st.multiselect(
                 "Selecciona sectors:",
                 all_sectors,
                 default=all_sectors[:3] if len(all_sectors) >= 3 else all_sectors
             )
             
-            all_years = sorted(df['any'].unique().tolist())
+            all_years = filter_options["years"]
             selected_years = st.multiselect(
                 "Selecciona anys:",
                 all_years,
                 default=all_years
             )
             
-            df_filtered = df[
-                (df['sector'].isin(selected_sectors)) &
-                (df['any'].isin(selected_years))
-            ].copy()
+            # Filtrado en SQL (WHERE sector IN ... AND any IN ...)
+            with perf.span("filtres"):
+                df_filtered = load_filtered_data(tuple(sorted(selected_sectors)), tuple(sorted(selected_years)),
+                                                 VIEW_GROUPS[view_mode])
+            if df_filtered is None:
+                st.stop()
             
             st.info(f"📍 Registres seleccionats: **{len(df_filtered)}**")
+            
+            if is_admin():
+                frame = get_delta_store().get(tuple(sorted(selected_sectors)), tuple(sorted(selected_years)))
+                if frame.memory_report is not None:
+                    with st.expander("🧠 Memòria del dataset"):
+                        report = frame.memory_report
+                        st.caption(f"Abans: {report['bytes_abans'].sum() / 1024:.1f} KB · "
+                                   f"Ara: {report['bytes_despres'].sum() / 1024:.1f} KB")
+                        safe_show_dataframe(report[report['estalvi'] != 0], height=250)
+    
+    view_started = time.perf_counter()
     
     # ========================================================================
     # MODE 1: VISIÓ GENERAL
@@ -354,14 +722,14 @@ else:
         
         st.subheader("Dades per Sector")
         
-        summary_table = df_filtered.groupby('sector').agg({
-            'codigo_actuacion': 'count',
-            'any': ['min', 'max'],
-            'Total_Ingressos': 'mean',
-            'Despesa_total': 'mean'
-        }).round(2)
-        
-        summary_table.columns = ['Registres', 'Any Min', 'Any Max', 'Ingressos Mitjans', 'Despesa Mitjana']
+        # Roll-up de las celdas (sector, any) del cubo en lugar de agrupar las filas
+        with perf.span("agregació"):
+            engine = load_analytics_engine(selected_sectors, selected_years)
+            if engine is not None:
+                summary_table = engine.sector_summary().round(2)
+            else:
+                cube = load_sector_year_cube(df_filtered)
+                summary_table = cube.sector_summary(selected_sectors, selected_years).round(2)
         safe_show_dataframe(summary_table)
     
     # ========================================================================
@@ -389,29 +757,55 @@ else:
             )
         
         if selected_vars and len(df_filtered) > 0:
-            agg_data = df_filtered.groupby('sector')[selected_vars].mean().round(2)
-            
-            if chart_type == "Barres":
-                fig = px.bar(agg_data.reset_index(), x='sector', y=selected_vars,
-                            title="Comparació de Variables per Sector", barmode='group',
-                            labels={'value': 'Valor', 'sector': 'Sector'})
-            elif chart_type == "Línies":
-                df_long = agg_data.reset_index().melt(id_vars='sector', var_name='Variable', value_name='Valor')
-                fig = px.line(df_long, x='sector', y='Valor', color='Variable',
-                             title="Evolució de Variables per Sector", markers=True)
-            elif chart_type == "Caixa":
-                df_plot = df_filtered[['sector'] + selected_vars].copy()
-                df_long = df_plot.melt(id_vars='sector', value_vars=selected_vars, var_name='Variable', value_name='Valor')
-                fig = px.box(df_long, x='Variable', y='Valor', color='sector',
-                            title="Distribució de Variables per Sector")
-            elif chart_type == "Radar":
-                fig = go.Figure()
-                for sector in agg_data.index:
-                    fig.add_trace(go.Scatterpolar(r=agg_data.loc[sector].values, theta=selected_vars,
-                                                   fill='toself', name=sector))
-                fig.update_layout(title="Comparació Radar de Sectors")
-            
-            st.plotly_chart(fig, use_container_width=True)
+            def aggregate():
+                engine = load_analytics_engine(selected_sectors, selected_years)
+                if engine is not None:
+                    return engine.means(selected_vars).round(2)
+                cube = load_sector_year_cube(df_filtered)
+                return cube.means(selected_sectors, selected_years, selected_vars).round(2)
+            
+            with perf.span("agregació"):
+                agg_data = derived_frame(selected_sectors, selected_years, "comparar", tuple(selected_vars), aggregate)
+            
+            # La figura depende solo de datos, variables y tipus: "Mostrar taula" no la reconstruye
+            def build_figure():
+                if chart_type == "Barres":
+                    fig = px.bar(agg_data.reset_index(), x='sector', y=selected_vars,
+                                title="Comparació de Variables per Sector", barmode='group',
+                                labels={'value': 'Valor', 'sector': 'Sector'})
+                elif chart_type == "Línies":
+                    df_long = agg_data.reset_index().melt(id_vars='sector', var_name='Variable', value_name='Valor')
+                    fig = px.line(df_long, x='sector', y='Valor', color='Variable',
+                                 title="Evolució de Variables per Sector", markers=True)
+                elif chart_type == "Caixa":
+                    # Cuartiles y outliers calculados aquí: a Plotly solo le llegan los resúmenes
+                    box_stats, box_outliers = edv_analytics.box_statistics(df_filtered, selected_vars)
+                    palette = px.colors.qualitative.Plotly
+                    fig = go.Figure()
+                    for i, (sector, stats) in enumerate(box_stats.groupby('sector')):
+                        color = palette[i % len(palette)]
+                        fig.add_trace(go.Box(x=stats['Variable'], q1=stats['q1'], median=stats['median'], q3=stats['q3'],
+                                             lowerfence=stats['lowerfence'], upperfence=stats['upperfence'],
+                                             mean=stats['mean'], name=sector, legendgroup=sector, offsetgroup=sector,
+                                             marker_color=color, boxpoints=False))
+                        points = box_outliers[box_outliers['sector'] == sector]
+                        if not points.empty:
+                            fig.add_trace(go.Scatter(x=points['Variable'], y=points['Valor'], mode='markers',
+                                                     name=sector, legendgroup=sector, offsetgroup=sector,
+                                                     marker_color=color, showlegend=False))
+                    fig.update_layout(title="Distribució de Variables per Sector", boxmode='group', scattermode='group',
+                                      xaxis_title='Variable', yaxis_title='Valor')
+                elif chart_type == "Radar":
+                    fig = go.Figure()
+                    for sector in agg_data.index:
+                        fig.add_trace(go.Scatterpolar(r=agg_data.loc[sector].values, theta=selected_vars,
+                                                       fill='toself', name=sector))
+                    fig.update_layout(title="Comparació Radar de Sectors")
+                return fig
+            
+            fig = cached_figure(selected_sectors, selected_years, view_mode,
+                                (tuple(selected_vars), chart_type), build_figure)
+            show_chart(fig)
             
             if st.checkbox("Mostrar taula de dades"):
                 safe_show_dataframe(agg_data)
@@ -432,7 +826,10 @@ else:
         with col2:
             metric_type = st.selectbox("Estadístics:", ["Mitjana", "Màxim", "Mínim"])
         
-        sector_data = df_filtered[df_filtered['sector'] == selected_sector].copy()
+        # Sub-frames compartidos entre reruns (solo lectura): sin .copy()
+        sector_data = derived_frame(selected_sectors, selected_years, "sector", selected_sector,
+                                    lambda: select_rows(df_filtered, selected_sectors, selected_years,
+                                                        sectors=[selected_sector]))
         
         if not sector_data.empty:
             st.subheader(f"Informació del Sector: {selected_sector}")
@@ -449,17 +846,12 @@ else:
             
             st.subheader("Evolució Temporal")
             
-            numeric_cols = get_numeric_columns(sector_data)
-            numeric_cols = [col for col in numeric_cols if col != 'id']
-            
-            temporal_df = sector_data[['any', 'Hipotesis'] + numeric_cols].copy()
-            temporal_df = temporal_df.reset_index(drop=True)
-            temporal_df = temporal_df.loc[:, ~temporal_df.columns.duplicated()]
-            
-            if 'any' in temporal_df.columns:
-                temporal_df = temporal_df.sort_values('any', ascending=False)
-            
-            safe_show_dataframe(temporal_df)
+            # Paginada: solo se renderizan las filas de la página y las columnas elegidas
+            numeric_cols = [col for col in dict.fromkeys(get_numeric_columns(sector_data)) if col != 'id']
+            temporal_columns = ['any', 'Hipotesis'] + [col for col in numeric_cols if col != 'any']
+            paginated_table("temporal", temporal_columns, df=sector_data,
+                            sectors=[selected_sector], years=selected_years,
+                            default_columns=temporal_columns[:8], order_key=("sector", selected_sector))
             
             st.subheader("Gràfic d'Evolució")
             
@@ -467,10 +859,12 @@ else:
             available_metrics = [m for m in key_metrics if m in sector_data.columns]
             
             if available_metrics:
-                fig = px.line(sector_data.sort_values('any'), x='any', y=available_metrics,
-                             title=f"Evolució de Métriques - {selected_sector}", markers=True,
-                             labels={'value': 'Valor', 'any': 'Any', 'variable': 'Variable'})
-                st.plotly_chart(fig, use_container_width=True)
+                fig = cached_figure(selected_sectors, selected_years, view_mode,
+                                    (selected_sector, tuple(available_metrics)),
+                                    lambda: px.line(sector_data.sort_values('any'), x='any', y=available_metrics,
+                                                    title=f"Evolució de Métriques - {selected_sector}", markers=True,
+                                                    labels={'value': 'Valor', 'any': 'Any', 'variable': 'Variable'}))
+                show_chart(fig)
         else:
             st.warning("No hi ha dades per aquest sector")
     
@@ -484,8 +878,7 @@ else:
         
         with tab1:
             st.subheader("Estadístics Descriptius")
-            numeric_data = df_filtered[get_numeric_columns(df_filtered)].drop('id', axis=1)
-            numeric_data = numeric_data.loc[:, ~numeric_data.columns.duplicated()]
+            numeric_columns = [col for col in dict.fromkeys(get_numeric_columns(df_filtered)) if col != 'id']
             
             col1, col2 = st.columns([1, 2])
             with col1:
@@ -493,38 +886,229 @@ else:
             with col2:
                 st.info("Estadístics de les variables numèriques seleccionades")
             
-            if stat_type == "describe":
-                stats_df = numeric_data.describe().round(2)
-            else:
-                stats_df = getattr(numeric_data, stat_type)().round(2).to_frame(name='Valor')
+            engine = load_analytics_engine(selected_sectors, selected_years)
+            
+            def build_stats():
+                if engine is not None:
+                    if stat_type == "describe":
+                        return engine.describe(numeric_columns).round(2)
+                    return engine.aggregate(numeric_columns, stat_type).round(2).to_frame(name='Valor')
+                numeric_data = df_filtered[numeric_columns]
+                if stat_type == "describe":
+                    return numeric_data.describe().round(2)
+                return getattr(numeric_data, stat_type)().round(2).to_frame(name='Valor')
+            
+            with perf.span("estadístics"):
+                stats_df = derived_frame(selected_sectors, selected_years, "estadístics",
+                                         (stat_type, engine.name if engine is not None else "pandas"), build_stats)
             
             safe_show_dataframe(stats_df)
         
         with tab2:
             st.subheader("Matriu de Correlacions")
-            numeric_data = df_filtered[get_numeric_columns(df_filtered)].drop('id', axis=1)
-            numeric_data = numeric_data.loc[:, ~numeric_data.columns.duplicated()]
+            corr_columns = [col for col in get_numeric_columns(df_filtered) if col != 'id']
             
-            corr_vars = st.multiselect("Selecciona variables:", numeric_data.columns.tolist(),
-                                      default=numeric_data.columns.tolist()[:10])
+            all_vars = st.checkbox("Totes les variables")
+            corr_vars = st.multiselect("Selecciona variables:", corr_columns,
+                                      default=corr_columns if all_vars else corr_columns[:10])
             
             if corr_vars:
-                corr_matrix = numeric_data[corr_vars].corr()
+                # Correlaciones a partir de sumas acumuladas por (sector, any), no de las filas
+                with perf.span("correlacions"):
+                    engine = load_analytics_engine(selected_sectors, selected_years)
+                    accumulators = None
+                    if engine is None:
+                        accumulators = load_covariance_accumulators(selected_sectors, selected_years, corr_columns)
+                    if engine is not None:
+                        corr_matrix = engine.correlation(corr_vars)
+                    elif accumulators is not None:
+                        corr_matrix = accumulators.correlation(corr_vars)
+                    else:
+                        corr_matrix = df_filtered[corr_vars].corr()
                 fig = px.imshow(corr_matrix, title="Correlacions entre Variables",
-                               labels=dict(color="Correlació"), color_continuous_scale='RdBu', zmin=-1, zmax=1)
-                st.plotly_chart(fig, use_container_width=True)
+                               labels=dict(color="Correlació"), color_continuous_scale='RdBu', zmin=-1, zmax=1,
+                               height=max(450, 22 * len(corr_vars)))
+                show_chart(fig)
         
         with tab3:
             st.subheader("Distribucions de Variables")
             selected_var = st.selectbox("Selecciona una variable:", get_numeric_columns(df_filtered))
             
             if selected_var != 'id':
-                fig = px.histogram(df_filtered, x=selected_var, color='sector', nbins=30,
-                                  title=f"Distribució de {selected_var}", barmode='overlay')
-                st.plotly_chart(fig, use_container_width=True)
+                # Conteos por intervalo calculados con NumPy: sectors × 30 barras en lugar de cada fila
+                with perf.span("histograma"):
+                    engine = load_analytics_engine(selected_sectors, selected_years)
+                    if engine is not None:
+                        bins = engine.histogram(selected_var, nbins=30)
+                    else:
+                        bins = edv_analytics.histogram_by_group(df_filtered, selected_var, nbins=30)
+                fig = px.bar(bins, x='bin_center', y='count', color='sector', barmode='overlay', opacity=0.6,
+                            title=f"Distribució de {selected_var}",
+                            hover_data={'bin_start': True, 'bin_end': True, 'bin_center': False},
+                            labels={'bin_center': selected_var, 'count': 'count'})
+                if not bins.empty:
+                    fig.update_traces(width=float(bins['bin_end'].iloc[0] - bins['bin_start'].iloc[0]))
+                fig.update_layout(bargap=0)
+                show_chart(fig)
     
     # ========================================================================
-    # MODE 5: EXPORTAR
+    # MODE 5: FASES EDV
+    # ========================================================================
+    elif view_mode == "🧭 Fases EDV":
+        st.subheader("Avanç de les Fases E1–E9")
+        
+        phases = load_phase_matrix(selected_sectors, selected_years, df_filtered)
+        if phases is None:
+            st.error("❌ No s'han pogut carregar les columnes de fases (E1–E9)")
+        else:
+            tab1, tab2 = st.tabs(["Embut per fases", "Temps per fase"])
+            
+            with tab1:
+                with perf.span("fases: embut"):
+                    funnel = phases.funnel(by=("sector",))
+                stage = st.radio("Comptar:", ["Completades (Fet)", "Arribades (Actiu o Fet)"], horizontal=True)
+                value_column = "completades" if stage.startswith("Completades") else "arribades"
+                
+                fig = px.funnel(funnel, x=value_column, y='fase', color='sector',
+                               title="Fitxes per fase i sector", labels={'fase': 'Fase', value_column: 'Fitxes'})
+                show_chart(fig)
+                
+                st.subheader("Evolució per Any")
+                funnel_sector = st.selectbox("Sector:", sorted(df_filtered['sector'].unique()))
+                with perf.span("fases: embut per any"):
+                    by_year = phases.funnel(sectors=[funnel_sector], by=("any",))
+                by_year["percentatge"] = 100 * by_year[value_column] / by_year["fitxes"]
+                heatmap = by_year.pivot(index='fase', columns='any', values='percentatge').reindex(edv_analytics.PHASE_LABELS)
+                fig = px.imshow(heatmap, title=f"% de fitxes {value_column} - {funnel_sector}",
+                               labels=dict(x="Any", y="Fase", color="%"), color_continuous_scale='Blues',
+                               zmin=0, zmax=100, aspect='auto')
+                show_chart(fig)
+            
+            with tab2:
+                st.caption("Anys entre EDV successius d'una mateixa actuació en què cada fase consta com a Activa")
+                with perf.span("fases: durada"):
+                    durations = phases.phase_durations()
+                    duration_summary = phases.duration_summary()
+                
+                if not duration_summary.empty:
+                    summary_long = duration_summary.reset_index().melt(id_vars='sector', var_name='Fase', value_name='Anys')
+                    fig = px.bar(summary_long, x='Fase', y='Anys', color='sector', barmode='group',
+                                title="Anys mitjans en cada fase per sector")
+                    show_chart(fig)
+                    safe_show_dataframe(duration_summary.round(2))
+                    
+                    st.subheader("Detall per Actuació")
+                    safe_show_dataframe(durations.round(2))
+                else:
+                    st.warning("No hi ha dades de fases per a la selecció")
+    
+    # ========================================================================
+    # MODE 6: ESCENARIS DE TAXA
+    # ========================================================================
+    elif view_mode == "📐 Escenaris de Taxa":
+        st.subheader("Escenaris de Taxa de Descompte")
+        
+        method_label = st.radio("Càlcul:", ["Dinàmic", "Estàtic"], horizontal=True)
+        method = "dinamic" if method_label == "Dinàmic" else "estatic"
+        
+        tab1, tab2 = st.tabs(["Corbes per taxa", "Sensibilitat (Monte Carlo)"])
+        
+        with tab1:
+            st.caption("Recàlcul del valor residual del sòl, el valor unitari i el temps mig de retorn "
+                       "de totes les fitxes seleccionades per a cada taxa")
+            
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                rate_range = st.slider("Rang de taxes (%):", 0.0, 20.0, (2.0, 12.0), step=0.5)
+            with col2:
+                rate_step = st.selectbox("Pas (%):", [0.25, 0.5, 1.0], index=1)
+            
+            rates = tuple(np.round(np.arange(rate_range[0], rate_range[1] + rate_step / 2, rate_step) / 100, 6))
+            
+            if rates and len(df_filtered) > 0:
+                # Toda la rejilla en una operación vectorizada, cacheada por (datos, selección, rejilla)
+                with perf.span("escenaris"):
+                    scenarios = derived_frame(selected_sectors, selected_years, "escenaris", rates,
+                                              lambda: edv_valuation.RateScenarios.from_frame(df_filtered, rates))
+                    curves = scenarios.sector_curves(method)
+                
+                metric = st.selectbox("Mètrica:", ["VRS Mitjà", "VRS Total", "Valor Unitari Mitjà", "% VRS Negatiu"])
+                fig = px.line(curves, x='taxa', y=metric, color='sector', markers=True,
+                             title=f"{metric} per taxa ({method_label.lower()})",
+                             labels={'taxa': 'Taxa', 'sector': 'Sector'})
+                fig.update_xaxes(tickformat='.1%')
+                if metric != "% VRS Negatiu":
+                    fig.add_hline(y=0, line_dash='dash', line_color='gray')
+                show_chart(fig)
+                
+                st.subheader("Detall per Fitxa")
+                selected_rate = st.select_slider("Taxa:", options=list(scenarios.rates),
+                                                 value=scenarios.rates[scenarios.rate_position(0.06)],
+                                                 format_func=lambda rate: f"{rate:.2%}")
+                fitxes = scenarios.fitxes_at(selected_rate, method)
+                fitxes = fitxes.round(2).assign(**{"Taxa guardada": fitxes["Taxa guardada"], "Taxa": fitxes["Taxa"]})
+                paginated_table("escenaris", list(fitxes.columns), df=fitxes)
+            else:
+                st.warning("No hi ha dades o taxes per calcular")
+        
+        with tab2:
+            st.caption("Probabilitat que el valor residual del sòl sigui negatiu pertorbant ingressos, "
+                       "costos i taxa (desviació típica relativa dels imports i absoluta de la taxa)")
+            
+            mc_params = {}
+            param_cols = st.columns(3)
+            for i, (name, default) in enumerate(edv_valuation.MC_DEFAULT_PARAMS.items()):
+                with param_cols[i % 3]:
+                    mc_params[name] = st.number_input(f"σ {name} (%)", 0.0, 100.0, default * 100, step=1.0) / 100
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                n_sims = st.selectbox("Simulacions per fitxa:", [500, 1000, 5000], index=1)
+            with col2:
+                mc_seed = int(st.number_input("Llavor:", 0, 2 ** 31 - 1, 0, step=1))
+            
+            mc_cache = get_monte_carlo_cache()
+            # Cada ficha solo depende de su fila: la clave es (id, marca de filas, parámetros),
+            # así otra selección o un refresco sin cambios reutilizan lo ya simulado
+            data_version = get_row_watermark(selected_sectors, selected_years)
+            params_key = edv_valuation.MonteCarloCache.params_key(mc_params, n_sims, mc_seed, method)
+            mc_results, pending = mc_cache.lookup(df_filtered['id'], data_version, params_key)
+            
+            if pending:
+                st.info(f"Fitxes pendents de simular: **{len(pending)}** (ja calculades: {len(mc_results)})")
+            if pending and st.button("▶️ Executar simulació", use_container_width=True):
+                progress = st.progress(0.0)
+                partial = st.empty()
+                pending_rows = df_filtered[df_filtered['id'].isin(pending)]
+                n_sectors = pending_rows['sector'].nunique()
+                parts = [mc_results] if not mc_results.empty else []
+                # Cada sector se simula en un proceso; la tabla se actualiza según terminan
+                with perf.span("monte carlo"):
+                    for done, (sector, result) in enumerate(edv_valuation.iter_monte_carlo(
+                            pending_rows, mc_params, n_sims=n_sims, seed=mc_seed, method=method), start=1):
+                        mc_cache.store(result, data_version, params_key)
+                        parts.append(result)
+                        progress.progress(done / n_sectors, text=f"{done}/{n_sectors} sectors")
+                        partial.dataframe(edv_valuation.monte_carlo_summary(pd.concat(parts)).round(3),
+                                          use_container_width=True)
+                mc_results = pd.concat(parts, ignore_index=True)
+                pending = []
+                partial.empty()
+            
+            if not mc_results.empty and not pending:
+                summary = edv_valuation.monte_carlo_summary(mc_results)
+                fig = px.bar(summary.reset_index(), x='sector', y='P(VRS<0) Mitjana',
+                            title="Probabilitat mitjana de VRS negatiu per sector",
+                            labels={'sector': 'Sector'})
+                fig.update_yaxes(tickformat='.0%')
+                show_chart(fig)
+                safe_show_dataframe(summary.round(3))
+                
+                st.subheader("Detall per Fitxa")
+                paginated_table("monte_carlo", list(mc_results.columns), df=mc_results.round(3))
+    
+    # ========================================================================
+    # MODE 7: EXPORTAR
     # ========================================================================
     elif view_mode == "📥 Exportar":
         st.subheader("Exportar Dades")
@@ -532,36 +1116,43 @@ else:
         col1, col2 = st.columns([1, 1])
         
         with col1:
-            export_format = st.selectbox("Format:", ["CSV", "Excel"])
+            export_format = st.selectbox("Format:", edv_export.available_formats())
         
         with col2:
             include_sectors = st.multiselect("Sectors a exportar:", sorted(df_filtered['sector'].unique()),
                                             default=sorted(df_filtered['sector'].unique()))
         
-        export_data = df_filtered[df_filtered['sector'].isin(include_sectors)]
+        export_data = select_rows(df_filtered, selected_sectors, selected_years, sectors=include_sectors)
         
         if not export_data.empty:
-            if export_format == "CSV":
-                csv = export_data.to_csv(index=False)
-                st.download_button(label="📥 Descarregar CSV", data=csv,
-                                  file_name=f"edv_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                  mime="text/csv")
-            
-            elif export_format == "Excel":
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                    export_data.to_excel(writer, index=False, sheet_name='EDV Data')
-                buffer.seek(0)
-                st.download_button(label="📥 Descarregar Excel", data=buffer.getvalue(),
-                                  file_name=f"edv_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                  mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            # El fichero se genera por bloques en disco y se reutiliza para la misma selección
+            with perf.span(f"exportar {export_format}"):
+                export_path, reused = get_export_cache().get_or_build(
+                    export_data, export_format,
+                    sectors=sorted(selected_sectors), years=sorted(selected_years),
+                    include_sectors=sorted(include_sectors),
+                    data_version=get_data_version(selected_sectors, selected_years),
+                )
+            perf.count("exportació: hit" if reused else "exportació: miss")
+            export_info = edv_export.EXPORT_FORMATS[export_format]
+            
+            with open(export_path, "rb") as export_file:
+                st.download_button(label=f"📥 Descarregar {export_format}", data=export_file,
+                                  file_name=f"edv_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_info['extension']}",
+                                  mime=export_info['mime'])
             
+            if reused:
+                st.caption("♻️ Fitxer reutilitzat (mateixa selecció i mateixes dades)")
             st.info(f"Registres a exportar: **{len(export_data)}**")
+            
+            # Vista prèvia paginada a MySQL (keyset): totes les columnes sense passar la taula al navegador
+            st.subheader("Vista prèvia")
+            paginated_table("exportar", list(edv_db.EDV_COLUMNS), sectors=include_sectors, years=selected_years)
         else:
             st.warning("No hi ha dades per exportar amb els filtres actuals")
     
     # ========================================================================
-    # MODE 6: AFEGIR REGISTRE (SOLO ADMINS)
+    # MODE 8: AFEGIR REGISTRE (SOLO ADMINS)
     # ========================================================================
     elif view_mode == "➕ Afegir Registre":
         if not is_admin():
@@ -571,121 +1162,170 @@ else:
             st.subheader("➕ Afegir Nou Registre EDV")
             st.info("📝 Solo administradores pueden crear nuevos registros")
             
-            with st.form("form_afegir_registre"):
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    sector = st.selectbox("Sector *", [""] + sorted(df['sector'].unique()))
-                    codigo_actuacion = st.text_input("Código Actuación *")
-                    nom_actuacio = st.text_input("Nom Actuació *")
-                
-                with col2:
-                    municipi = st.text_input("Municipi *")
-                    any = st.number_input("Any *", min_value=2000, max_value=2050, value=datetime.now().year)
-                    codi_actuacio = st.text_input("Codi Actuació")
-                
-                with col3:
-                    tipus_actuacio = st.selectbox("Tipus Actuació", ["", "Residencial", "Comercial", "Industrial", "Mixta", "Altres"])
-                    hipotesis = st.selectbox("Hipòtesis", ["", "Per adquisició", "Per Planejament", "Per a PR", "Per a obres", "Altres"])
-                    titular = st.selectbox("Titular Adm. Act.", ["", "Incasòl", "Consorci", "Altres"])
-                
-                st.subheader("📐 Dades Físiques")
-                fcol1, fcol2, fcol3, fcol4 = st.columns(4)
-                
-                with fcol1:
-                    sol_sistemes = st.number_input("Sòl Sistemes", value=0.0, format="%.2f")
-                    sol_zones = st.number_input("Sòl Zones", value=0.0, format="%.2f")
-                
-                with fcol2:
-                    total_ambit = st.number_input("Total Àmbit", value=0.0, format="%.2f")
-                    sol_viari = st.number_input("Sòl Viari", value=0.0, format="%.2f")
-                
-                with fcol3:
-                    sostre_zones = st.number_input("Sostre Zones", value=0.0, format="%.2f")
-                    edificabilitat = st.number_input("Edificabilitat Bruta", value=0.0, format="%.2f")
-                
-                with fcol4:
-                    sostre_residencial = st.number_input("Sostre Residencial", value=0.0, format="%.2f")
-                    habitatges = st.number_input("Nombre Habitatges", value=0, step=1)
-                
-                st.subheader("💰 Dades Econòmiques")
-                ecol1, ecol2, ecol3 = st.columns(3)
-                
-                with ecol1:
-                    total_ingressos = st.number_input("Total Ingressos", value=0.0, format="%.2f")
-                    cessio = st.number_input("Cessió Administració", value=0.0, format="%.2f")
-                    despesa_comercial = st.number_input("Despesa Comercialització", value=0.0, format="%.2f")
+            entry_mode = st.radio("Mode d'entrada:", ["📝 Formulari", "📋 Graella / Enganxar"], horizontal=True)
+            
+            if entry_mode == "📝 Formulari":
+                with st.form("form_afegir_registre"):
+                    col1, col2, col3 = st.columns(3)
+                    
+                    with col1:
+                        sector = st.selectbox("Sector *", [""] + filter_options["sectors"])
+                        codigo_actuacion = st.text_input("Código Actuación *")
+                        nom_actuacio = st.text_input("Nom Actuació *")
+                    
+                    with col2:
+                        municipi = st.text_input("Municipi *")
+                        any = st.number_input("Any *", min_value=2000, max_value=2050, value=datetime.now().year)
+                        codi_actuacio = st.text_input("Codi Actuació")
+                    
+                    with col3:
+                        tipus_actuacio = st.selectbox("Tipus Actuació", ["", "Residencial", "Comercial", "Industrial", "Mixta", "Altres"])
+                        hipotesis = st.selectbox("Hipòtesis", ["", "Per adquisició", "Per Planejament", "Per a PR", "Per a obres", "Altres"])
+                        titular = st.selectbox("Titular Adm. Act.", ["", "Incasòl", "Consorci", "Altres"])
+                    
+                    st.subheader("📐 Dades Físiques")
+                    fcol1, fcol2, fcol3, fcol4 = st.columns(4)
+                    
+                    with fcol1:
+                        sol_sistemes = st.number_input("Sòl Sistemes", value=0.0, format="%.2f")
+                        sol_zones = st.number_input("Sòl Zones", value=0.0, format="%.2f")
+                    
+                    with fcol2:
+                        total_ambit = st.number_input("Total Àmbit", value=0.0, format="%.2f")
+                        sol_viari = st.number_input("Sòl Viari", value=0.0, format="%.2f")
+                    
+                    with fcol3:
+                        sostre_zones = st.number_input("Sostre Zones", value=0.0, format="%.2f")
+                        edificabilitat = st.number_input("Edificabilitat Bruta", value=0.0, format="%.2f")
+                    
+                    with fcol4:
+                        sostre_residencial = st.number_input("Sostre Residencial", value=0.0, format="%.2f")
+                        habitatges = st.number_input("Nombre Habitatges", value=0, step=1)
+                    
+                    st.subheader("💰 Dades Econòmiques")
+                    ecol1, ecol2, ecol3 = st.columns(3)
+                    
+                    with ecol1:
+                        total_ingressos = st.number_input("Total Ingressos", value=0.0, format="%.2f")
+                        cessio = st.number_input("Cessió Administració", value=0.0, format="%.2f")
+                        despesa_comercial = st.number_input("Despesa Comercialització", value=0.0, format="%.2f")
+                    
+                    with ecol2:
+                        aprofitament = st.number_input("Aprofitament Privats", value=0.0, format="%.2f")
+                        obres = st.number_input("Obres d'Urbanització", value=0.0, format="%.2f")
+                        connexions = st.number_input("Connexions i Cànons", value=0.0, format="%.2f")
+                    
+                    with ecol3:
+                        indemnitzacions = st.number_input("Indemnitzacions", value=0.0, format="%.2f")
+                        gestio = st.number_input("Gestió", value=0.0, format="%.2f")
+                        despesa_total = st.number_input("Despesa Total", value=0.0, format="%.2f")
+                    
+                    submitted = st.form_submit_button("✅ Afegir Registre", use_container_width=True)
+                    
+                    if submitted:
+                        errors = []
+                        if not sector or sector == "":
+                            errors.append("• Sector és obligatori")
+                        if not codigo_actuacion or codigo_actuacion.strip() == "":
+                            errors.append("• Código Actuación és obligatori")
+                        if not nom_actuacio or nom_actuacio.strip() == "":
+                            errors.append("• Nom Actuació és obligatori")
+                        if not municipi or municipi.strip() == "":
+                            errors.append("• Municipi és obligatori")
+                        if not hipotesis or hipotesis == "":
+                            errors.append("• Hipòtesis és obligatori")
+                        if not titular or titular == "":
+                            errors.append("• Titular Adm. Act. és obligatori")
+                    
+                        if errors:
+                            st.error("❌ Falten camps obligatoris:\n" + "\n".join(errors))
+                        else:
+                            new_record = {
+                                'sector': sector,
+                                'codigo_actuacion': codigo_actuacion.strip(),
+                                'nom_actuacio': nom_actuacio.strip(),
+                                'municipi': municipi.strip(),
+                                'any': int(any),
+                                'Codi_Actuacio': codi_actuacio.strip(),
+                                'Tipus_actuacio': tipus_actuacio if tipus_actuacio else None,
+                                'Sol_sistemes': sol_sistemes,
+                                'Sol_zones': sol_zones,
+                                'Total_ambit': total_ambit,
+                                'Sol_viari': sol_viari,
+                                'Sostre_zones': sostre_zones,
+                                'edificabilitat_bruta': edificabilitat,
+                                'Sostre_residencial': sostre_residencial,
+                                'Nombre_dhabitatges': int(habitatges),
+                                'Hipotesis': hipotesis if hipotesis else None,
+                                'Titular_Adm__Act_': titular if titular else None,
+                                'Total_Ingressos': total_ingressos,
+                                'Cessio_Administracio_actuant': cessio,
+                                'despesa_comercialitzacio': despesa_comercial,
+                                'Aprofitament_privats': aprofitament,
+                                'Obres_durbanitzacio': obres,
+                                'Connexions_i_canons': connexions,
+                                'Indemnitzacions': indemnitzacions,
+                                'Gestio': gestio,
+                                'Despesa_total': despesa_total
+                            }
+                        
+                            success, message = insert_new_record(new_record)
+                            if success:
+                                st.success(message)
+                                get_cube_cache().add_record(new_record)
+                                # Solo se invalidan los filtros; los datos se refrescan con deltas
+                                load_filter_options.clear()
+                                get_delta_store().mark_stale()
+                                st.balloons()
+                                st.info("📱 El nou registre apareixerà a la propera actualització de la vista")
+                            else:
+                                st.error(message)
+            
+            else:
+                st.caption("Enganxa files copiades d'Excel (amb capçalera) o omple la graella directament. "
+                           "Si ja existeix una fitxa amb el mateix Código Actuación i Any, s'actualitza.")
                 
-                with ecol2:
-                    aprofitament = st.number_input("Aprofitament Privats", value=0.0, format="%.2f")
-                    obres = st.number_input("Obres d'Urbanització", value=0.0, format="%.2f")
-                    connexions = st.number_input("Connexions i Cànons", value=0.0, format="%.2f")
+                pasted = st.text_area("Files enganxades (separades per tabuladors, ; o ,):", height=150)
+                decimal_comma = st.checkbox("Decimals amb coma (1.234,56)")
                 
-                with ecol3:
-                    indemnitzacions = st.number_input("Indemnitzacions", value=0.0, format="%.2f")
-                    gestio = st.number_input("Gestió", value=0.0, format="%.2f")
-                    despesa_total = st.number_input("Despesa Total", value=0.0, format="%.2f")
+                base_rows = bulk_entry_template()
+                if pasted.strip():
+                    try:
+                        base_rows = pd.read_csv(io.StringIO(pasted), sep=None, engine="python", dtype=str)
+                    except Exception as e:
+                        st.error(f"❌ No s'han pogut llegir les files enganxades: {e}")
                 
-                submitted = st.form_submit_button("✅ Afegir Registre", use_container_width=True)
+                edited_rows = st.data_editor(base_rows, num_rows="dynamic", use_container_width=True,
+                                             key=f"bulk_editor_{hashlib.md5(pasted.encode()).hexdigest()}")
                 
-                if submitted:
-                    errors = []
-                    if not sector or sector == "":
-                        errors.append("• Sector és obligatori")
-                    if not codigo_actuacion or codigo_actuacion.strip() == "":
-                        errors.append("• Código Actuación és obligatori")
-                    if not nom_actuacio or nom_actuacio.strip() == "":
-                        errors.append("• Nom Actuació és obligatori")
-                    if not municipi or municipi.strip() == "":
-                        errors.append("• Municipi és obligatori")
-                    if not hipotesis or hipotesis == "":
-                        errors.append("• Hipòtesis és obligatori")
-                    if not titular or titular == "":
-                        errors.append("• Titular Adm. Act. és obligatori")
+                if st.button("✅ Validar i desar lot", use_container_width=True):
+                    records = edv_db.normalize_records(edited_rows, decimal_comma=decimal_comma)
+                    errors = edv_db.validate_records(records)
                     
-                    if errors:
-                        st.error("❌ Falten camps obligatoris:\n" + "\n".join(errors))
+                    if records.empty:
+                        st.warning("No hi ha cap fila per desar")
+                    elif errors:
+                        st.error("❌ El lot té errors (no s'ha desat res):\n" + "\n".join(errors[:50]))
                     else:
-                        new_record = {
-                            'sector': sector,
-                            'codigo_actuacion': codigo_actuacion.strip(),
-                            'nom_actuacio': nom_actuacio.strip(),
-                            'municipi': municipi.strip(),
-                            'any': int(any),
-                            'Codi_Actuacio': codi_actuacio.strip(),
-                            'Tipus_actuacio': tipus_actuacio if tipus_actuacio else None,
-                            'Sol_sistemes': sol_sistemes,
-                            'Sol_zones': sol_zones,
-                            'Total_ambit': total_ambit,
-                            'Sol_viari': sol_viari,
-                            'Sostre_zones': sostre_zones,
-                            'edificabilitat_bruta': edificabilitat,
-                            'Sostre_residencial': sostre_residencial,
-                            'Nombre_dhabitatges': int(habitatges),
-                            'Hipotesis': hipotesis if hipotesis else None,
-                            'Titular_Adm__Act_': titular if titular else None,
-                            'Total_Ingressos': total_ingressos,
-                            'Cessio_Administracio_actuant': cessio,
-                            'despesa_comercialitzacio': despesa_comercial,
-                            'Aprofitament_privats': aprofitament,
-                            'Obres_durbanitzacio': obres,
-                            'Connexions_i_canons': connexions,
-                            'Indemnitzacions': indemnitzacions,
-                            'Gestio': gestio,
-                            'Despesa_total': despesa_total
-                        }
-                        
-                        success, message = insert_new_record(new_record)
+                        success, message = upsert_new_records(records)
                         if success:
                             st.success(message)
-                            st.cache_data.clear()
-                            st.balloons()
-                            st.info("📱 Actualiza la app para ver el nuevo registre")
+                            # Con actualizaciones el cubo no se puede mantener fila a fila: se revalida
+                            load_filter_options.clear()
+                            get_delta_store().mark_stale()
+                            get_cube_cache().mark_stale()
                         else:
                             st.error(message)
     
+    perf.record(f"vista: {view_mode}", time.perf_counter() - view_started)
+    
     # ========================================================================
     # FOOTER
     # ========================================================================
     st.divider()
     st.caption("💾 Font: Base de dades EDV | 🗄️ Última actualització: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+# Cierre del registro de tiempos: log JSON lines y panel de rendimiento (admin)
+perf_record = log_rerun(perf)
+if perf_panel is not None:
+    show_perf_panel(perf_panel, perf_record)
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks del pipeline de datos de EDV Comparator"""
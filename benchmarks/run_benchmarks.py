@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+BENCHMARK DEL PIPELINE - EDV Comparator
+Mide sin Streamlit cada etapa de Home.py (carga → filtro → agregación →
+correlaciones → exportación) sobre datos sintéticos cargados en el sustituto
+SQLite de MySQL. Guarda tiempos y memoria pico en JSON para comparar ejecuciones.
+
+Uso:
+    python -m benchmarks.run_benchmarks --rows 10000 100000 --output bench.json
+    python -m benchmarks.run_benchmarks --rows 10000 --compare bench.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import edv_analytics
+import edv_db
+import edv_engine
+import edv_export
+import edv_sqlite
+from benchmarks.synthetic import generate_edv_fitxes
+
+ALL_STAGES = [
+    "load_raw", "load_typed", "filter_pandas", "filter_sql", "aggregate_groupby", "aggregate_cube",
+    "aggregate_engine", "describe_pandas", "describe_engine", "corr_pandas", "corr_accumulators", "corr_engine",
+    "export_csv_string", "export_csv", "export_excel", "export_parquet",
+]
+
+# Excel no admite más de 1.048.576 filas y es muy lento a gran escala
+EXCEL_MAX_ROWS = 200_000
+
+
+def measure(func, repeat):
+    """Ejecuta func `repeat` veces; devuelve tiempos y memoria pico (tracemalloc) de la primera"""
+    times = []
+    peak = 0
+    for i in range(repeat):
+        gc.collect()
+        if i == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if i == 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return {
+        "seconds_min": min(times),
+        "seconds_median": statistics.median(times),
+        "peak_mb": peak / 1024 ** 2,
+    }
+
+
+def selection(df, fraction=0.25):
+    """Sectores (una fracción) y todos los años, como la selección por defecto del sidebar"""
+    sectors = sorted(df["sector"].unique().tolist())
+    years = sorted(int(y) for y in df["any"].unique())
+    return sectors[:max(1, int(len(sectors) * fraction))], years
+
+
+def run_scale(n_rows, args, workdir):
+    """Ejecuta todas las etapas para un tamaño de datos"""
+    print(f"\n▶ {n_rows:,} filas ({args.sectors} sectores, {args.first_year}-{args.last_year})")
+    generated = generate_edv_fitxes(n_rows, n_sectors=args.sectors, first_year=args.first_year,
+                                    last_year=args.last_year, seed=args.seed)
+
+    db_path = os.path.join(workdir, f"edv_{n_rows}.sqlite")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = edv_sqlite.connect(db_path)
+    edv_sqlite.insert_frame(conn, generated)
+    del generated
+
+    raw = edv_db.read_edv_fitxes(conn)
+    typed = edv_db.apply_schema_types(raw)
+    sectors, years = selection(typed)
+    filtered = edv_db.filter_frame(typed, sectors, years)
+    numeric = [c for c in typed.select_dtypes(include=[np.number]).columns if c != "id"]
+    cube = edv_analytics.SectorYearCube.from_frame(typed)
+    accumulators = edv_analytics.CovarianceAccumulators.from_frame(typed, numeric)
+    corr_vars = numeric[:10]
+    # El motor embebido se carga con la selección, como en Home.py
+    engine = edv_engine.create_engine(args.engine, filtered)
+
+    stages = {
+        "load_raw": lambda: edv_db.read_edv_fitxes(conn),
+        "load_typed": lambda: edv_db.apply_schema_types(raw),
+        "filter_pandas": lambda: typed[typed["sector"].isin(sectors) & typed["any"].isin(years)].copy(),
+        "filter_sql": lambda: edv_db.load_edv_fitxes(conn, sectors=sectors, years=years),
+        "aggregate_groupby": lambda: filtered.groupby("sector", observed=True).agg({
+            "codigo_actuacion": "count", "any": ["min", "max"],
+            "Total_Ingressos": "mean", "Despesa_total": "mean"}),
+        "aggregate_cube": lambda: cube.sector_summary(sectors, years),
+        "aggregate_engine": lambda: engine.sector_summary(),
+        "describe_pandas": lambda: filtered[numeric].describe(),
+        "describe_engine": lambda: engine.describe(numeric),
+        "corr_pandas": lambda: filtered[corr_vars].corr(),
+        "corr_accumulators": lambda: accumulators.correlation(corr_vars, sectors, years),
+        "corr_engine": lambda: engine.correlation(corr_vars),
+        "export_csv_string": lambda: filtered.to_csv(index=False),
+        "export_csv": lambda: edv_export.write_csv(filtered, os.path.join(workdir, "export.csv")),
+        "export_excel": lambda: edv_export.write_excel(filtered, os.path.join(workdir, "export.xlsx")),
+        "export_parquet": lambda: edv_export.write_parquet(filtered, os.path.join(workdir, "export.parquet")),
+    }
+
+    results = []
+    for name in args.stages:
+        if name == "export_excel" and len(filtered) > EXCEL_MAX_ROWS:
+            print(f"  - {name:<20} omès (> {EXCEL_MAX_ROWS:,} files)")
+            continue
+        if name == "export_parquet" and "Parquet" not in edv_export.available_formats():
+            print(f"  - {name:<20} omès (sense pyarrow)")
+            continue
+        stats = measure(stages[name], args.repeat)
+        stats.update({"stage": name, "rows": n_rows, "selected_rows": len(filtered)})
+        results.append(stats)
+        print(f"  - {name:<20} {stats['seconds_median'] * 1000:10.1f} ms   pic {stats['peak_mb']:8.1f} MB")
+
+    conn.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    """Imprime la relación de tiempos respecto a una ejecución anterior"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["stage"], r["rows"]): r for r in json.load(f)["results"]}
+    print(f"\nComparació amb {baseline_path} (temps actual / anterior):")
+    for result in results:
+        previous = baseline.get((result["stage"], result["rows"]))
+        if previous is None:
+            continue
+        ratio = result["seconds_median"] / previous["seconds_median"] if previous["seconds_median"] else float("nan")
+        flag = "⚠️" if ratio > 1.2 else ""
+        print(f"  {result['stage']:<20} {result['rows']:>10,}  x{ratio:5.2f} {flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de dades EDV")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000],
+                        help="mides a provar (p.ex. 10000 100000 1000000)")
+    parser.add_argument("--sectors", type=int, default=200)
+    parser.add_argument("--first-year", type=int, default=2000)
+    parser.add_argument("--last-year", type=int, default=2025)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=ALL_STAGES, default=ALL_STAGES)
+    parser.add_argument("--engine", choices=["duckdb", "sqlite"], default="duckdb",
+                        help="motor embegut de les etapes *_engine (sense duckdb s'usa sqlite)")
+    parser.add_argument("--workdir", default=None, help="directori per a la BD i els fitxers (temporal per defecte)")
+    parser.add_argument("--output", default=None, help="fitxer JSON de resultats")
+    parser.add_argument("--compare", default=None, help="JSON d'una execució anterior")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # pandas avisa con cualquier conexión DB-API que no sea sqlite3 o SQLAlchemy (también con MySQL)
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="edv_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    for n_rows in args.rows:
+        results.extend(run_scale(n_rows, args, workdir))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "sectors": args.sectors,
+            "years": [args.first_year, args.last_year],
+            "repeat": args.repeat,
+            "engine": args.engine if edv_engine.duckdb is not None else "sqlite",
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Resultats desats a {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+GENERADOR DE DATOS SINTÉTICOS - edv_fitxes
+Fitxes EDV realistas a cualquier escala, con las mismas relaciones entre
+columnas que los registros de database/insert_edv_data.sql.
+"""
+
+import numpy as np
+import pandas as pd
+
+import edv_db
+
+MUNICIPIS = [
+    "Hospitalet Llobregat", "Granollers", "Vilafranca del Penedès", "Sabadell", "Terrassa",
+    "Mataró", "Badalona", "Reus", "Girona", "Lleida", "Manresa", "Vic", "Igualada", "Figueres",
+    "Tarragona", "Rubí", "Cerdanyola del Vallès", "Martorell", "Vilanova i la Geltrú", "Blanes",
+]
+TIPUS = ["Residencial", "Residencial", "Residencial", "Industrial", "Comercial", "Mixta"]
+TITULARS = ["Incasòl", "Incasòl", "Consorci", "Altres"]
+
+# Hipòtesis según el avance del expediente y fase activa correspondiente (E1..E9)
+HIPOTESIS = ["Per adquisició", "Per Planejament", "Per a PR", "Per a obres"]
+ACTIVE_PHASES = {0: (0, 2), 1: (2, 4), 2: (4, 5), 3: (5, 6)}
+
+
+def _phase_matrix(stage):
+    """Estados E1..E9: Fet antes de las fases activas, Actiu en ellas, Pendent después"""
+    first = np.array([ACTIVE_PHASES[s][0] for s in stage])
+    last = np.array([ACTIVE_PHASES[s][1] for s in stage])
+    phase = np.arange(len(edv_db.PHASE_COLUMNS))[None, :]
+    labels = np.where(phase < first[:, None], "Fet", np.where(phase < last[:, None], "Actiu", "Pendent"))
+    return pd.DataFrame(labels, columns=edv_db.PHASE_COLUMNS)
+
+
+def generate_edv_fitxes(n_rows, n_sectors=200, first_year=2000, last_year=2025,
+                        studies_per_actuacio=4, seed=0):
+    """Genera `n_rows` filas edv_fitxes (sin id).
+
+    Cada actuación (codigo_actuacion) pertenece a un sector y tiene varios
+    EDV en años crecientes; la hipòtesis y las fases avanzan con los años.
+    Las claves (codigo_actuacion, any) son únicas.
+    """
+    rng = np.random.default_rng(seed)
+    n_years = last_year - first_year + 1
+    studies_per_actuacio = max(1, min(studies_per_actuacio, n_years))
+    n_actuacions = int(np.ceil(n_rows / studies_per_actuacio))
+
+    # --- Actuaciones: atributos fijos ---------------------------------------
+    act_sector = rng.integers(0, n_sectors, n_actuacions)
+    act_municipi = rng.integers(0, len(MUNICIPIS), n_actuacions)
+    sol_sistemes = rng.lognormal(10.0, 0.8, n_actuacions).round(2)
+    sol_zones = (sol_sistemes * rng.uniform(0.2, 1.2, n_actuacions)).round(2)
+    edificabilitat = rng.uniform(0.5, 1.2, n_actuacions)
+
+    # --- Estudios: una fila por (actuación, any) -----------------------------
+    act = np.repeat(np.arange(n_actuacions), studies_per_actuacio)[:n_rows]
+    study = np.tile(np.arange(studies_per_actuacio), n_actuacions)[:n_rows]
+    offsets = np.sort(rng.random((n_actuacions, n_years)).argsort(axis=1)[:, :studies_per_actuacio], axis=1)
+    year = first_year + offsets[act, study]
+    stage = np.minimum(study, len(HIPOTESIS) - 1)
+
+    total_ambit = sol_sistemes[act] + sol_zones[act]
+    sostre_zones = (total_ambit * edificabilitat[act]).round(2)
+    sostre_residencial = (sostre_zones * rng.uniform(0.6, 1.0, n_rows)).round(2)
+    incasol = (total_ambit * rng.uniform(0, 1, n_rows)).round(2)
+    sol_amb_drets = (total_ambit * rng.uniform(0.6, 0.95, n_rows)).round(2)
+
+    total_ingressos = (sostre_zones * rng.uniform(400, 900, n_rows)).round(2)
+    pct_cessio = rng.choice([0.1, 0.15], n_rows)
+    cessio = (total_ingressos * pct_cessio).round(2)
+    despesa_com = rng.choice([0.0, 0.03], n_rows)
+    aprofitament = ((total_ingressos - cessio) * (1 - despesa_com)).round(2)
+    obres = (total_ingressos * rng.uniform(0.2, 0.4, n_rows)).round(2)
+    connexions = (total_ingressos * rng.uniform(0, 0.05, n_rows) * (rng.random(n_rows) < 0.4)).round(2)
+    indemnitzacions = (total_ingressos * rng.uniform(0, 0.1, n_rows) * (rng.random(n_rows) < 0.6)).round(2)
+    gestio = (total_ingressos * rng.uniform(0.03, 0.05, n_rows)).round(2)
+    despesa_adm = np.where(rng.random(n_rows) < 0.2, -(total_ingressos * rng.uniform(0, 0.05, n_rows)).round(2), 0.0)
+    despesa_total = obres + connexions + indemnitzacions + gestio + despesa_adm
+
+    # Càlcul dinàmic: VRS = Aprofitament / (1 + taxa)^T - Despesa total
+    taxa_dinamica = rng.choice([0.08, 0.083, 0.08117], n_rows)
+    temps_dinamic = rng.uniform(2.0, 5.0, n_rows)
+    vrs_dinamic = aprofitament / (1 + taxa_dinamica) ** temps_dinamic - despesa_total
+    # Càlcul estàtic: VRS = Aprofitament - Despesa total · (1 + taxa)
+    taxa_estatica = np.full(n_rows, 0.08117)
+    vrs_estatic = aprofitament - despesa_total * (1 + taxa_estatica)
+
+    sector_names = np.array([f"Sector {i + 1:04d}" for i in range(n_sectors)])
+    codes = np.array([f"{i // 10:04d}-{i % 10 + 1}" for i in range(n_actuacions)])
+
+    df = pd.DataFrame({
+        "sector": sector_names[act_sector[act]],
+        "codigo_actuacion": codes[act],
+        "nom_actuacio": sector_names[act_sector[act]],
+        "municipi": np.array(MUNICIPIS)[act_municipi[act]],
+        "any": year.astype(int),
+        "Codi_Actuacio": codes[act],
+        "Tipus_actuacio": np.array(TIPUS)[rng.integers(0, len(TIPUS), n_rows)],
+        "Sol_sistemes": sol_sistemes[act],
+        "Sol_zones": sol_zones[act],
+        "Total_ambit": total_ambit,
+        "Sol_viari": (sol_sistemes[act] * rng.uniform(0.3, 0.5, n_rows)).round(2),
+        "Sostre_zones": sostre_zones,
+        "edificabilitat_bruta": sostre_zones / total_ambit,
+        "Sostre_residencial": sostre_residencial,
+        "Nombre_dhabitatges": (sostre_residencial / rng.uniform(80, 110, n_rows)).astype(int),
+        "Hipotesis": np.array(HIPOTESIS)[stage],
+    })
+    df = pd.concat([df, _phase_matrix(stage)], axis=1)
+    df = df.assign(
+        Incasol=incasol,
+        Altres_propietaris=(total_ambit - incasol).round(2),
+        Sol_amb_drets=sol_amb_drets,
+        Sol_sense_drets=(total_ambit - sol_amb_drets).round(2),
+        Titular_Adm__Act_=np.array(TITULARS)[rng.integers(0, len(TITULARS), n_rows)],
+        pct_drets_Adm__Act_=pct_cessio,
+        Total_Ingressos=total_ingressos,
+        Cessio_Administracio_actuant=cessio,
+        despesa_comercialitzacio=despesa_com,
+        Aprofitament_privats=aprofitament,
+        Obres_durbanitzacio=obres,
+        Connexions_i_canons=connexions,
+        Indemnitzacions=indemnitzacions,
+        Gestio=gestio,
+        Despesa_a_assumir_Adm__Act_=despesa_adm,
+        Despesa_total=despesa_total,
+        Calcul_dinamic_Taxa_aplicada=taxa_dinamica,
+        Calcul_dinamic_Valor_residual_sol=vrs_dinamic,
+        Calcul_dinamic_Valor_unitari=vrs_dinamic / sol_amb_drets,
+        Calcul_dinamic_Temps_mig_retorn=temps_dinamic,
+        Calcul_estatic_Taxa_aplicada=taxa_estatica,
+        Calcul_estatic_Valor_residual_sol=vrs_estatic,
+        Calcul_estatic_Valor_unitari=vrs_estatic / sol_amb_drets,
+        Calcul_estatic_Temps_mig_retorn=despesa_total * (1 + taxa_estatica) / aprofitament,
+    )
+    return df[[column for column in edv_db.EDV_COLUMNS if column != "id"]]
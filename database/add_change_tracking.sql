@@ -0,0 +1,15 @@
+-- ============================================================================
+-- MIGRACIÓN: control de cambios en edv_fitxes
+-- ============================================================================
+-- Descripción: Añade la columna updated_at a bases de datos creadas con una
+--              versión anterior de create_edv_database.sql. La app la usa para
+--              refrescar solo los registros nuevos o modificados.
+-- Ejecución:   mysql -u root gestio_de_projectes < add_change_tracking.sql
+-- ============================================================================
+
+USE gestio_de_projectes;
+
+ALTER TABLE edv_fitxes
+    ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        COMMENT 'Última inserción o modificación del registro',
+    ADD INDEX idx_updated_at (updated_at);
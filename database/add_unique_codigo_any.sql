@@ -0,0 +1,17 @@
+-- ============================================================================
+-- MIGRACIÓN: clave única (codigo_actuacion, any) en edv_fitxes
+-- ============================================================================
+-- Descripción: Sustituye el índice idx_codigo_any por una clave única. La
+--              carga por lotes de la app hace upsert sobre esta clave.
+-- Requisito:   no puede haber dos fitxes con el mismo codigo_actuacion y any.
+--              Para comprobarlo antes de migrar:
+--                SELECT codigo_actuacion, any, COUNT(*) FROM edv_fitxes
+--                GROUP BY codigo_actuacion, any HAVING COUNT(*) > 1;
+-- Ejecución:   mysql -u root gestio_de_projectes < add_unique_codigo_any.sql
+-- ============================================================================
+
+USE gestio_de_projectes;
+
+ALTER TABLE edv_fitxes
+    DROP INDEX idx_codigo_any,
+    ADD UNIQUE KEY uq_codigo_any (codigo_actuacion, any);
@@ -90,12 +90,18 @@ CREATE TABLE edv_fitxes (
     Calcul_estatic_Valor_unitari DECIMAL(20,10) COMMENT 'Càlcul estàtic: Valor unitari',
     Calcul_estatic_Temps_mig_retorn DECIMAL(20,10) COMMENT 'Càlcul estàtic: Temps mig retorn',
 
+    -- ========================================================================
+    -- CONTROL DE CAMBIOS (refresco incremental de la app)
+    -- ========================================================================
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT 'Última inserción o modificación del registro',
+
     -- ========================================================================
     -- ÍNDICES PARA OPTIMIZACIÓN DE CONSULTAS
     -- ========================================================================
     INDEX idx_sector_codigo_any (sector, codigo_actuacion, any),
-    INDEX idx_codigo_any (codigo_actuacion, any),
+    UNIQUE KEY uq_codigo_any (codigo_actuacion, any),
     INDEX idx_municipi (municipi),
     INDEX idx_any (any),
-    INDEX idx_sector (sector)
+    INDEX idx_sector (sector),
+    INDEX idx_updated_at (updated_at)
 );
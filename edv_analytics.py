@@ -0,0 +1,611 @@
+# -*- coding: utf-8 -*-
+
+"""
+ANALÍTICA PRECALCULADA - EDV Comparator
+Estructuras agregadas que evitan recorrer las filas en cada rerun de Streamlit
+"""
+
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import edv_db
+import edv_perf
+
+# ============================================================================
+# CUBO SECTOR × ANY
+# ============================================================================
+
+CUBE_KEYS = ["sector", "any"]
+CUBE_STATS = ("count", "sum", "min", "max")
+
+
+def _cell_columns(columns, stat):
+    return [f"{column}__{stat}" for column in columns]
+
+
+class SectorYearCube:
+    """Agregados count/sum/min/max por (sector, any) para cada columna numérica.
+
+    Cualquier combinación de filtros se resuelve sumando (o tomando mín/máx de)
+    las celdas seleccionadas, sin volver a recorrer las filas originales.
+    """
+
+    def __init__(self, cells, columns, watermark=None):
+        self.columns = list(columns)
+        self.cells = cells.set_index(CUBE_KEYS).sort_index()
+        self.watermark = watermark
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """Construye el cubo a partir de un DataFrame de edv_fitxes"""
+        columns = [c for c in (columns or edv_db.measure_columns()) if c in df.columns]
+        data = df[CUBE_KEYS + columns].copy()
+        data["sector"] = data["sector"].astype(object)
+        grouped = data.groupby(CUBE_KEYS, observed=True, sort=True)
+
+        cells = pd.DataFrame({"n": grouped.size().astype("float64")})
+        for stat in CUBE_STATS:
+            values = getattr(grouped[columns], stat)().astype("float64")
+            values.columns = _cell_columns(columns, stat)
+            cells = cells.join(values)
+        return cls(cells.reset_index(), columns)
+
+    @classmethod
+    def from_db(cls, conn, columns=None, watermark=None):
+        """Construye el cubo con un GROUP BY sector, any en MySQL"""
+        columns = list(columns or edv_db.measure_columns())
+        return cls(edv_db.fetch_sector_year_aggregates(conn, columns), columns, watermark)
+
+    @property
+    def n_rows(self):
+        """Filas agregadas en todo el cubo"""
+        return int(self.cells["n"].sum())
+
+    def add_record(self, record):
+        """Incorpora una fila recién insertada a su celda (sector, any)"""
+        key = (record["sector"], int(record["any"]))
+        with self._lock:
+            cells = self.cells.copy()
+            if key not in cells.index:
+                empty = pd.DataFrame([[0.0] * len(cells.columns)], columns=cells.columns,
+                                     index=pd.MultiIndex.from_tuples([key], names=CUBE_KEYS))
+                empty[_cell_columns(self.columns, "min") + _cell_columns(self.columns, "max")] = np.nan
+                cells = pd.concat([cells, empty]).sort_index()
+
+            cells.loc[key, "n"] += 1
+            for column in self.columns:
+                value = record.get(column)
+                if value is None or pd.isna(value):
+                    continue
+                value = float(value)
+                cells.loc[key, f"{column}__count"] += 1
+                cells.loc[key, f"{column}__sum"] += value
+                cells.loc[key, f"{column}__min"] = np.fmin(cells.loc[key, f"{column}__min"], value)
+                cells.loc[key, f"{column}__max"] = np.fmax(cells.loc[key, f"{column}__max"], value)
+            # Sustitución atómica: los lectores nunca ven una celda a medias
+            self.cells = cells
+
+    def rollup(self, sectors=None, years=None, columns=None):
+        """Agrega por sector las celdas de la selección (sectores, años)"""
+        columns = list(columns or self.columns)
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+        if sectors is not None:
+            mask &= cells.index.get_level_values("sector").isin(list(sectors))
+        if years is not None:
+            mask &= cells.index.get_level_values("any").isin(list(years))
+        selected = cells[mask]
+
+        grouped = selected.groupby(level="sector", sort=True)
+        additive = ["n"] + _cell_columns(columns, "count") + _cell_columns(columns, "sum")
+        result = pd.concat([
+            grouped[additive].sum(),
+            grouped[_cell_columns(columns, "min")].min(),
+            grouped[_cell_columns(columns, "max")].max(),
+        ], axis=1)
+
+        years_level = pd.Series(selected.index.get_level_values("any"), index=selected.index.get_level_values("sector"))
+        result["any__min"] = years_level.groupby(level=0).min()
+        result["any__max"] = years_level.groupby(level=0).max()
+        return result
+
+    @staticmethod
+    def _means_from_rollup(rolled, columns):
+        counts = rolled[_cell_columns(columns, "count")].to_numpy()
+        sums = rolled[_cell_columns(columns, "sum")].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(counts > 0, sums / np.where(counts > 0, counts, 1), np.nan)
+        means = pd.DataFrame(values, index=rolled.index, columns=columns)
+        means.index.name = "sector"
+        return means
+
+    def means(self, sectors=None, years=None, columns=None):
+        """Media por sector (equivale a df.groupby('sector')[columns].mean())"""
+        columns = list(columns or self.columns)
+        return self._means_from_rollup(self.rollup(sectors, years, columns), columns)
+
+    def sector_summary(self, sectors=None, years=None):
+        """Tabla de la Visió General: registros, años y medias de ingresos/despesa"""
+        columns = ["Total_Ingressos", "Despesa_total"]
+        rolled = self.rollup(sectors, years, columns)
+        means = self._means_from_rollup(rolled, columns)
+        summary = pd.DataFrame({
+            "Registres": rolled["n"].astype(int),
+            "Any Min": rolled["any__min"],
+            "Any Max": rolled["any__max"],
+            "Ingressos Mitjans": means["Total_Ingressos"],
+            "Despesa Mitjana": means["Despesa_total"],
+        })
+        summary.index.name = "sector"
+        return summary
+
+
+class CubeCache:
+    """Cubo compartido por el proceso; se reconstruye si cambia la versión de los datos.
+
+    La versión es la marca (máximo id, última modificación) más el número de
+    filas, para detectar bajas. Los cambios que no tocan updated_at solo se
+    ven con la reconstrucción completa de cada `full_rebuild_seconds`.
+    """
+
+    def __init__(self, refresh_seconds=60, full_rebuild_seconds=3600):
+        self.refresh_seconds = refresh_seconds
+        self.full_rebuild_seconds = full_rebuild_seconds
+        self.cube = None
+        self._tracked = None
+        self._checked_at = 0.0
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        return self.cube is None or time.monotonic() - self._checked_at >= self.refresh_seconds
+
+    def refresh(self, conn):
+        """Comprueba la versión de los datos y reconstruye el cubo solo si cambió"""
+        with self._lock:
+            if not self.is_stale():
+                return self.cube
+            if self._tracked is None:
+                self._tracked = edv_db.has_change_tracking(conn)
+            watermark = edv_db.fetch_watermark(conn, self._tracked)
+            rows = edv_db.count_rows(conn)
+            now = time.monotonic()
+            if (self.cube is None or self.cube.watermark != watermark or self.cube.n_rows != rows
+                    or now - self._built_at >= self.full_rebuild_seconds):
+                self.cube = SectorYearCube.from_db(conn, watermark=watermark)
+                self._built_at = now
+            self._checked_at = now
+            return self.cube
+
+    def mark_stale(self):
+        """Fuerza la comprobación de versión en el próximo acceso"""
+        self._checked_at = 0.0
+
+    def add_record(self, record):
+        """Mantiene el cubo al día tras un insert_new_record() correcto"""
+        if self.cube is not None:
+            self.cube.add_record(record)
+
+
+# ============================================================================
+# ACUMULADORES DE COVARIANZA (CORRELACIONES)
+# ============================================================================
+
+class CovarianceAccumulators:
+    """Estadísticos suficientes por celda (sector, any) para correlaciones de Pearson.
+
+    Para cada par de columnas (i, j) se guardan, sobre las filas con ambos
+    valores presentes: n_ij, Σx_i, Σx_i² y Σx_i·x_j. Así la matriz coincide
+    con DataFrame.corr() (eliminación por pares). Los valores se desplazan por
+    un vector fijo `shift` para evitar cancelación numérica; la correlación no
+    cambia. Las sumas son restables, así que altas, bajas y modificaciones se
+    aplican sin recalcular: O(k²) por fila y O(celdas·k²) por consulta.
+    """
+
+    def __init__(self, columns, shift):
+        self.columns = list(columns)
+        self.shift = np.asarray(shift, dtype="float64")
+        self.cells = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df, columns):
+        columns = list(columns)
+        values = df[columns].to_numpy(dtype="float64", na_value=np.nan)
+        with np.errstate(invalid="ignore"):
+            shift = np.nan_to_num(np.nanmean(values, axis=0)) if len(values) else np.zeros(len(columns))
+        accumulators = cls(columns, shift)
+        accumulators.add_rows(df)
+        return accumulators
+
+    def _empty_cell(self):
+        k = len(self.columns)
+        return {stat: np.zeros((k, k)) for stat in ("n", "sx", "sxx", "sxy")}
+
+    def add_rows(self, df, sign=1.0):
+        """Suma (o resta con sign=-1) las filas de df a sus celdas"""
+        if df is None or df.empty:
+            return
+        keys = pd.MultiIndex.from_arrays([df["sector"].astype(object), df["any"]])
+        values = df[self.columns].to_numpy(dtype="float64", na_value=np.nan) - self.shift
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        mask = present.astype("float64")
+
+        codes, uniques = pd.factorize(keys)
+        with self._lock:
+            for code, key in enumerate(uniques):
+                rows = codes == code
+                x, m = values[rows], mask[rows]
+                cell = self.cells.setdefault(key, self._empty_cell())
+                cell["n"] += sign * (m.T @ m)
+                cell["sx"] += sign * (x.T @ m)
+                cell["sxx"] += sign * ((x * x).T @ m)
+                cell["sxy"] += sign * (x.T @ x)
+
+    def remove_rows(self, df):
+        self.add_rows(df, sign=-1.0)
+
+    def apply_delta(self, removed, added):
+        """Listener de DeltaFrame: removed=None significa recarga completa"""
+        if removed is None:
+            with self._lock:
+                self.cells = {}
+        else:
+            self.remove_rows(removed)
+        self.add_rows(added)
+
+    def merged(self, sectors=None, years=None):
+        """Suma las celdas de la selección"""
+        total = self._empty_cell()
+        with self._lock:
+            for (sector, year), cell in self.cells.items():
+                if sectors is not None and sector not in sectors:
+                    continue
+                if years is not None and year not in years:
+                    continue
+                for stat in total:
+                    total[stat] += cell[stat]
+        return total
+
+    def correlation(self, columns=None, sectors=None, years=None):
+        """Matriz de correlaciones (como DataFrame.corr()) a partir de las sumas"""
+        columns = list(columns or self.columns)
+        idx = np.array([self.columns.index(column) for column in columns], dtype=int)
+        total = self.merged(sectors, years)
+        n, sx, sxx, sxy = (total[stat][np.ix_(idx, idx)] for stat in ("n", "sx", "sxx", "sxy"))
+
+        # sx[i, j] = Σx_i y sx[j, i] = Σx_j sobre las filas donde ambos existen
+        cov = n * sxy - sx * sx.T
+        var_i = n * sxx - sx ** 2
+        var_j = var_i.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = cov / np.sqrt(var_i * var_j)
+        # Sin varianza o con menos de 2 pares la correlación no está definida
+        scale = np.maximum(np.abs(n * sxx), 1.0)
+        undefined = (n < 2) | (var_i <= 1e-12 * scale) | (var_j <= 1e-12 * scale.T)
+        corr = np.where(undefined, np.nan, np.clip(corr, -1.0, 1.0))
+        diagonal = np.diag_indices_from(corr)
+        corr[diagonal] = np.where(np.isnan(corr[diagonal]), np.nan, 1.0)
+        return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+# ============================================================================
+# HISTOGRAMAS Y DIAGRAMAS DE CAJA PRECALCULADOS
+# ============================================================================
+
+def histogram_by_group(df, column, group="sector", nbins=30):
+    """Cuenta por intervalo y grupo con NumPy (bordes comunes a todos los grupos).
+
+    Devuelve una fila por (grupo, intervalo): el navegador solo recibe
+    grupos × nbins barras, no cada valor.
+    """
+    values = df[column].to_numpy(dtype="float64", na_value=np.nan)
+    present = ~np.isnan(values)
+    if not present.any():
+        return pd.DataFrame(columns=[group, "bin_start", "bin_end", "bin_center", "count"])
+
+    edges = np.histogram_bin_edges(values[present], bins=nbins)
+    codes, groups = pd.factorize(df[group].astype(object), sort=True)
+    bins = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, len(edges) - 2)
+
+    valid = present & (codes >= 0)
+    counts = np.zeros((len(groups), len(edges) - 1), dtype=np.int64)
+    np.add.at(counts, (codes[valid], bins[valid]), 1)
+
+    result = pd.DataFrame({
+        group: np.repeat(groups, len(edges) - 1),
+        "bin_start": np.tile(edges[:-1], len(groups)),
+        "bin_end": np.tile(edges[1:], len(groups)),
+        "count": counts.ravel(),
+    })
+    result["bin_center"] = (result["bin_start"] + result["bin_end"]) / 2
+    return result
+
+
+def box_statistics(df, columns, group="sector", max_outliers=50):
+    """Cuartiles, bigotes (1.5·IQR) y outliers acotados por (variable, grupo).
+
+    Mismo criterio que Plotly (cuartiles lineales); solo se conservan los
+    `max_outliers` valores más alejados de la mediana de cada caja.
+    """
+    data = df[[group] + list(columns)].copy()
+    data[group] = data[group].astype(object)
+    grouped = data.groupby(group, sort=True)
+
+    quartiles = grouped[list(columns)].quantile([0.25, 0.5, 0.75])
+    means = grouped[list(columns)].mean()
+    stats, outliers = [], []
+    for column in columns:
+        q = quartiles[column].unstack()
+        q.columns = ["q1", "median", "q3"]
+        iqr = q["q3"] - q["q1"]
+        low_fence = data[group].map(q["q1"] - 1.5 * iqr)
+        high_fence = data[group].map(q["q3"] + 1.5 * iqr)
+        values = data[column]
+        inside = values.between(low_fence, high_fence)
+
+        box = q.copy()
+        box["lowerfence"] = values.where(inside).groupby(data[group]).min()
+        box["upperfence"] = values.where(inside).groupby(data[group]).max()
+        box["mean"] = means[column]
+        box["Variable"] = column
+        stats.append(box.reset_index())
+
+        outside = data.loc[values.notna() & ~inside, [group, column]]
+        if not outside.empty:
+            distance = (outside[column] - outside[group].map(q["median"])).abs()
+            keep = distance.groupby(outside[group]).rank(method="first", ascending=False) <= max_outliers
+            capped = outside[keep].rename(columns={column: "Valor"})
+            capped["Variable"] = column
+            outliers.append(capped)
+
+    stats = pd.concat(stats, ignore_index=True) if stats else pd.DataFrame()
+    outliers = (pd.concat(outliers, ignore_index=True) if outliers
+                else pd.DataFrame(columns=[group, "Valor", "Variable"]))
+    return stats, outliers
+
+
+# ============================================================================
+# CACHÉ DE FRAMES DERIVADOS
+# ============================================================================
+
+# Propiedades de traza que guardan un valor por punto (bar, line, box, radar, histograma...)
+TRACE_ARRAY_PROPERTIES = ("x", "y", "z", "r", "theta", "text", "customdata", "hovertext",
+                          "q1", "median", "q3", "lowerfence", "upperfence", "mean")
+TRACE_OVERHEAD_BYTES = 2048
+FIGURE_OVERHEAD_BYTES = 8192
+
+
+def _trace_bytes(trace):
+    """Memoria aproximada de una traza Plotly: 8 bytes por valor de sus arrays"""
+    values = 0
+    for name in TRACE_ARRAY_PROPERTIES:
+        array = getattr(trace, name, None)
+        if array is not None and not isinstance(array, str) and hasattr(array, "__len__"):
+            values += len(array)
+    return TRACE_OVERHEAD_BYTES + 8 * values
+
+
+def estimate_bytes(value):
+    """Memoria aproximada de un resultado cacheado"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "to_plotly_json"):
+        # Figura Plotly: por la longitud de los arrays de cada traza, sin serializarla
+        return sum(_trace_bytes(trace) for trace in value.data) + FIGURE_OVERHEAD_BYTES
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_bytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class DerivedFrameCache:
+    """LRU de resultados derivados (sub-frames, estadísticos...) acotado por memoria.
+
+    La clave debe incluir la versión de los datos y los parámetros de la vista,
+    así un cambio en los datos deja de encontrar las entradas antiguas, que se
+    acaban expulsando. Los resultados se comparten: no modificarlos in situ.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, max_entries=128, name="derivats"):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # Prefijo de los contadores de aciertos del panel de rendimiento
+        self.name = name
+        self._entries = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, factory):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                edv_perf.count(f"{self.name}: hit")
+                return entry[0]
+            self.misses += 1
+        edv_perf.count(f"{self.name}: miss")
+
+        value = factory()
+        size = estimate_bytes(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            # Un resultado mayor que todo el presupuesto no se guarda
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self._bytes += size
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                oldest = next(iter(self._entries))
+                self._bytes -= self._entries.pop(oldest)[1]
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+# ============================================================================
+# FASES E1..E9 (MATRIZ uint8)
+# ============================================================================
+
+# Estados ordenados por avance; 0 = sin informar o valor desconocido
+PHASE_STATES = {"Pendent": 1, "Actiu": 2, "Fet": 3}
+PHASE_STATE_NAMES = {0: "-", 1: "Pendent", 2: "Actiu", 3: "Fet"}
+
+PHASE_LABELS = [
+    "E1 Programació", "E2 Adquisició", "E3 Planejament", "E4 Projecte d'urbanització",
+    "E5 Projecte de reparcel·lació", "E6 Execució obres", "E7 Comercialització",
+    "E8 Compte liquidació", "E9 Tancament",
+]
+
+
+def encode_phase_column(values):
+    """Códigos uint8 de una columna de fase vía sus categorías (una comparación por categoría, no por fila)"""
+    categorical = pd.Categorical(values)
+    normalized = {state.lower(): code for state, code in PHASE_STATES.items()}
+    lookup = np.zeros(len(categorical.categories) + 1, dtype=np.uint8)
+    for i, category in enumerate(categorical.categories):
+        lookup[i] = normalized.get(str(category).strip().lower(), 0)
+    # El código -1 (nulo) cae en la última posición, que vale 0
+    return lookup[categorical.codes]
+
+
+class PhaseMatrix:
+    """Estados E1..E9 de cada ficha como matriz densa (fichas × 9) de uint8.
+
+    Guarda junto a la matriz las claves de cada fila (id, sector, any,
+    codigo_actuacion), así que no depende del orden del frame y se mantiene
+    con apply_delta (protocolo de DeltaFrame.attach).
+    """
+
+    def __init__(self, keys, matrix):
+        self.keys = keys.reset_index(drop=True)
+        self.matrix = matrix
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df):
+        columns = edv_db.PHASE_COLUMNS
+        matrix = np.zeros((len(df), len(columns)), dtype=np.uint8)
+        for k, column in enumerate(columns):
+            if column in df.columns:
+                matrix[:, k] = encode_phase_column(df[column])
+        keys = pd.DataFrame({
+            "id": df["id"].to_numpy(),
+            "sector": df["sector"].astype(object).to_numpy(),
+            "any": df["any"].to_numpy(),
+            "codigo_actuacion": df["codigo_actuacion"].astype(object).to_numpy(),
+        })
+        return cls(keys, matrix)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + int(self.keys.memory_usage(deep=True).sum())
+
+    def apply_delta(self, removed, added):
+        """Quita las filas sustituidas y añade las nuevas (removed=None: recarga completa)"""
+        new = PhaseMatrix.from_frame(added)
+        with self._lock:
+            if removed is None:
+                keys, matrix = new.keys, new.matrix
+            else:
+                keep = ~np.isin(self.keys["id"].to_numpy(), removed["id"].to_numpy())
+                keys = pd.concat([self.keys[keep], new.keys], ignore_index=True)
+                matrix = np.concatenate([self.matrix[keep], new.matrix])
+            self.keys, self.matrix = keys, matrix
+
+    def select(self, sectors=None, years=None):
+        """(claves, matriz) de la selección"""
+        keys, matrix = self.keys, self.matrix
+        mask = np.ones(len(keys), dtype=bool)
+        if sectors is not None:
+            mask &= keys["sector"].isin(list(sectors)).to_numpy()
+        if years is not None:
+            mask &= keys["any"].isin(list(years)).to_numpy()
+        return keys[mask].reset_index(drop=True), matrix[mask]
+
+    def funnel(self, sectors=None, years=None, by=("sector",)):
+        """Por grupo y fase: fichas, fichas que han llegado a la fase (Actiu o Fet) y completadas (Fet)"""
+        keys, matrix = self.select(sectors, years)
+        by = list(by)
+        if keys.empty:
+            return pd.DataFrame(columns=by + ["fase", "ordre", "fitxes", "arribades", "completades"])
+        codes, groups = pd.factorize(pd.MultiIndex.from_frame(keys[by]))
+        n_groups, n_phases = len(groups), matrix.shape[1]
+
+        def group_sum(values):
+            totals = np.zeros((n_groups, n_phases), dtype=np.int64)
+            np.add.at(totals, codes, values)
+            return totals
+
+        fitxes = np.bincount(codes, minlength=n_groups)
+        reached = group_sum(matrix >= PHASE_STATES["Actiu"])
+        completed = group_sum(matrix == PHASE_STATES["Fet"])
+        result = pd.DataFrame(np.repeat(groups.to_frame(index=False).to_numpy(), n_phases, axis=0), columns=by)
+        result["fase"] = np.tile(PHASE_LABELS, n_groups)
+        result["ordre"] = np.tile(np.arange(1, n_phases + 1), n_groups)
+        result["fitxes"] = np.repeat(fitxes, n_phases)
+        result["arribades"] = reached.ravel()
+        result["completades"] = completed.ravel()
+        return result.sort_values(by + ["ordre"], kind="mergesort").reset_index(drop=True)
+
+    def phase_durations(self, sectors=None, years=None):
+        """Años en estado Actiu de cada fase por codigo_actuacion.
+
+        Entre dos EDV consecutivos del mismo codigo_actuacion, los años que los
+        separan se atribuyen a las fases activas en el primero. El último EDV de
+        cada actuación no tiene siguiente: sus fases activas no suman (NaN si
+        la fase nunca se ha observado activa con un EDV posterior).
+        """
+        keys, matrix = self.select(sectors, years)
+        if keys.empty:
+            return pd.DataFrame(columns=["codigo_actuacion", "sector", "EDVs"] + PHASE_LABELS)
+        codes, actuacions = pd.factorize(keys["codigo_actuacion"])
+        years_array = keys["any"].to_numpy(dtype="float64")
+        order = np.lexsort((years_array, codes))
+        codes, years_array, matrix = codes[order], years_array[order], matrix[order]
+
+        same = np.zeros(len(codes), dtype=bool)
+        same[:-1] = codes[1:] == codes[:-1]
+        gap = np.zeros(len(codes))
+        gap[:-1] = np.where(same[:-1], years_array[1:] - years_array[:-1], 0.0)
+
+        active = (matrix == PHASE_STATES["Actiu"]) & same[:, None]
+        durations = np.zeros((len(actuacions), matrix.shape[1]))
+        observed = np.zeros((len(actuacions), matrix.shape[1]), dtype=bool)
+        np.add.at(durations, codes, active * gap[:, None])
+        np.logical_or.at(observed, codes, active)
+
+        result = pd.DataFrame(np.where(observed, durations, np.nan), columns=PHASE_LABELS)
+        result.insert(0, "codigo_actuacion", np.asarray(actuacions, dtype=object))
+        first = np.r_[True, ~same[:-1]]
+        result.insert(1, "sector", keys["sector"].to_numpy()[order][first])
+        result.insert(2, "EDVs", np.bincount(codes, minlength=len(actuacions)))
+        return result
+
+    def duration_summary(self, sectors=None, years=None):
+        """Años medios en cada fase por sector (solo actuaciones observadas en la fase)"""
+        durations = self.phase_durations(sectors, years)
+        if durations.empty:
+            return pd.DataFrame(columns=PHASE_LABELS)
+        summary = durations.groupby("sector", sort=True)[PHASE_LABELS].mean()
+        summary.index.name = "sector"
+        return summary
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+API JSON DE SOLO LECTURA - EDV Comparator
+Servidor HTTP asíncrono (asyncio, sin dependencias) sobre la misma capa de
+datos que Home.py: DeltaFrame con deltas, índice sector × any y cubo de
+agregados. Cada respuesta se identifica por la versión de los datos y la
+consulta (ETag): con If-None-Match igual se responde 304 sin recalcular, y el
+cuerpo (también comprimido con gzip) se guarda en un LRU acotado.
+
+Uso:
+    python edv_api.py --port 8502
+    python edv_api.py --sqlite edv.sqlite    # sustituto local de MySQL
+
+Endpoints (GET; sector y any se pueden repetir):
+    /api/version                                    versión de los datos
+    /api/filtres                                    sectores y años disponibles
+    /api/fitxes?sector=..&any=..&columns=a,b&sort=col&desc=1&limit=50&after=[..]
+    /api/sectors?sector=..&any=..                   resumen por sector (Visió General)
+    /api/series?sector=..&metric=Total_Ingressos    media por sector y año
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import sys
+import warnings
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import edv_analytics
+import edv_db
+
+DEFAULT_PORT = 8502
+MAX_PAGE_SIZE = 1000
+# Por debajo de este tamaño gzip no compensa
+GZIP_MIN_BYTES = 1024
+KEEP_ALIVE_SECONDS = 15
+# Mismas métricas que el "Gràfic d'Evolució" de Análisi Individual
+SERIES_METRICS = ["Total_Ingressos", "Despesa_total", "Aprofitament_privats", "Obres_durbanitzacio"]
+
+
+class ApiError(Exception):
+    """Petición incorrecta: se responde con `status` y el mensaje en JSON"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _plain(value):
+    """Valor JSON nativo (numpy → Python, NaN → null)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, "item") else value
+
+
+def _json_body(payload):
+    """Serializa el dict de respuesta; los DataFrame van como lista de registros"""
+    parts = []
+    for key, value in payload.items():
+        if isinstance(value, pd.DataFrame):
+            encoded = value.to_json(orient="records", force_ascii=False, date_format="iso", double_precision=10)
+        else:
+            encoded = json.dumps(value, ensure_ascii=False, default=str)
+        parts.append(f"{json.dumps(key)}: {encoded}")
+    return ("{" + ", ".join(parts) + "}").encode("utf-8")
+
+
+# ============================================================================
+# PARÁMETROS DE LA CONSULTA
+# ============================================================================
+
+def _list_param(params, name):
+    """Parámetro repetible (?sector=A&sector=B) o separado por comas"""
+    values = [item.strip() for value in params.get(name, []) for item in value.split(",")]
+    return [value for value in values if value] or None
+
+
+def _int_list_param(params, name):
+    values = _list_param(params, name)
+    try:
+        return None if values is None else [int(value) for value in values]
+    except ValueError:
+        raise ApiError(f"❌ '{name}' ha de ser un enter")
+
+
+def _int_param(params, name, default, maximum):
+    try:
+        value = int(params.get(name, [default])[0])
+    except ValueError:
+        raise ApiError(f"❌ '{name}' ha de ser un enter")
+    if not 1 <= value <= maximum:
+        raise ApiError(f"❌ '{name}' ha d'estar entre 1 i {maximum}")
+    return value
+
+
+def _columns_param(params, name, available, default):
+    columns = _list_param(params, name) or default
+    unknown = [column for column in columns if column not in available]
+    if unknown:
+        raise ApiError(f"❌ Columnes desconegudes: {', '.join(unknown)}")
+    return columns
+
+
+def _cursor_param(params, name, df, keys):
+    """Cursor keyset (lista JSON, un valor por clave) convertido a los tipos de sus columnas"""
+    raw = params.get(name, [None])[0]
+    if raw is None:
+        return None
+    message = f"❌ '{name}' ha de ser el cursor JSON de la pàgina anterior"
+    # Las mismas claves que usa page_from_frame para generar el cursor
+    keys = [(column, descending) for column, descending in keys if column in df.columns]
+    try:
+        values = json.loads(raw)
+    except ValueError:
+        raise ApiError(message)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ApiError(message)
+
+    cursor = []
+    for (column, _), value in zip(keys, values):
+        dtype = df[column].dtype
+        if value is None:
+            cursor.append(None)
+        elif pd.api.types.is_bool_dtype(dtype):
+            if not isinstance(value, bool):
+                raise ApiError(message)
+            cursor.append(value)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ApiError(message)
+            cursor.append(value)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            try:
+                cursor.append(pd.Timestamp(value))
+            except (ValueError, TypeError):
+                raise ApiError(message)
+        elif isinstance(value, str):
+            cursor.append(value)
+        else:
+            raise ApiError(message)
+    return tuple(cursor)
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+class EdvApi:
+    """Vistas JSON sobre la tabla completa cacheada (DeltaFrame)"""
+
+    def __init__(self, pool, float_dtype="float64", refresh_seconds=30, full_reload_seconds=3600,
+                 cache_mb=64, gzip_min_bytes=GZIP_MIN_BYTES):
+        self.pool = pool
+        self.frame = edv_db.DeltaFrame(refresh_seconds=refresh_seconds, full_reload_seconds=full_reload_seconds,
+                                       float_dtype=float_dtype)
+        # Cuerpos de respuesta y estructuras derivadas, por versión de los datos
+        self.cache = edv_analytics.DerivedFrameCache(max_bytes=cache_mb * 1024 ** 2, max_entries=1024)
+        self.gzip_min_bytes = gzip_min_bytes
+        self.routes = {
+            "/api/version": self.version_view,
+            "/api/filtres": self.filters_view,
+            "/api/fitxes": self.fitxes_view,
+            "/api/sectors": self.sectors_view,
+            "/api/series": self.series_view,
+        }
+
+    # ---- datos ---------------------------------------------------------------
+
+    def _current(self):
+        """(df, versión) coherentes; la primera vez carga y luego revalida en segundo plano"""
+        if self.frame.df is None:
+            with self.pool.connection() as conn:
+                self.frame.refresh(conn)
+        elif self.frame.is_stale():
+            self.frame.refresh_in_background(self.pool)
+        # frame.version cambia también con las recargas completas (bajas), que no mueven la marca
+        df, version, (last_id, last_changed) = self.frame.state()
+        return df, f"{version}:{last_id}:{_plain(last_changed)}"
+
+    def _select(self, df, sectors, years):
+        index = self.frame.attach("index", edv_db.SectorYearIndex.from_frame)
+        return index.take(df, sectors, years)
+
+    def _cube(self, df, version):
+        return self.cache.get_or_compute(("cube", version), lambda: edv_analytics.SectorYearCube.from_frame(df))
+
+    # ---- vistas --------------------------------------------------------------
+
+    def version_view(self, df, version, params):
+        return {"version": version, "rows": len(df)}
+
+    def filters_view(self, df, version, params):
+        return {"version": version, **edv_db.filter_options_from_frame(df)}
+
+    def fitxes_view(self, df, version, params):
+        """Fitxes filtradas, paginadas por keyset (cursor `after` de la respuesta anterior)"""
+        sectors, years = _list_param(params, "sector"), _int_list_param(params, "any")
+        columns = _columns_param(params, "columns", df.columns, list(df.columns))
+        sort = params.get("sort", [None])[0]
+        descending = params.get("desc", ["0"])[0] in ("1", "true")
+        limit = _int_param(params, "limit", edv_db.PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            keys = edv_db.page_keys(sort, descending, allowed=df.columns)
+        except ValueError as e:
+            raise ApiError(f"❌ {e}")
+        after = _cursor_param(params, "after", df, keys)
+
+        selection = self._select(df, sectors, years)
+        order = self.cache.get_or_compute(
+            ("ordre", version, tuple(sectors or ()), tuple(years or ()), tuple(keys)),
+            lambda: edv_db.keyset_order(selection, keys))
+        page, next_cursor = edv_db.page_from_frame(selection, keys, after, limit, order=order)
+        return {
+            "version": version,
+            "total": len(selection),
+            "next": None if next_cursor is None else [_plain(value) for value in next_cursor],
+            "fitxes": page[columns],
+        }
+
+    def sectors_view(self, df, version, params):
+        """Resumen por sector de la Visió General (registros, años, medias)"""
+        sectors, years = _list_param(params, "sector"), _int_list_param(params, "any")
+        summary = self._cube(df, version).sector_summary(sectors, years)
+        return {"version": version, "sectors": summary.reset_index()}
+
+    def series_view(self, df, version, params):
+        """Media anual por sector de las métricas pedidas"""
+        cube = self._cube(df, version)
+        sectors, years = _list_param(params, "sector"), _int_list_param(params, "any")
+        metrics = _columns_param(params, "metric", cube.columns,
+                                 [m for m in SERIES_METRICS if m in cube.columns])
+        cells = cube.cells
+        mask = np.ones(len(cells), dtype=bool)
+        if sectors is not None:
+            mask &= cells.index.get_level_values("sector").isin(sectors)
+        if years is not None:
+            mask &= cells.index.get_level_values("any").isin(years)
+        selected = cells[mask]
+        counts = selected[[f"{m}__count" for m in metrics]].to_numpy()
+        sums = selected[[f"{m}__sum" for m in metrics]].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / np.where(counts > 0, counts, 1), np.nan)
+        series = pd.DataFrame(means, index=selected.index, columns=metrics).reset_index()
+        series.insert(2, "fitxes", selected["n"].astype(int).to_numpy())
+        return {"version": version, "series": series}
+
+    # ---- HTTP ----------------------------------------------------------------
+
+    def _render(self, view, df, version, params):
+        body = _json_body(view(df, version, params))
+        compressed = gzip.compress(body, compresslevel=5) if len(body) >= self.gzip_min_bytes else None
+        return body, compressed
+
+    def respond(self, method, target, headers):
+        """Atiende una petición; devuelve (status, cabeceras, cuerpo)"""
+        try:
+            return self._respond(method, target, headers)
+        except Exception as e:
+            # Un error inesperado responde 500 en lugar de cerrar la conexión sin respuesta
+            return self._error(HTTPStatus.INTERNAL_SERVER_ERROR, f"❌ Error intern: {e}")
+
+    def _respond(self, method, target, headers):
+        url = urlsplit(target)
+        view = self.routes.get(url.path.rstrip("/"))
+        if view is None:
+            return self._error(HTTPStatus.NOT_FOUND, f"❌ Ruta desconeguda: {url.path}")
+        if method not in ("GET", "HEAD"):
+            return self._error(HTTPStatus.METHOD_NOT_ALLOWED, "❌ Només GET i HEAD")
+
+        params = parse_qs(url.query)
+        try:
+            df, version = self._current()
+        except Exception as e:
+            return self._error(HTTPStatus.SERVICE_UNAVAILABLE, f"❌ Error carregant les dades: {e}")
+
+        query = urlencode(sorted((name, value) for name, values in params.items() for value in values))
+        etag = '"%s"' % hashlib.sha1(f"{version}|{url.path}|{query}".encode("utf-8")).hexdigest()[:20]
+        response_headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag in self._if_none_match(headers):
+            return HTTPStatus.NOT_MODIFIED, response_headers, b""
+
+        try:
+            body, compressed = self.cache.get_or_compute(("resposta", etag),
+                                                         lambda: self._render(view, df, version, params))
+        except ApiError as e:
+            return self._error(e.status, str(e))
+        if compressed is not None and "gzip" in headers.get("accept-encoding", ""):
+            body = compressed
+            response_headers["Content-Encoding"] = "gzip"
+        response_headers["Content-Type"] = "application/json; charset=utf-8"
+        return HTTPStatus.OK, response_headers, body
+
+    @staticmethod
+    def _if_none_match(headers):
+        value = headers.get("if-none-match", "")
+        return {tag.strip().removeprefix("W/") for tag in value.split(",") if tag.strip()}
+
+    @staticmethod
+    def _error(status, message):
+        body = json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+        return HTTPStatus(status), {"Content-Type": "application/json; charset=utf-8"}, body
+
+
+# ============================================================================
+# SERVIDOR (asyncio)
+# ============================================================================
+
+async def _read_request(reader):
+    """(método, ruta, cabeceras) o None si el cliente cerró la conexión"""
+    request_line = await asyncio.wait_for(reader.readline(), timeout=KEEP_ALIVE_SECONDS)
+    if not request_line.strip():
+        return None
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method.upper(), target, headers
+
+
+async def handle_connection(api, reader, writer):
+    """Conexión HTTP/1.1 con keep-alive; el trabajo de pandas va a un hilo"""
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except (asyncio.TimeoutError, ValueError):
+                break
+            if request is None:
+                break
+            method, target, headers = request
+            status, response_headers, body = await asyncio.to_thread(api.respond, method, target, headers)
+            keep_alive = headers.get("connection", "").lower() != "close"
+
+            lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+            lines += [f"{name}: {value}" for name, value in response_headers.items()]
+            lines.append(f"Content-Length: {len(body)}")
+            lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            if method != "HEAD":
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(api, host="127.0.0.1", port=DEFAULT_PORT):
+    server = await asyncio.start_server(lambda r, w: handle_connection(api, r, w), host, port)
+    print(f"✅ API EDV a http://{host}:{port}/api/version")
+    async with server:
+        await server.serve_forever()
+
+
+def build_pool(args):
+    """Pool sobre MySQL (secrets.toml) o sobre el sustituto SQLite"""
+    if args.sqlite:
+        import edv_sqlite
+        return edv_db.ConnectionPool({"path": args.sqlite}, size=args.pool_size,
+                                     connect=lambda path: edv_sqlite.connect(path, create=False))
+    return edv_db.ConnectionPool.from_config(edv_db.read_secrets(args.secrets)["mysql"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="API JSON de només lectura de les fitxes EDV")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--secrets", default=edv_db.SECRETS_PATH, help="secrets.toml amb la secció [mysql]")
+    parser.add_argument("--sqlite", default=None, help="BD SQLite substituta en lloc de MySQL")
+    parser.add_argument("--pool-size", type=int, default=edv_db.DEFAULT_POOL_SIZE)
+    parser.add_argument("--refresh-seconds", type=int, default=30, help="cada quant es comproven canvis")
+    parser.add_argument("--cache-mb", type=int, default=64, help="memòria per a respostes cacheades")
+    parser.add_argument("--float-dtype", default="float64", choices=["float64", "float32"])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # pandas avisa con cualquier conexión DB-API que no sea sqlite3 o SQLAlchemy (también con MySQL)
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    api = EdvApi(build_pool(args), float_dtype=args.float_dtype, refresh_seconds=args.refresh_seconds,
+                 cache_mb=args.cache_mb)
+    try:
+        asyncio.run(serve(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
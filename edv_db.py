@@ -0,0 +1,1276 @@
+# -*- coding: utf-8 -*-
+
+"""
+CAPA DE DATOS - EDV Comparator
+Acceso a MySQL compartido por la app Streamlit y los scripts auxiliares
+"""
+
+import functools
+import json
+import os
+import queue
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import mysql.connector
+import numpy as np
+import pandas as pd
+
+import edv_perf
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow es opcional: sin él no hay snapshot local
+    pa = None
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# ============================================================================
+# POOL DE CONEXIONES
+# ============================================================================
+
+# Claves de secrets.toml que se pasan tal cual a mysql.connector.connect
+CONNECT_KEYS = ("host", "port", "user", "password", "database")
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_POOL_TIMEOUT = 10.0
+
+
+class PoolTimeoutError(Exception):
+    """No se ha liberado ninguna conexión dentro del tiempo de espera"""
+
+
+def connection_params(db_config):
+    """Extrae de la configuración [mysql] los parámetros de conexión"""
+    return {key: db_config[key] for key in CONNECT_KEYS if key in db_config}
+
+
+class ConnectionPool:
+    """Pool de conexiones MySQL con health check y contadores de uso"""
+
+    def __init__(self, connect_params, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 connect=mysql.connector.connect):
+        self._params = dict(connect_params)
+        # connect(**params) abre una conexión nueva (otro driver, p.ej. el sustituto SQLite)
+        self._connect = connect
+        self.size = int(size)
+        self.timeout = float(timeout)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "hits": 0,
+            "misses": 0,
+            "health_failures": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    @classmethod
+    def from_config(cls, db_config):
+        """Crea el pool a partir de la sección [mysql] de secrets.toml"""
+        return cls(
+            connection_params(db_config),
+            size=db_config.get("pool_size", DEFAULT_POOL_SIZE),
+            timeout=db_config.get("pool_timeout", DEFAULT_POOL_TIMEOUT),
+        )
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _is_healthy(self, conn):
+        """Comprueba que una conexión ociosa sigue viva"""
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Toma una conexión del pool (espera hasta `timeout` si está lleno)"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("timeouts")
+            raise PoolTimeoutError(f"Pool de conexiones agotado ({self.size}) tras {self.timeout:.1f}s")
+        waited = time.perf_counter() - start
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self._is_healthy(conn):
+                    self._count("hits")
+                    return conn
+                self._count("health_failures")
+                self._close_quietly(conn)
+
+            self._count("misses")
+            return self._connect(**self._params)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        """Devuelve una conexión al pool (o la cierra si está rota)"""
+        try:
+            if not discard:
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                except Exception:
+                    discard = True
+            if discard:
+                self._close_quietly(conn)
+            else:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager: presta una conexión y la devuelve al salir"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        """Copia de los contadores del pool"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["size"] = self.size
+        snapshot["idle"] = self._idle.qsize()
+        checkouts = snapshot["checkouts"]
+        snapshot["hit_rate"] = snapshot["hits"] / checkouts if checkouts else 0.0
+        snapshot["wait_time_avg"] = snapshot["wait_time_total"] / checkouts if checkouts else 0.0
+        return snapshot
+
+    def close_all(self):
+        """Cierra todas las conexiones ociosas"""
+        while True:
+            try:
+                self._close_quietly(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# ============================================================================
+# CONFIGURACIÓN FUERA DE STREAMLIT
+# ============================================================================
+
+SECRETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+
+def read_secrets(path=SECRETS_PATH):
+    """Lee secrets.toml para los scripts de línea de comandos (sin st.secrets)"""
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def connect_from_secrets(path=SECRETS_PATH):
+    """Conexión MySQL directa con la sección [mysql] de secrets.toml (scripts de un solo uso)"""
+    return mysql.connector.connect(**connection_params(read_secrets(path)["mysql"]))
+
+
+# ============================================================================
+# CONSULTAS SOBRE edv_fitxes
+# ============================================================================
+
+EDV_COLUMNS = [
+    "id", "sector", "codigo_actuacion", "nom_actuacio", "municipi", "any",
+    "Codi_Actuacio", "Tipus_actuacio", "Sol_sistemes", "Sol_zones", "Total_ambit",
+    "Sol_viari", "Sostre_zones", "edificabilitat_bruta", "Sostre_residencial",
+    "Nombre_dhabitatges", "Hipotesis", "E1__Programacio", "E2__Adquisicio",
+    "E3__Planejament", "E4__Projecte_durbanitzacio", "E5__Projecte_de_reparcellacio",
+    "E6__Execucio_obres", "E7__Comercialitzacio", "E8__Compte_liquidacio_definitiva",
+    "E9__Tancament_darrera_venda", "Incasol", "Altres_propietaris", "Sol_amb_drets",
+    "Sol_sense_drets", "Titular_Adm__Act_", "pct_drets_Adm__Act_", "Total_Ingressos",
+    "Cessio_Administracio_actuant", "despesa_comercialitzacio", "Aprofitament_privats",
+    "Obres_durbanitzacio", "Connexions_i_canons", "Indemnitzacions", "Gestio",
+    "Despesa_a_assumir_Adm__Act_", "Despesa_total", "Calcul_dinamic_Taxa_aplicada",
+    "Calcul_dinamic_Valor_residual_sol", "Calcul_dinamic_Valor_unitari",
+    "Calcul_dinamic_Temps_mig_retorn", "Calcul_estatic_Taxa_aplicada",
+    "Calcul_estatic_Valor_residual_sol", "Calcul_estatic_Valor_unitari",
+    "Calcul_estatic_Temps_mig_retorn",
+]
+
+# Grupos de columnas (secciones del diccionario de datos) que se cargan bajo demanda
+COLUMN_GROUPS = {
+    "identificadors": ["id", "sector", "codigo_actuacion", "nom_actuacio", "municipi", "any"],
+    "info_sector": [
+        "Codi_Actuacio", "Tipus_actuacio", "Sol_sistemes", "Sol_zones", "Total_ambit", "Sol_viari",
+        "Sostre_zones", "edificabilitat_bruta", "Sostre_residencial", "Nombre_dhabitatges",
+    ],
+    "info_edv": [
+        "Hipotesis", "E1__Programacio", "E2__Adquisicio", "E3__Planejament", "E4__Projecte_durbanitzacio",
+        "E5__Projecte_de_reparcellacio", "E6__Execucio_obres", "E7__Comercialitzacio",
+        "E8__Compte_liquidacio_definitiva", "E9__Tancament_darrera_venda",
+    ],
+    "propietat": [
+        "Incasol", "Altres_propietaris", "Sol_amb_drets", "Sol_sense_drets", "Titular_Adm__Act_",
+        "pct_drets_Adm__Act_",
+    ],
+    "edv_sector": [
+        "Total_Ingressos", "Cessio_Administracio_actuant", "despesa_comercialitzacio", "Aprofitament_privats",
+        "Obres_durbanitzacio", "Connexions_i_canons", "Indemnitzacions", "Gestio",
+        "Despesa_a_assumir_Adm__Act_", "Despesa_total",
+    ],
+    "calcul": [
+        "Calcul_dinamic_Taxa_aplicada", "Calcul_dinamic_Valor_residual_sol", "Calcul_dinamic_Valor_unitari",
+        "Calcul_dinamic_Temps_mig_retorn", "Calcul_estatic_Taxa_aplicada", "Calcul_estatic_Valor_residual_sol",
+        "Calcul_estatic_Valor_unitari", "Calcul_estatic_Temps_mig_retorn",
+    ],
+}
+
+# Siempre presentes: filtros, ordenación y clave de unión entre grupos
+BASE_GROUP = "identificadors"
+
+
+def columns_for_groups(groups):
+    """Columnas de los grupos indicados (más los identificadores) en el orden de EDV_COLUMNS"""
+    wanted = set(COLUMN_GROUPS[BASE_GROUP])
+    for group in groups or ():
+        wanted.update(COLUMN_GROUPS[group])
+    return [column for column in EDV_COLUMNS if column in wanted]
+
+
+def build_where(sectors=None, years=None):
+    """Construye el WHERE parametrizado para los filtros de sector y año.
+
+    None significa "sin filtro"; una lista vacía no selecciona ninguna fila.
+    Los filtros usan los índices idx_sector, idx_any e idx_sector_codigo_any.
+    """
+    clauses, params = [], []
+    for column, values in (("sector", sectors), ("any", years)):
+        if values is None:
+            continue
+        values = list(values)
+        if not values:
+            clauses.append("1 = 0")
+            continue
+        clauses.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+        params.extend(values)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def build_select(columns=None, sectors=None, years=None):
+    """Construye el SELECT de edv_fitxes con filtros y orden sector, any DESC"""
+    where, params = build_where(sectors, years)
+    query = f"""
+        SELECT {', '.join(columns or EDV_COLUMNS)}
+        FROM edv_fitxes
+        {where}
+        ORDER BY sector, any DESC
+    """
+    return query, params
+
+
+def read_edv_fitxes(conn, sectors=None, years=None, columns=None):
+    """Lee edv_fitxes (opcionalmente filtrado) tal como lo devuelve el driver"""
+    query, params = build_select(columns, sectors, years)
+    with edv_perf.span("db: consulta"):
+        df = pd.read_sql(query, conn, params=params or None)
+
+    # Eliminar columnas duplicadas
+    return df.loc[:, ~df.columns.duplicated()]
+
+
+def load_edv_fitxes(conn, sectors=None, years=None, columns=None, float_dtype="float64"):
+    """Lee edv_fitxes (opcionalmente filtrado) con tipos compactos"""
+    return apply_schema_types(read_edv_fitxes(conn, sectors, years, columns), float_dtype)
+
+
+def fetch_sector_year_aggregates(conn, columns):
+    """Agregados count/sum/min/max por (sector, any) calculados en MySQL"""
+    expressions = ["sector", "any", "COUNT(*) AS n"]
+    for column in columns:
+        expressions += [
+            f"COUNT({column}) AS {column}__count",
+            f"SUM({column}) AS {column}__sum",
+            f"MIN({column}) AS {column}__min",
+            f"MAX({column}) AS {column}__max",
+        ]
+    query = f"""
+        SELECT {', '.join(expressions)}
+        FROM edv_fitxes
+        GROUP BY sector, any
+    """
+    df = pd.read_sql(query, conn)
+    numeric = [column for column in df.columns if column not in ("sector", "any")]
+    df[numeric] = df[numeric].apply(pd.to_numeric, errors="coerce").astype("float64")
+    return df
+
+
+def fetch_filter_options(conn):
+    """Obtiene solo los valores distintos de sector y año para los filtros"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT sector FROM edv_fitxes WHERE sector IS NOT NULL ORDER BY sector")
+        sectors = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT any FROM edv_fitxes WHERE any IS NOT NULL ORDER BY any")
+        years = [int(row[0]) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    return {"sectors": sectors, "years": years}
+
+
+def filter_options_from_frame(df):
+    """Mismas listas que fetch_filter_options, calculadas sobre un frame local"""
+    sectors = sorted(df["sector"].dropna().unique().tolist())
+    years = sorted(int(year) for year in df["any"].dropna().unique())
+    return {"sectors": sectors, "years": years}
+
+
+# ============================================================================
+# PAGINACIÓN POR KEYSET
+# ============================================================================
+
+# Orden natural de la tabla; id desempata y hace única cada posición
+DEFAULT_PAGE_KEYS = (("sector", False), ("any", True), ("id", False))
+
+PAGE_SIZE = 50
+
+
+def page_keys(sort_column=None, descending=False, allowed=EDV_COLUMNS):
+    """Claves (columna, descendente) de la paginación: la columna elegida y después el orden natural"""
+    if sort_column is None:
+        return list(DEFAULT_PAGE_KEYS)
+    if sort_column not in allowed:
+        raise ValueError(f"Columna d'ordenació desconeguda: {sort_column}")
+    return [(sort_column, descending)] + [key for key in DEFAULT_PAGE_KEYS if key[0] != sort_column]
+
+
+def _sql_param(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _keyset_sql(keys, after, not_null):
+    """Condición 'posterior al cursor' y ORDER BY para las claves, con los NULL al final"""
+    order, terms, params = [], [], []
+    equal, equal_params = [], []
+    for i, (column, descending) in enumerate(keys):
+        nullable = column not in not_null
+        order.append(f"{column} IS NULL, " * nullable + f"{column}{' DESC' if descending else ''}")
+        if after is None:
+            continue
+        value = _sql_param(after[i])
+        if value is None:
+            # Tras un NULL solo quedan filas con el mismo NULL y claves siguientes mayores
+            equal.append(f"{column} IS NULL")
+            continue
+        condition = f"{column} {'<' if descending else '>'} %s"
+        if nullable:
+            condition = f"({condition} OR {column} IS NULL)"
+        terms.append(" AND ".join(equal + [condition]))
+        params.extend(equal_params + [value])
+        equal.append(f"{column} = %s")
+        equal_params.append(value)
+    if after is None:
+        return None, [], ", ".join(order)
+    keyset = " OR ".join(f"({term})" for term in terms) if terms else "1 = 0"
+    return f"({keyset})", params, ", ".join(order)
+
+
+def build_page_query(columns, sectors=None, years=None, keys=DEFAULT_PAGE_KEYS, after=None, page_size=PAGE_SIZE):
+    """SELECT de una página: filtros + condición de keyset + ORDER BY + LIMIT (una fila extra)"""
+    where, params = build_where(sectors, years)
+    # Con filtro IN la columna ya no puede ser NULL y el orden puede usar el índice
+    not_null = {"id"} | ({"sector"} if sectors is not None else set()) | ({"any"} if years is not None else set())
+    keyset, keyset_params, order = _keyset_sql(keys, after, not_null)
+    if keyset:
+        where = f"{where} AND {keyset}" if where else f"WHERE {keyset}"
+        params = params + keyset_params
+    select_columns = list(dict.fromkeys(list(columns) + [column for column, _ in keys]))
+    query = f"""
+        SELECT {', '.join(select_columns)}
+        FROM edv_fitxes
+        {where}
+        ORDER BY {order}
+        LIMIT {int(page_size) + 1}
+    """
+    return query, params
+
+
+def read_page(conn, columns, sectors=None, years=None, keys=DEFAULT_PAGE_KEYS, after=None,
+              page_size=PAGE_SIZE, float_dtype="float64"):
+    """Lee una página de MySQL; devuelve (página, cursor de la siguiente o None)"""
+    query, params = build_page_query(columns, sectors, years, keys, after, page_size)
+    with edv_perf.span("db: pàgina"):
+        page = pd.read_sql(query, conn, params=params or None)
+    page = apply_schema_types(page, float_dtype)
+    next_cursor = None
+    if len(page) > page_size:
+        page = page.iloc[:page_size]
+        next_cursor = tuple(page[column].iloc[-1] for column, _ in keys)
+    return page.reset_index(drop=True), next_cursor
+
+
+def keyset_order(df, keys):
+    """Posiciones de las filas de df en el orden de las claves (NULL al final)"""
+    columns = [column for column, _ in keys]
+    ordered = df[columns].reset_index(drop=True).sort_values(
+        columns, ascending=[not descending for _, descending in keys], na_position="last", kind="mergesort")
+    return ordered.index.to_numpy()
+
+
+def page_from_frame(df, keys=DEFAULT_PAGE_KEYS, after=None, page_size=PAGE_SIZE, order=None):
+    """Misma paginación que read_page sobre un frame en memoria (order: keyset_order precalculado)"""
+    keys = [(column, descending) for column, descending in keys if column in df.columns]
+    if order is None:
+        order = keyset_order(df, keys)
+    start = 0
+    if after is not None:
+        mask = np.zeros(len(order), dtype=bool)
+        equal = np.ones(len(order), dtype=bool)
+        for (column, descending), value in zip(keys, after):
+            values = df[column].to_numpy()[order]
+            missing = pd.isna(values)
+            if value is None or (not isinstance(value, str) and pd.isna(value)):
+                equal &= missing
+                continue
+            present = values[~missing]
+            beyond, same = missing.copy(), np.zeros(len(values), dtype=bool)
+            beyond[~missing] = (present < value) if descending else (present > value)
+            same[~missing] = present == value
+            mask |= equal & beyond
+            equal &= same
+        # El orden es monótono respecto al cursor: la página empieza en el primer True
+        start = int(mask.argmax()) if mask.any() else len(order)
+    positions = order[start:start + page_size]
+    page = df.iloc[positions].reset_index(drop=True)
+    next_cursor = None
+    if start + page_size < len(order):
+        next_cursor = tuple(page[column].iloc[-1] for column, _ in keys)
+    return page, next_cursor
+
+
+# ============================================================================
+# TIPOS SEGÚN EL ESQUEMA (create_edv_database.sql)
+# ============================================================================
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "create_edv_database.sql")
+
+PHASE_COLUMNS = [
+    "E1__Programacio", "E2__Adquisicio", "E3__Planejament", "E4__Projecte_durbanitzacio",
+    "E5__Projecte_de_reparcellacio", "E6__Execucio_obres", "E7__Comercialitzacio",
+    "E8__Compte_liquidacio_definitiva", "E9__Tancament_darrera_venda",
+]
+
+# Columnas de texto con pocos valores distintos: se guardan como category
+CATEGORICAL_COLUMNS = ["sector", "municipi", "Tipus_actuacio", "Hipotesis", "Titular_Adm__Act_"] + PHASE_COLUMNS
+
+_COLUMN_DEF = re.compile(r"^\s*(\w+)\s+(INT|DECIMAL|VARCHAR|TIMESTAMP)\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema(path=SCHEMA_PATH):
+    """Lee el CREATE TABLE y devuelve {columna: tipo SQL base}"""
+    schema = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                match = _COLUMN_DEF.match(line)
+                if match:
+                    schema[match.group(1)] = match.group(2).upper()
+    except OSError:
+        pass
+    return schema
+
+
+def measure_columns(schema=None):
+    """Columnas numéricas de medida (DECIMAL/INT) sin id ni any, en orden del esquema"""
+    schema = load_schema() if schema is None else schema
+    return [column for column, sql_type in schema.items()
+            if sql_type in ("DECIMAL", "INT") and column not in ("id", "any")]
+
+
+def apply_schema_types(df, float_dtype="float64", schema=None):
+    """Convierte DECIMAL a float, INT a entero y los textos repetitivos a category.
+
+    pd.read_sql devuelve los DECIMAL como objetos Decimal en columnas object:
+    lentos, pesados e invisibles para select_dtypes(include=[np.number]).
+    """
+    schema = load_schema() if schema is None else schema
+    with edv_perf.span("db: decodificar tipus"):
+        df = df.copy()
+        for column in df.columns:
+            sql_type = schema.get(column)
+            if sql_type == "DECIMAL":
+                df[column] = pd.to_numeric(df[column], errors="coerce").astype(float_dtype)
+            elif sql_type == "INT" and df[column].dtype == object:
+                df[column] = pd.to_numeric(df[column], errors="coerce")
+            elif column in CATEGORICAL_COLUMNS and df[column].dtype != "category":
+                df[column] = df[column].astype("category")
+    return df
+
+
+def memory_report(before, after):
+    """Memoria por columna antes y después de tipar (bytes)"""
+    old = before.memory_usage(deep=True, index=False)
+    new = after.memory_usage(deep=True, index=False).reindex(old.index)
+    report = pd.DataFrame({
+        "dtype_abans": before.dtypes.astype(str),
+        "dtype_despres": after.dtypes.reindex(old.index).astype(str),
+        "bytes_abans": old,
+        "bytes_despres": new,
+    })
+    report["estalvi"] = report["bytes_abans"] - report["bytes_despres"]
+    return report.sort_values("estalvi", ascending=False)
+
+
+# ============================================================================
+# ESCRITURA POR LOTES (UPSERT)
+# ============================================================================
+
+# Mismos campos obligatorios que el formulario de "➕ Afegir Registre"
+REQUIRED_FIELDS = {
+    "sector": "Sector",
+    "codigo_actuacion": "Código Actuación",
+    "nom_actuacio": "Nom Actuació",
+    "municipi": "Municipi",
+    "any": "Any",
+    "Hipotesis": "Hipòtesis",
+    "Titular_Adm__Act_": "Titular Adm. Act.",
+}
+
+UPSERT_KEY = ("codigo_actuacion", "any")
+UPSERT_BATCH_SIZE = 500
+
+
+def normalize_records(df, decimal_comma=False, schema=None):
+    """Limpia un lote de filas: textos sin espacios, vacíos a NaN y filas vacías fuera.
+
+    Con `decimal_comma` los números con formato catalán (1.234,56) se pasan a 1234.56.
+    """
+    schema = load_schema() if schema is None else schema
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        text = df[column].astype("string").str.strip()
+        if decimal_comma and schema.get(column) in ("DECIMAL", "INT"):
+            text = text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+        df[column] = text.mask(text == "")
+    return df.dropna(how="all").reset_index(drop=True)
+
+
+def validate_records(df, schema=None, min_year=2000, max_year=2050):
+    """Valida un lote completo de una vez; devuelve una lista de errores por fila"""
+    schema = load_schema() if schema is None else schema
+    errors = []
+
+    unknown = [column for column in df.columns if column not in schema or column == "id"]
+    if unknown:
+        errors.append(f"• Columnes desconegudes: {', '.join(unknown)}")
+
+    def add_errors(mask, message):
+        for row in np.flatnonzero(mask.to_numpy()):
+            errors.append(f"• Fila {row + 1}: {message}")
+
+    for column, label in REQUIRED_FIELDS.items():
+        if column not in df.columns:
+            errors.append(f"• Falta la columna obligatòria {label} ({column})")
+            continue
+        add_errors(df[column].isna(), f"{label} és obligatori")
+
+    for column in df.columns:
+        if schema.get(column) not in ("DECIMAL", "INT"):
+            continue
+        numeric = pd.to_numeric(df[column], errors="coerce")
+        add_errors(numeric.isna() & df[column].notna(), f"{column} no és numèric")
+
+    if "any" in df.columns:
+        years = pd.to_numeric(df["any"], errors="coerce")
+        add_errors(years.notna() & ((years < min_year) | (years > max_year) | (years % 1 != 0)),
+                   f"Any ha de ser un enter entre {min_year} i {max_year}")
+
+    if all(column in df.columns for column in UPSERT_KEY):
+        add_errors(df.duplicated(list(UPSERT_KEY), keep="first") & df["codigo_actuacion"].notna(),
+                   "Código Actuación i Any repetits dins del lot")
+    return errors
+
+
+def _sql_values(df, schema):
+    """Convierte el lote a tuplas de valores Python (None para NaN)"""
+    df = df.copy()
+    for column in df.columns:
+        sql_type = schema.get(column)
+        if sql_type == "DECIMAL":
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+        elif sql_type == "INT":
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+    df = df.astype(object).where(df.notna(), None)
+    return [tuple(row) for row in df.itertuples(index=False, name=None)]
+
+
+def upsert_records(conn, df, batch_size=UPSERT_BATCH_SIZE, schema=None):
+    """Inserta o actualiza (por codigo_actuacion, any) un lote en una sola transacción.
+
+    Usa INSERT multi-VALUES ... ON DUPLICATE KEY UPDATE en bloques de
+    `batch_size` filas; si un bloque falla se deshace todo el lote.
+    Devuelve el número de filas afectadas según MySQL (1 por alta, 2 por cambio).
+    """
+    schema = load_schema() if schema is None else schema
+    columns = [column for column in df.columns if column != "id"]
+    rows = _sql_values(df[columns], schema)
+    if not rows:
+        return 0
+
+    row_placeholder = f"({', '.join(['%s'] * len(columns))})"
+    updates = ", ".join(f"{column} = VALUES({column})" for column in columns if column not in UPSERT_KEY)
+    affected = 0
+
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            query = (
+                f"INSERT INTO edv_fitxes ({', '.join(columns)}) "
+                f"VALUES {', '.join([row_placeholder] * len(batch))} "
+                f"ON DUPLICATE KEY UPDATE {updates}"
+            )
+            cursor.execute(query, [value for row in batch for value in row])
+            affected += cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return affected
+
+
+# ============================================================================
+# REFRESCO INCREMENTAL (DELTAS)
+# ============================================================================
+
+CHANGE_COLUMN = "updated_at"
+
+
+def has_change_tracking(conn):
+    """Comprueba si edv_fitxes tiene la columna de control de cambios"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SHOW COLUMNS FROM edv_fitxes LIKE '{CHANGE_COLUMN}'")
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+
+
+def fetch_watermark(conn, tracked):
+    """Devuelve (máximo id, última modificación) de la tabla"""
+    cursor = conn.cursor()
+    try:
+        if tracked:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0), MAX({CHANGE_COLUMN}) FROM edv_fitxes")
+            max_id, max_changed = cursor.fetchone()
+        else:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM edv_fitxes")
+            max_id, max_changed = cursor.fetchone()[0], None
+    finally:
+        cursor.close()
+    return int(max_id), max_changed
+
+
+def count_rows(conn):
+    """Número de filas de la tabla (las bajas no mueven la marca de versión)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM edv_fitxes")
+        return int(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def sort_edv_frame(df):
+    """Reordena como la consulta original: sector, any DESC"""
+    return df.sort_values(["sector", "any"], ascending=[True, False], kind="mergesort").reset_index(drop=True)
+
+
+def _unchanged_rows(df, delta):
+    """Máscara de las filas de delta idénticas (mismo id y valores) a las de df"""
+    current = df[df["id"].isin(delta["id"])]
+    if current.empty:
+        return pd.Series(False, index=delta.index)
+    columns = [column for column in delta.columns if column in current.columns]
+    # object: las category de df y delta pueden tener categorías distintas
+    old = current[columns].astype(object).set_index("id")
+    new = delta[columns].astype(object).set_index("id", drop=False)
+    old = old.reindex(new.index)
+    new = new.drop(columns="id")
+    same = (old == new) | (old.isna() & new.isna())
+    return pd.Series(same.all(axis=1).to_numpy() & delta["id"].isin(current["id"]).to_numpy(), index=delta.index)
+
+
+class DeltaFrame:
+    """Selección (sectores, años) cacheada que se refresca con deltas.
+
+    La primera carga lee la selección completa. Después solo se leen las filas
+    con id mayor que el último visto o con updated_at posterior a la última
+    modificación vista, y se fusionan por id. Las bajas no se detectan con
+    deltas, por eso cada `full_reload_seconds` se hace una recarga completa.
+    """
+
+    def __init__(self, sectors=None, years=None, columns=None,
+                 refresh_seconds=30, full_reload_seconds=3600, float_dtype="float64"):
+        self.sectors = None if sectors is None else list(sectors)
+        self.years = None if years is None else list(years)
+        self.columns = list(columns or EDV_COLUMNS)
+        self.max_group_workers = 4
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.float_dtype = float_dtype
+        self.df = None
+        self.memory_report = None
+        self.version = 0
+        self._last_id = 0
+        self._last_changed = None
+        self._tracked = None
+        self._checked_at = 0.0
+        self._loaded_at = 0.0
+        self.validated = False
+        self.derived = {}
+        self._listeners = []
+        self._background = None
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        return self.df is None or time.monotonic() - self._checked_at >= self.refresh_seconds
+
+    def mark_stale(self):
+        self._checked_at = 0.0
+
+    def attach(self, name, factory):
+        """Estructura derivada mantenida junto al frame.
+
+        `factory(df)` la construye una vez; después su método apply_delta(removed,
+        added) recibe cada cambio (removed=None en recargas completas).
+        """
+        with self._lock:
+            if name not in self.derived:
+                derived = factory(self.df)
+                self.derived[name] = derived
+                self._listeners.append(derived.apply_delta)
+            return self.derived[name]
+
+    def detach(self, name):
+        """Quita una estructura derivada: deja de recibir cambios; devuelve la quitada (o None)"""
+        with self._lock:
+            derived = self.derived.pop(name, None)
+            if derived is not None:
+                self._listeners.remove(derived.apply_delta)
+            return derived
+
+    def _notify(self, removed, added):
+        for listener in self._listeners:
+            listener(removed, added)
+
+    def watermark(self):
+        """Versión de los datos cargados: (máximo id, última modificación)"""
+        return self._last_id, self._last_changed
+
+    def state(self):
+        """(df, version, watermark) leídos juntos: un refresco no puede colarse entre ellos"""
+        with self._lock:
+            return self.df, self.version, (self._last_id, self._last_changed)
+
+    def missing_groups(self, groups):
+        return [group for group in groups
+                if not set(COLUMN_GROUPS[group]).issubset(self.columns)]
+
+    def require_groups(self, groups, pool):
+        """Asegura que los grupos de columnas están cargados.
+
+        Antes de la primera carga solo amplía la consulta. Con el frame ya
+        cargado, cada grupo que falta se lee (id + columnas del grupo, con los
+        mismos filtros) en paralelo con su propia conexión del pool y se une
+        por id. Las filas cambiadas entre tanto se corrigen en el siguiente delta.
+        """
+        with self._lock:
+            missing = self.missing_groups(groups)
+            if not missing:
+                return 0
+            if self.df is None:
+                self.columns = columns_for_groups(list(groups) + self._loaded_groups())
+                return 0
+
+            def fetch(group):
+                with pool.connection() as conn:
+                    part = read_edv_fitxes(conn, self.sectors, self.years, ["id"] + COLUMN_GROUPS[group])
+                return apply_schema_types(part, self.float_dtype)
+
+            with edv_perf.span("db: grups de columnes"):
+                workers = max(1, min(len(missing), self.max_group_workers, getattr(pool, "size", 1)))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="edv-groups") as executor:
+                    parts = list(executor.map(fetch, missing))
+
+            df = self.df
+            for part in parts:
+                part = part[[c for c in part.columns if c == "id" or c not in df.columns]]
+                df = df.merge(part, on="id", how="left")
+            self.columns = columns_for_groups(missing + self._loaded_groups())
+            self.df = df[[c for c in self.columns if c in df.columns]]
+            self.version += 1
+            return len(missing)
+
+    def _loaded_groups(self):
+        return [group for group in COLUMN_GROUPS if set(COLUMN_GROUPS[group]).issubset(self.columns)]
+
+    def adopt(self, df):
+        """Sustituye df por un frame idéntico (la vista compartida de lo que se acaba de publicar)"""
+        with self._lock:
+            if self.df is not None and len(df) == len(self.df):
+                self.df = df
+
+    def seed(self, df, watermark):
+        """Sirve un frame ya conocido (p.ej. el snapshot local) hasta revalidarlo"""
+        with self._lock:
+            self.df = df
+            self.columns = [column for column in EDV_COLUMNS if column in df.columns]
+            self._notify(None, df)
+            self._last_id, self._last_changed = watermark
+            self._loaded_at = time.monotonic()
+            self._checked_at = 0.0
+            self.validated = False
+            self.version += 1
+
+    def refresh_in_background(self, pool, on_change=None):
+        """Revalida contra MySQL en un hilo; mientras tanto se sigue sirviendo df"""
+        with self._lock:
+            if self._background is not None and self._background.is_alive():
+                return
+
+            def run():
+                try:
+                    with pool.connection() as conn:
+                        changed = self.refresh(conn)
+                    if changed and on_change is not None:
+                        on_change(self)
+                except Exception:
+                    # Sin BD se sigue sirviendo lo que haya; se reintenta en el próximo acceso
+                    self.mark_stale()
+
+            self._background = threading.Thread(target=run, name="edv-revalidate", daemon=True)
+            self._background.start()
+
+    def refresh(self, conn, force_full=False):
+        """Actualiza el frame; devuelve el número de filas nuevas o modificadas"""
+        with self._lock:
+            if not force_full and not self.is_stale():
+                return 0
+            now = time.monotonic()
+            if self._tracked is None:
+                self._tracked = has_change_tracking(conn)
+            with edv_perf.span("db: marca de versió"):
+                last_id, last_changed = fetch_watermark(conn, self._tracked)
+
+            if force_full or self.df is None or now - self._loaded_at >= self.full_reload_seconds:
+                raw = read_edv_fitxes(conn, self.sectors, self.years, self.columns)
+                self.df = apply_schema_types(raw, self.float_dtype)
+                self.memory_report = memory_report(raw, self.df)
+                self._notify(None, self.df)
+                self._loaded_at = now
+                changed = len(self.df)
+            elif last_id == self._last_id and last_changed == self._last_changed:
+                changed = 0
+            else:
+                changed = self._merge_delta(conn)
+
+            self._last_id, self._last_changed = last_id, last_changed
+            self._checked_at = now
+            self.validated = True
+            if changed:
+                self.version += 1
+            return changed
+
+    def _merge_delta(self, conn):
+        """Lee las filas nuevas/modificadas de la selección y las fusiona por id.
+
+        Las filas modificadas que han salido de la selección solo se leen por id
+        para quitarlas. Devuelve las filas que realmente han cambiado: las que
+        se releen por compartir el último segundo y no difieren no cuentan.
+        """
+        changes = "id > %s"
+        change_params = [self._last_id]
+        if self._tracked and self._last_changed is not None:
+            # >= para no perder cambios del mismo segundo; la fusión por id es idempotente
+            changes += f" OR {CHANGE_COLUMN} >= %s"
+            change_params.append(self._last_changed)
+        where, params = build_where(self.sectors, self.years)
+        selection = where[len("WHERE "):] if where else "1 = 1"
+        with edv_perf.span("db: consulta delta"):
+            delta = pd.read_sql(f"SELECT {', '.join(self.columns)} FROM edv_fitxes "
+                                f"WHERE ({changes}) AND ({selection})",
+                                conn, params=change_params + params)
+            left = []
+            if where and self._tracked and self._last_changed is not None:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(f"SELECT id FROM edv_fitxes WHERE {CHANGE_COLUMN} >= %s AND NOT ({selection})",
+                                   [self._last_changed] + params)
+                    left = [row[0] for row in cursor.fetchall()]
+                finally:
+                    cursor.close()
+        delta = apply_schema_types(delta, self.float_dtype)
+
+        delta = delta[~_unchanged_rows(self.df, delta)]
+        moved_out = self.df["id"].isin(left)
+        removed = self.df["id"].isin(delta["id"]) | moved_out
+        changed = len(delta) + int(moved_out.sum())
+        if not changed:
+            return 0
+        self._notify(self.df[removed], delta)
+        merged = pd.concat([self.df[~removed], delta], ignore_index=True)
+        # concat de category con categorías distintas devuelve object: se vuelve a tipar
+        self.df = sort_edv_frame(apply_schema_types(merged, self.float_dtype))
+        return changed
+
+
+class DeltaStore:
+    """Conjunto acotado (LRU) de DeltaFrame por selección de filtros"""
+
+    def __init__(self, max_entries=32, **frame_kwargs):
+        self.max_entries = max_entries
+        self._frame_kwargs = frame_kwargs
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def get(self, sectors=None, years=None):
+        key = (None if sectors is None else tuple(sectors), None if years is None else tuple(years))
+        with self._lock:
+            frame = self._frames.pop(key, None)
+            if frame is None:
+                frame = DeltaFrame(sectors, years, **self._frame_kwargs)
+            self._frames[key] = frame
+            while len(self._frames) > self.max_entries:
+                self._frames.pop(next(iter(self._frames)))
+        return frame
+
+    def mark_stale(self):
+        """Fuerza la comprobación de deltas en el próximo acceso a cada selección"""
+        with self._lock:
+            frames = list(self._frames.values())
+        for frame in frames:
+            frame.mark_stale()
+
+
+# ============================================================================
+# SNAPSHOT LOCAL (Arrow IPC)
+# ============================================================================
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "edv_fitxes.arrow")
+
+_SNAPSHOT_META_KEY = b"edv_version"
+
+
+def snapshot_available():
+    return pa is not None
+
+
+def _normalize_watermark(watermark):
+    """(last_id, last_changed) comparables: el driver puede devolver datetime o texto"""
+    last_id, last_changed = watermark
+    return int(last_id), None if last_changed is None else pd.Timestamp(last_changed)
+
+
+def _arrow_table(df):
+    """Tabla Arrow con los float sin máscara de nulos (NaN como valor): se leen sin copia"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type) and table.column(i).null_count:
+            values = df[field.name].to_numpy(dtype=field.type.to_pandas_dtype(), na_value=np.nan)
+            table = table.set_column(i, field, pa.array(values))
+    return table
+
+
+def write_snapshot(df, watermark, path=SNAPSHOT_PATH):
+    """Guarda el frame tipado con su versión de datos (escritura atómica)"""
+    if pa is None:
+        return False
+    last_id, last_changed = _normalize_watermark(watermark)
+    version = {
+        "last_id": last_id,
+        "last_changed": last_changed.isoformat() if last_changed is not None else None,
+        "rows": len(df),
+        "written_at": time.time(),
+        # Cambia en cada escritura: distingue versiones con la misma marca (p.ej. tras bajas)
+        "generation": time.time_ns(),
+    }
+    table = _arrow_table(df)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_SNAPSHOT_META_KEY] = json.dumps(version).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return True
+
+
+def read_snapshot_version(path=SNAPSHOT_PATH):
+    """Lee el snapshot (memory-mapped); devuelve (df, metadatos de versión) o (None, None)"""
+    if pa is None or not os.path.exists(path):
+        return None, None
+    try:
+        # El mapa no se cierra explícitamente: las columnas sin copia lo referencian
+        source = pa.memory_map(path, "r")
+        table = pa.ipc.open_file(source).read_all()
+        version = json.loads(table.schema.metadata[_SNAPSHOT_META_KEY])
+        df = table.to_pandas(split_blocks=True)
+    except Exception:
+        return None, None
+    return df, version
+
+
+def snapshot_watermark(version):
+    """(last_id, last_changed) de los metadatos de un snapshot"""
+    last_changed = version.get("last_changed")
+    if last_changed is not None:
+        last_changed = pd.Timestamp(last_changed).to_pydatetime()
+    return version["last_id"], last_changed
+
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    """Lee el snapshot (memory-mapped); devuelve (df, watermark) o (None, None)"""
+    df, version = read_snapshot_version(path)
+    if df is None:
+        return None, None
+    return df, snapshot_watermark(version)
+
+
+class SharedDataset:
+    """Tabla completa compartida por todos los procesos del host.
+
+    La versión publicada es un fichero Arrow IPC mapeado en memoria: los
+    procesos que lo leen comparten las mismas páginas (en /dev/shm si
+    snapshot_path apunta allí) y las columnas numéricas son vistas sin copia,
+    de solo lectura. Publicar escribe un fichero nuevo y lo sustituye con
+    os.replace: los lectores ven la versión anterior o la nueva, nunca una a
+    medias, y las vistas antiguas siguen siendo válidas mientras se usen.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.df = None
+        self.watermark = None
+        self.generation = None
+        self._signature = None
+        # Generación del snapshot que sirve cada frame (publicada o adoptada)
+        self._held = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def current(self):
+        """(df, watermark) de la última versión publicada; solo se relee si cambió el fichero"""
+        signature = self._file_signature()
+        with self._lock:
+            if signature is not None and signature != self._signature:
+                df, version = read_snapshot_version(self.path)
+                if df is not None:
+                    self.df, self.watermark, self._signature = df, snapshot_watermark(version), signature
+                    self.generation = version.get("generation")
+            return self.df, self.watermark
+
+    def publish(self, frame):
+        """Publica el frame y le pasa las vistas compartidas en lugar de su copia privada"""
+        if not write_snapshot(frame.df, frame.watermark(), self.path):
+            return False
+        df, watermark = self.current()
+        if df is not None and _normalize_watermark(watermark) == _normalize_watermark(frame.watermark()):
+            frame.adopt(df)
+            self._held[frame] = self.generation
+        return True
+
+    def sync(self, frame):
+        """Sirve en `frame` la versión publicada (p.ej. por otro proceso) si es más reciente"""
+        df, watermark = self.current()
+        if df is None or frame.df is df:
+            return False
+        published, loaded = _normalize_watermark(watermark), _normalize_watermark(frame.watermark())
+        newer = published[0] > loaded[0] or (
+            published[1] is not None and (loaded[1] is None or published[1] > loaded[1]))
+        older = published[0] < loaded[0] or (
+            loaded[1] is not None and (published[1] is None or published[1] < loaded[1]))
+        # Misma marca pero otra generación: p.ej. una recarga completa tras borrar filas
+        held = self._held.get(frame)
+        republished = (held is not None and self.generation is not None
+                       and self.generation > held and not older)
+        if frame.df is None or newer or republished:
+            frame.seed(df, watermark)
+            self._held[frame] = self.generation
+            return True
+        return False
+
+
+def filter_frame(df, sectors=None, years=None):
+    """Aplica en pandas el mismo filtro que build_where"""
+    mask = pd.Series(True, index=df.index)
+    if sectors is not None:
+        mask &= df["sector"].isin(list(sectors))
+    if years is not None:
+        mask &= df["any"].isin(list(years))
+    return df[mask].reset_index(drop=True)
+
+
+# ============================================================================
+# ÍNDICE SECTOR × ANY (RANGOS DE FILAS)
+# ============================================================================
+
+def _key_counts(df):
+    """Número de filas por (sector, any)"""
+    if df is None or df.empty:
+        return pd.Series(dtype="int64")
+    keys = pd.DataFrame({"sector": df["sector"].astype(object), "any": df["any"]})
+    return keys.groupby(["sector", "any"], sort=False).size()
+
+
+class SectorYearIndex:
+    """Rangos contiguos de filas por sector y por (sector, any) de un frame ordenado.
+
+    Con el frame ordenado por sector, any DESC cada celda (sector, any) ocupa
+    un bloque de filas; filtrar es concatenar los bloques seleccionados, en
+    proporción a las filas elegidas y no al tamaño del frame. Se mantiene con
+    apply_delta (mismo protocolo que DeltaFrame.attach) a partir de los conteos
+    por celda, sin volver a recorrer el frame.
+    """
+
+    def __init__(self, cells, contiguous=True):
+        self._state = self._build_state(cells, contiguous)
+
+    @staticmethod
+    def _build_state(cells, contiguous):
+        cells = cells.reset_index(drop=True)
+        n_rows = int(cells["stop"].iloc[-1]) if len(cells) else 0
+        sector_ranges = {}
+        if contiguous and len(cells):
+            bounds = cells.assign(n=cells["stop"] - cells["start"]).groupby("sector", sort=False).agg(
+                start=("start", "min"), stop=("stop", "max"), n=("n", "sum"))
+            # Solo si cada sector es un único bloque (sus años son consecutivos en el frame)
+            if ((bounds["stop"] - bounds["start"]) == bounds["n"]).all():
+                sector_ranges = {sector: (int(row.start), int(row.stop)) for sector, row in bounds.iterrows()}
+        return cells, sector_ranges, n_rows, contiguous
+
+    @classmethod
+    def from_frame(cls, df):
+        """Detecta los bloques (sector, any) recorriendo el frame una vez"""
+        if df is None or df.empty:
+            return cls(pd.DataFrame({"sector": [], "any": [], "start": [], "stop": []}))
+        codes, uniques = pd.factorize(df["sector"])
+        years = df["any"].to_numpy()
+        change = np.ones(len(df), dtype=bool)
+        change[1:] = (codes[1:] != codes[:-1]) | (years[1:] != years[:-1])
+        starts = np.flatnonzero(change)
+        stops = np.append(starts[1:], len(df))
+        cells = pd.DataFrame({
+            "sector": np.asarray(uniques, dtype=object)[codes[starts]],
+            "any": years[starts],
+            "start": starts,
+            "stop": stops,
+        })
+        # Sin orden (o con sectores nulos) no hay bloques únicos: take() filtrará con máscaras
+        contiguous = not (codes[starts] < 0).any() and not cells.duplicated(["sector", "any"]).any()
+        return cls(cells, contiguous)
+
+    @classmethod
+    def from_counts(cls, counts):
+        """Bloques en el orden de sort_edv_frame a partir de filas por (sector, any)"""
+        cells = counts[counts > 0].rename("n").reset_index()
+        cells = cells.sort_values(["sector", "any"], ascending=[True, False], kind="mergesort")
+        stops = cells["n"].cumsum().to_numpy()
+        cells = pd.DataFrame({"sector": cells["sector"].to_numpy(), "any": cells["any"].to_numpy(),
+                              "start": stops - cells["n"].to_numpy(), "stop": stops})
+        return cls(cells)
+
+    @property
+    def n_rows(self):
+        return self._state[2]
+
+    def counts(self):
+        cells = self._state[0]
+        counts = pd.Series((cells["stop"] - cells["start"]).to_numpy(),
+                           index=pd.MultiIndex.from_frame(cells[["sector", "any"]]))
+        return counts.groupby(level=[0, 1], sort=False).sum()
+
+    def apply_delta(self, removed, added):
+        """Actualiza los bloques tras un cambio en el frame (removed=None: recarga completa)"""
+        if removed is None:
+            new = SectorYearIndex.from_frame(added)
+        else:
+            counts = self.counts()
+            counts = counts.add(_key_counts(added), fill_value=0).sub(_key_counts(removed), fill_value=0)
+            new = SectorYearIndex.from_counts(counts.astype("int64"))
+        # Sustitución atómica del estado
+        self._state = new._state
+
+    def ranges(self, sectors=None, years=None):
+        """(inicios, finales) de los bloques seleccionados, fusionando los adyacentes"""
+        cells, sector_ranges, _, _ = self._state
+        if years is None and sectors is not None and sector_ranges:
+            bounds = sorted(sector_ranges[s] for s in sectors if s in sector_ranges)
+            starts = np.array([b[0] for b in bounds], dtype=np.int64)
+            stops = np.array([b[1] for b in bounds], dtype=np.int64)
+        else:
+            mask = np.ones(len(cells), dtype=bool)
+            if sectors is not None:
+                mask &= cells["sector"].isin(list(sectors)).to_numpy()
+            if years is not None:
+                mask &= cells["any"].isin(list(years)).to_numpy()
+            starts = cells["start"].to_numpy(dtype=np.int64)[mask]
+            stops = cells["stop"].to_numpy(dtype=np.int64)[mask]
+        if len(starts) > 1:
+            adjacent = starts[1:] == stops[:-1]
+            starts, stops = starts[np.r_[True, ~adjacent]], stops[np.r_[~adjacent, True]]
+        return starts, stops
+
+    def take(self, df, sectors=None, years=None):
+        """Equivale a filter_frame(df, sectors, years) para el frame indexado"""
+        _, _, n_rows, contiguous = self._state
+        if not contiguous or len(df) != n_rows:
+            # Índice de otra versión del frame (o frame sin ordenar): filtro normal
+            return filter_frame(df, sectors, years)
+        starts, stops = self.ranges(sectors, years)
+        if len(starts) == 0:
+            return df.iloc[0:0].reset_index(drop=True)
+        if len(starts) == 1:
+            return df.iloc[starts[0]:stops[0]].reset_index(drop=True)
+        lengths = stops - starts
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return df.iloc[np.arange(lengths.sum()) + offsets].reset_index(drop=True)
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+"""
+MOTOR ANALÍTICO EMBEBIDO - EDV Comparator
+Copia columnar de la selección cargada en DuckDB (o SQLite si no está
+instalado) sobre la que las vistas lanzan sus agregaciones como SQL. Mismos
+resultados que los cálculos de pandas de Home.py; se elige con
+`analytics_engine` en la sección [app] de secrets.toml.
+"""
+
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import edv_perf
+
+try:
+    import duckdb
+except ImportError:  # duckdb es opcional: sin él el motor SQL es SQLite
+    duckdb = None
+
+# "pandas" = cálculos en memoria de Home.py (cubo, acumuladores, NumPy)
+ENGINES = ("pandas", "duckdb", "sqlite")
+DESCRIBE_INDEX = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+QUANTILES = (0.25, 0.5, 0.75)
+TABLE = "edv"
+# SQLite admite como máximo 2000 columnas por consulta
+_MAX_SELECT_COLUMNS = 1800
+
+
+def available_engines():
+    return [engine for engine in ENGINES if engine != "duckdb" or duckdb is not None]
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def engine_columns(df):
+    """Columnas que se copian al motor: claves de filtro y todas las numéricas"""
+    numeric = df.select_dtypes(include=[np.number]).columns.tolist()
+    return ["sector"] + [column for column in dict.fromkeys(["id", "any"] + numeric) if column in df.columns]
+
+
+# ============================================================================
+# MOTOR SQL
+# ============================================================================
+
+class SqlEngine:
+    """Tabla `edv` con la selección (sectores, años) de un DeltaFrame.
+
+    Se mantiene con apply_delta como el resto de estructuras enganchadas al
+    frame: las recargas completas rehacen la tabla y los deltas borran por id
+    e insertan las filas nuevas. Las subclases definen la conexión, la carga,
+    query(sql, params) y las funciones que cada dialecto resuelve de forma nativa.
+    """
+
+    name = None
+
+    def __init__(self, df):
+        self.columns = engine_columns(df)
+        self.numeric = [column for column in self.columns if column not in ("sector", "id")]
+        self._lock = threading.Lock()
+        self.conn = self._connect()
+        self._load(self._prepare(df), replace=True)
+
+    # ---- carga ---------------------------------------------------------------
+
+    def _prepare(self, df):
+        data = df[[column for column in self.columns if column in df.columns]].copy()
+        data["sector"] = data["sector"].astype(object)
+        return data
+
+    def apply_delta(self, removed, added):
+        with self._lock:
+            if removed is None:
+                self._load(self._prepare(added), replace=True)
+                return
+            if len(removed):
+                ids = [int(i) for i in removed["id"]]
+                placeholders = ", ".join([self.placeholder] * len(ids))
+                self.conn.execute(f"DELETE FROM {TABLE} WHERE id IN ({placeholders})", ids)
+            if len(added):
+                self._load(self._prepare(added), replace=False)
+
+    # ---- consultas -----------------------------------------------------------
+
+    placeholder = "?"
+
+    def _where(self, sectors=None, years=None, extra=()):
+        clauses, params = list(extra), []
+        if sectors is not None:
+            clauses.append(f"sector IN ({', '.join([self.placeholder] * len(sectors))})")
+            params.extend(str(sector) for sector in sectors)
+        if years is not None:
+            clauses.append(f"{_quote('any')} IN ({', '.join([self.placeholder] * len(years))})")
+            params.extend(int(year) for year in years)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def sector_summary(self, sectors=None, years=None):
+        """Igual que SectorYearCube.sector_summary"""
+        where, params = self._where(sectors, years)
+        year = _quote("any")
+        result = self.query(
+            f"SELECT sector, COUNT(*) AS n, MIN({year}) AS any_min, MAX({year}) AS any_max, "
+            f"AVG(Total_Ingressos) AS ingressos, AVG(Despesa_total) AS despesa "
+            f"FROM {TABLE}{where} GROUP BY sector ORDER BY sector", params)
+        summary = pd.DataFrame({
+            "Registres": result["n"].astype(int).to_numpy(),
+            "Any Min": result["any_min"].to_numpy(),
+            "Any Max": result["any_max"].to_numpy(),
+            "Ingressos Mitjans": result["ingressos"].astype("float64").to_numpy(),
+            "Despesa Mitjana": result["despesa"].astype("float64").to_numpy(),
+        }, index=pd.Index(result["sector"], name="sector"))
+        return summary
+
+    def means(self, columns, sectors=None, years=None):
+        """Media por sector (equivale a df.groupby('sector')[columns].mean())"""
+        where, params = self._where(sectors, years)
+        selects = ", ".join(f"AVG({_quote(c)}) AS {_quote(c)}" for c in columns)
+        result = self.query(f"SELECT sector, {selects} FROM {TABLE}{where} GROUP BY sector ORDER BY sector", params)
+        means = result.set_index("sector")[list(columns)].astype("float64")
+        means.columns.name = None
+        return means
+
+    def _moments(self, columns, where, params):
+        """count, mean, min, max y desviación típica (ddof=1, dos pasadas) por columna"""
+        selects = []
+        for c in columns:
+            q = _quote(c)
+            selects += [f"COUNT({q})", f"AVG({q})", f"MIN({q})", f"MAX({q})"]
+        first = self.query(f"SELECT {', '.join(selects)} FROM {TABLE}{where}", params).iloc[0].to_numpy()
+        stats = pd.DataFrame(first.astype("float64").reshape(len(columns), 4),
+                             index=columns, columns=["count", "mean", "min", "max"])
+
+        # Segunda pasada centrada en la media: sin la cancelación de Σx² − (Σx)²/n
+        centred = ", ".join(f"SUM(({_quote(c)} - {self.placeholder}) * ({_quote(c)} - {self.placeholder}))"
+                            for c in columns)
+        centred_params = [float(m) if pd.notna(m) else 0.0 for m in stats["mean"] for _ in range(2)]
+        squares = self.query(f"SELECT {centred} FROM {TABLE}{where}", centred_params + params)
+        squares = squares.iloc[0].to_numpy(dtype="float64", na_value=np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["std"] = np.where(stats["count"] > 1, np.sqrt(squares / (stats["count"] - 1)), np.nan)
+        return stats
+
+    def describe(self, columns, sectors=None, years=None):
+        """Igual que df[columns].describe()"""
+        where, params = self._where(sectors, years)
+        with edv_perf.span(f"motor {self.name}: describe"):
+            stats = self._moments(list(columns), where, params)
+            for column in columns:
+                stats.loc[column, ["25%", "50%", "75%"]] = self._quantiles(
+                    column, where, params, int(stats.loc[column, "count"]))
+        return stats[DESCRIBE_INDEX].T
+
+    def aggregate(self, columns, stat, sectors=None, years=None):
+        """Igual que getattr(df[columns], stat)() para mean, std, min y max"""
+        where, params = self._where(sectors, years)
+        with edv_perf.span(f"motor {self.name}: {stat}"):
+            return self._moments(list(columns), where, params)[stat]
+
+    def correlation(self, columns, sectors=None, years=None):
+        """Igual que df[columns].corr() (Pearson con observaciones completas por pareja)"""
+        columns = list(columns)
+        where, params = self._where(sectors, years)
+        with edv_perf.span(f"motor {self.name}: correlacions"):
+            values = self._correlation(columns, where, params)
+        return pd.DataFrame(values, index=columns, columns=columns)
+
+    def histogram(self, column, nbins=30, sectors=None, years=None, group="sector"):
+        """Igual que edv_analytics.histogram_by_group sobre la selección"""
+        q = _quote(column)
+        where, params = self._where(sectors, years)
+        bounds = self.query(f"SELECT MIN({q}) AS lo, MAX({q}) AS hi FROM {TABLE}{where}", params).iloc[0]
+        if pd.isna(bounds["lo"]):
+            return pd.DataFrame(columns=[group, "bin_start", "bin_end", "bin_center", "count"])
+
+        edges = np.histogram_bin_edges(np.array([bounds["lo"], bounds["hi"]], dtype="float64"), bins=nbins)
+        # Mismo criterio que searchsorted(edges, x, side="right") - 1 recortado a [0, nbins - 1]
+        cases = " ".join(f"WHEN {q} < {self.placeholder} THEN {i}" for i in range(nbins - 1))
+        bin_expr = f"CASE {cases} ELSE {nbins - 1} END"
+        bin_where, bin_params = self._where(sectors, years, extra=[f"{q} IS NOT NULL"])
+        counts = self.query(
+            f"SELECT sector, {bin_expr} AS bin, COUNT(*) AS n FROM {TABLE}{bin_where} GROUP BY sector, bin",
+            [float(edge) for edge in edges[1:nbins]] + bin_params)
+        groups = self.query(f"SELECT DISTINCT sector FROM {TABLE}{where} ORDER BY sector", params)["sector"]
+
+        grid = np.zeros((len(groups), nbins), dtype=np.int64)
+        positions = pd.Index(groups).get_indexer(counts["sector"])
+        grid[positions, counts["bin"].astype(int).to_numpy()] = counts["n"].astype(np.int64).to_numpy()
+        result = pd.DataFrame({
+            group: np.repeat(groups.to_numpy(dtype=object), nbins),
+            "bin_start": np.tile(edges[:-1], len(groups)),
+            "bin_end": np.tile(edges[1:], len(groups)),
+            "count": grid.ravel(),
+        })
+        result["bin_center"] = (result["bin_start"] + result["bin_end"]) / 2
+        return result
+
+
+class DuckDbEngine(SqlEngine):
+    """DuckDB en memoria: ejecución vectorizada y en paralelo (un hilo por núcleo)"""
+
+    name = "duckdb"
+
+    def __init__(self, df, threads=None):
+        self.threads = threads
+        super().__init__(df)
+
+    def _connect(self):
+        conn = duckdb.connect(database=":memory:")
+        if self.threads:
+            conn.execute(f"SET threads = {int(self.threads)}")
+        return conn
+
+    def _prepare(self, df):
+        data = super()._prepare(df)
+        # Float64 con NA: DuckDB guarda NULL (un NaN de NumPy sería un valor y estropearía AVG/MIN)
+        for column in data.columns:
+            if pd.api.types.is_float_dtype(data[column]):
+                data[column] = data[column].astype("Float64")
+        return data
+
+    def _load(self, data, replace):
+        self.conn.register("edv_delta", data)
+        try:
+            if replace:
+                self.conn.execute(f"CREATE OR REPLACE TABLE {TABLE} AS SELECT * FROM edv_delta")
+            else:
+                self.conn.execute(f"INSERT INTO {TABLE} SELECT * FROM edv_delta")
+        finally:
+            self.conn.unregister("edv_delta")
+
+    def query(self, sql, params=()):
+        # Un cursor por consulta: las sesiones de Streamlit consultan desde hilos distintos
+        with edv_perf.span("motor duckdb: consulta"):
+            return self.conn.cursor().execute(sql, list(params)).df()
+
+    def _quantiles(self, column, where, params, count):
+        q = _quote(column)
+        result = self.query(f"SELECT {', '.join(f'quantile_cont({q}, {p})' for p in QUANTILES)} "
+                            f"FROM {TABLE}{where}", params)
+        return result.iloc[0].to_numpy(dtype="float64", na_value=np.nan)
+
+    def _correlation(self, columns, where, params):
+        k = len(columns)
+        pairs = [(i, j) for i in range(k) for j in range(i, k)]
+        values = np.full((k, k), np.nan)
+        for start in range(0, len(pairs), _MAX_SELECT_COLUMNS):
+            chunk = pairs[start:start + _MAX_SELECT_COLUMNS]
+            selects = ", ".join(f"corr({_quote(columns[i])}, {_quote(columns[j])})" for i, j in chunk)
+            row = self.query(f"SELECT {selects} FROM {TABLE}{where}", params).iloc[0]
+            for (i, j), value in zip(chunk, row.to_numpy(dtype="float64", na_value=np.nan)):
+                values[i, j] = values[j, i] = value
+        # pandas deja la diagonal en 1 (NaN si la columna es constante o no tiene datos)
+        return values
+
+
+class SqliteEngine(SqlEngine):
+    """SQLite en memoria (biblioteca estándar): sin paralelismo, útil para comparar"""
+
+    name = "sqlite"
+
+    def _connect(self):
+        return sqlite3.connect(":memory:", check_same_thread=False)
+
+    def _load(self, data, replace):
+        data.to_sql(TABLE, self.conn, if_exists="replace" if replace else "append", index=False)
+
+    def query(self, sql, params=()):
+        with self._lock, edv_perf.span("motor sqlite: consulta"):
+            return pd.read_sql_query(sql, self.conn, params=list(params))
+
+    def apply_delta(self, removed, added):
+        super().apply_delta(removed, added)
+        self.conn.commit()
+
+    def _quantiles(self, column, where, params, count):
+        """Interpolación lineal (como pandas) leyendo solo los dos valores vecinos de cada cuantil"""
+        if count == 0:
+            return np.full(len(QUANTILES), np.nan)
+        q = _quote(column)
+        where, params = (where + f" AND {q} IS NOT NULL" if where else f" WHERE {q} IS NOT NULL"), list(params)
+        result = []
+        for p in QUANTILES:
+            position = p * (count - 1)
+            low = int(np.floor(position))
+            neighbours = self.query(f"SELECT {q} AS v FROM {TABLE}{where} ORDER BY {q} LIMIT 2 OFFSET {low}",
+                                    params)["v"].to_numpy(dtype="float64")
+            high = neighbours[1] if len(neighbours) > 1 else neighbours[0]
+            result.append(neighbours[0] + (high - neighbours[0]) * (position - low))
+        return np.array(result)
+
+    def _correlation(self, columns, where, params):
+        """Sumas centradas por pareja en SQL; la raíz y el cociente en NumPy (SQLite no tiene corr)"""
+        k = len(columns)
+        moments = self._moments(columns, where, params)
+        means = [float(mean) for mean in moments["mean"].fillna(0.0)]
+        pairs = [(i, j) for i in range(k) for j in range(i, k)]
+        values = np.full((k, k), np.nan)
+        per_pair = 6
+        for start in range(0, len(pairs), _MAX_SELECT_COLUMNS // per_pair):
+            chunk = pairs[start:start + _MAX_SELECT_COLUMNS // per_pair]
+            selects = []
+            for i, j in chunk:
+                x, y = _quote(columns[i]), _quote(columns[j])
+                a, b = f"({x} - {means[i]!r})", f"({y} - {means[j]!r})"
+                selects += [f"SUM(CASE WHEN {x} IS NOT NULL AND {y} IS NOT NULL THEN 1 ELSE 0 END)",
+                            f"SUM(CASE WHEN {y} IS NOT NULL THEN {a} END)",
+                            f"SUM(CASE WHEN {x} IS NOT NULL THEN {b} END)",
+                            f"SUM({a} * {b})",
+                            f"SUM(CASE WHEN {y} IS NOT NULL THEN {a} * {a} END)",
+                            f"SUM(CASE WHEN {x} IS NOT NULL THEN {b} * {b} END)"]
+            row = self.query(f"SELECT {', '.join(selects)} FROM {TABLE}{where}", params).iloc[0]
+            sums = row.to_numpy(dtype="float64", na_value=np.nan).reshape(len(chunk), per_pair)
+            n, sa, sb, sab, saa, sbb = sums.T
+            with np.errstate(invalid="ignore", divide="ignore"):
+                cov = sab - sa * sb / n
+                var_a, var_b = saa - sa * sa / n, sbb - sb * sb / n
+                corr = cov / np.sqrt(var_a * var_b)
+            # Columna constante: la varianza es solo error de redondeo y pandas devuelve NaN
+            constant = (var_a <= 1e-12 * saa) | (var_b <= 1e-12 * sbb)
+            corr = np.where((n > 1) & ~constant, np.clip(corr, -1.0, 1.0), np.nan)
+            for (i, j), value in zip(chunk, corr):
+                values[i, j] = values[j, i] = value
+        return values
+
+
+def create_engine(name, df, threads=None):
+    """Motor SQL sobre df; "duckdb" cae a SQLite si duckdb no está instalado"""
+    if name == "duckdb" and duckdb is not None:
+        return DuckDbEngine(df, threads=threads)
+    if name in ("duckdb", "sqlite"):
+        return SqliteEngine(df)
+    raise ValueError(f"Motor analític desconegut: {name}")
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+EXPORTACIÓN - EDV Comparator
+Ficheros CSV / Excel / Parquet generados por bloques directamente a disco
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él no se ofrece Parquet
+    pa = None
+    pq = None
+
+CHUNK_ROWS = 50_000
+
+EXPORT_FORMATS = {
+    "CSV": {"extension": "csv", "mime": "text/csv"},
+    "Excel": {"extension": "xlsx", "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    "Parquet": {"extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def available_formats():
+    """Formatos disponibles según las dependencias instaladas"""
+    return [name for name in EXPORT_FORMATS if name != "Parquet" or pq is not None]
+
+
+def iter_chunks(df, chunk_rows=CHUNK_ROWS):
+    """Recorre el DataFrame en bloques de `chunk_rows` filas (vistas, sin copiar)"""
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+# ============================================================================
+# ESCRITORES POR FORMATO
+# ============================================================================
+
+def write_csv(df, path, chunk_rows=CHUNK_ROWS):
+    """CSV escrito por bloques: nunca se construye el fichero entero en memoria"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if df.empty:
+            df.to_csv(f, index=False)
+        for i, chunk in enumerate(iter_chunks(df, chunk_rows)):
+            chunk.to_csv(f, index=False, header=(i == 0))
+
+
+def write_excel(df, path, chunk_rows=CHUNK_ROWS, sheet_name="EDV Data"):
+    """XLSX con openpyxl en modo write_only (memoria constante por fila)"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([str(column) for column in df.columns])
+    for chunk in iter_chunks(df, chunk_rows):
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(path)
+
+
+def write_parquet(df, path, chunk_rows=CHUNK_ROWS, compression="zstd"):
+    """Parquet comprimido, un row group por bloque"""
+    if pq is None:
+        raise RuntimeError("Parquet requiere pyarrow")
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for chunk in iter_chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+WRITERS = {
+    "CSV": write_csv,
+    "Excel": write_excel,
+    "Parquet": write_parquet,
+}
+
+
+# ============================================================================
+# CACHÉ DE FICHEROS EXPORTADOS
+# ============================================================================
+
+class ExportCache:
+    """Ficheros ya generados por (versión de datos, formato, selección).
+
+    Se guardan en disco y se reutilizan mientras no cambien los datos; los más
+    antiguos se borran al superar `max_entries`.
+    """
+
+    def __init__(self, directory, max_entries=20):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(export_format, **selection):
+        payload = json.dumps({"format": export_format, **selection}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def path_for(self, key, export_format):
+        return os.path.join(self.directory, f"{key}.{EXPORT_FORMATS[export_format]['extension']}")
+
+    def get_or_build(self, df, export_format, **selection):
+        """Devuelve la ruta del fichero exportado, generándolo solo si no existe"""
+        key = self.make_key(export_format, **selection)
+        path = self.path_for(key, export_format)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return path, True
+            # Un temporal por proceso: el lock solo protege a los hilos de este
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                WRITERS[export_format](df, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._evict()
+        return path, False
+
+    def _evict(self):
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if not name.endswith(".tmp")]
+        files.sort(key=os.path.getmtime, reverse=True)
+        for old in files[self.max_entries:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CARGA DE LLIBRES EXCEL - EDV Comparator
+Lee la sección "A. Resum fitxa EDV" de cada libro en un pool de procesos, la
+traduce a columnas de edv_fitxes según database/diccionario_datos_ORDENADO.md,
+quita duplicados por (codigo_actuacion, any) y la carga por lotes con upsert.
+
+Formato del libro (el del Excel original): una fila por campo, con la
+etiqueta del "Campo Original" en una columna, y una columna por fitxa a su
+derecha. La fila 5 tiene el sector (celdas combinadas sobre sus fitxes) y las
+filas de título de sección ("Càlcul dinàmic"...) distinguen las etiquetas
+repetidas. La sección "B. Explotació de dades" no se carga.
+
+Uso:
+    python edv_ingest.py excels/*.xlsx
+    python edv_ingest.py excels/ --workers 8 --transaction-rows 5000
+    python edv_ingest.py excels/ --sqlite edv.sqlite --dry-run
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import unicodedata
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import edv_db
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database",
+                               "diccionario_datos_ORDENADO.md")
+
+WORKBOOK_EXTENSIONS = (".xlsx", ".xlsm")
+SHEET_TITLE = "Resum fitxa EDV"
+SECTION_START = "A. Resum fitxa EDV"
+SECTION_END = "B. Explotació de dades"
+# Fila (1-based) con el sector de cada columna
+SECTOR_ROW = 5
+# Columnas candidatas a contener las etiquetas
+LABEL_SEARCH_COLUMNS = 10
+
+# Campos duplicados en el Excel que en la tabla son un solo identificador
+IDENTIFIER_SOURCES = {"codigo_actuacion": "Codi_Actuacio"}
+TRANSACTION_ROWS = 5000
+
+_TABLE_ROW = re.compile(r"^\|\s*\d+\s*\|\s*([\w]+)\s*\|[^|]*\|\s*(.+?)\s*\|\s*$")
+
+
+def normalize_label(text):
+    """Etiqueta comparable: sin acentos, minúsculas, apóstrofo recto y espacios simples"""
+    text = unicodedata.normalize("NFKD", str(text).replace("’", "'"))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text).strip().rstrip(":").strip().casefold()
+
+
+# ============================================================================
+# DICCIONARIO DE DATOS → COLUMNAS
+# ============================================================================
+
+def load_dictionary(path=DICTIONARY_PATH, schema=None):
+    """Lee las tablas "Campo SQL | Tipo | Campo Original" por sección.
+
+    Devuelve {sección normalizada: {etiqueta normalizada: columna}}. Los campos
+    del Excel que en la tabla no existen con ese nombre (Nom_Actuacio,
+    Municipi, Any) se asignan a la columna identificadora equivalente. La
+    tabla de identificadores no tiene "Campo Original" y no aporta etiquetas.
+    """
+    schema = edv_db.load_schema() if schema is None else schema
+    by_lower = {column.lower(): column for column in schema}
+    sections, section, with_original = {}, None, False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("### "):
+                section, with_original = normalize_label(line[4:]), False
+                continue
+            if line.startswith("|") and "Campo Original" in line:
+                with_original = True
+                continue
+            match = _TABLE_ROW.match(line)
+            if match is None or not with_original:
+                continue
+            column, original = match.groups()
+            column = column if column in schema else by_lower.get(column.lower())
+            if column is not None and column != "id":
+                sections.setdefault(section, {})[normalize_label(original)] = column
+    return sections
+
+
+class LabelMap:
+    """Resuelve una etiqueta del Excel a su columna teniendo en cuenta la sección"""
+
+    def __init__(self, sections):
+        self.sections = sections
+        owners = {}
+        for name, labels in sections.items():
+            for label, column in labels.items():
+                owners.setdefault(label, set()).add(column)
+        # Etiquetas que significan lo mismo en cualquier sección
+        self.unique = {label: columns.pop() for label, columns in owners.items() if len(columns) == 1}
+
+    def resolve(self, text, section):
+        """(columna o None, sección vigente tras esta fila)"""
+        label = normalize_label(text)
+        if label in self.sections:
+            return None, label
+        # "Càlcul dinàmic_Taxa aplicada": la sección va delante de la etiqueta
+        prefix, _, rest = label.partition("_")
+        if rest and prefix in self.sections:
+            section, label = prefix, rest.strip()
+        if section is not None and label in self.sections.get(section, {}):
+            return self.sections[section][label], section
+        return self.unique.get(label), section
+
+
+# ============================================================================
+# LECTURA DE UN LIBRO (proceso del pool)
+# ============================================================================
+
+_LABELS = None
+
+
+def _init_worker(dictionary_path):
+    global _LABELS
+    _LABELS = LabelMap(load_dictionary(dictionary_path))
+
+
+def _find_sheet(workbook):
+    for sheet in workbook.worksheets:
+        if SHEET_TITLE.casefold() in sheet.title.casefold():
+            return sheet
+    return workbook.worksheets[0]
+
+
+def _has_text(row, text):
+    target = normalize_label(text)
+    return any(isinstance(value, str) and target in normalize_label(value) for value in row)
+
+
+def _label_column(rows, labels):
+    """Columna con más etiquetas reconocidas"""
+    counts = [0] * LABEL_SEARCH_COLUMNS
+    for row in rows:
+        for i, value in enumerate(row[:LABEL_SEARCH_COLUMNS]):
+            if isinstance(value, str) and labels.resolve(value, None)[0] is not None:
+                counts[i] += 1
+    best = max(range(LABEL_SEARCH_COLUMNS), key=counts.__getitem__)
+    return best if counts[best] else None
+
+
+def parse_rows(rows, labels):
+    """Fitxes (una por columna con datos) de las filas de la hoja; devuelve (DataFrame, avisos)"""
+    rows = [tuple(row) for row in rows]
+    width = max((len(row) for row in rows), default=0)
+    rows = [row + (None,) * (width - len(row)) for row in rows]
+    warnings_ = []
+
+    start = next((i + 1 for i, row in enumerate(rows) if _has_text(row, SECTION_START)), 0)
+    end = next((i for i, row in enumerate(rows) if i >= start and _has_text(row, SECTION_END)), len(rows))
+    label_column = _label_column(rows[start:end], labels)
+    if label_column is None:
+        return pd.DataFrame(), ["no s'ha trobat cap etiqueta del diccionari"]
+
+    field_rows, section = {}, None
+    for i in range(start, end):
+        value = rows[i][label_column]
+        if not isinstance(value, str) or not value.strip():
+            continue
+        column, section = labels.resolve(value, section)
+        if column is not None and column not in field_rows:
+            field_rows[column] = i
+
+    # Fila del sector: celdas combinadas → solo la primera tiene valor; se propaga a la derecha
+    sectors, current = {}, None
+    if len(rows) >= SECTOR_ROW:
+        for j in range(label_column + 1, width):
+            value = rows[SECTOR_ROW - 1][j]
+            current = value if value not in (None, "") else current
+            sectors[j] = current
+
+    records = []
+    for j in range(label_column + 1, width):
+        record = {column: rows[i][j] for column, i in field_rows.items()}
+        if all(value in (None, "") for value in record.values()):
+            continue
+        if record.get("sector") in (None, ""):
+            record["sector"] = sectors.get(j)
+        for column, source in IDENTIFIER_SOURCES.items():
+            if record.get(column) in (None, ""):
+                record[column] = record.get(source)
+        records.append(record)
+    if not records:
+        warnings_.append("cap columna amb dades")
+    return pd.DataFrame(records), warnings_
+
+
+def parse_workbook(path):
+    """Tarea del pool: (ruta, fitxes, avisos, segundos)"""
+    import openpyxl
+
+    start = time.perf_counter()
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        return path, pd.DataFrame(), [f"no es pot obrir: {e}"], time.perf_counter() - start
+    try:
+        rows = list(_find_sheet(workbook).iter_rows(values_only=True))
+    finally:
+        workbook.close()
+    records, messages = parse_rows(rows, _LABELS)
+    if not records.empty:
+        records["_fitxer"] = path
+        records["_modificat"] = os.path.getmtime(path)
+    return path, records, messages, time.perf_counter() - start
+
+
+# ============================================================================
+# CARGA
+# ============================================================================
+
+def collect_paths(inputs):
+    """Ficheros .xlsx/.xlsm de las rutas, directorios (recursivo) o patrones indicados"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths += [os.path.join(root, name) for name in files]
+        else:
+            paths += glob.glob(item) or [item]
+    return sorted({path for path in paths
+                   if path.lower().endswith(WORKBOOK_EXTENSIONS) and not os.path.basename(path).startswith("~$")})
+
+
+def deduplicate(records):
+    """Una fitxa por (codigo_actuacion, any): gana la del libro modificado más tarde"""
+    ordered = records.sort_values("_modificat", kind="mergesort")
+    key = pd.DataFrame({"codigo_actuacion": ordered["codigo_actuacion"].astype("string"),
+                        "any": pd.to_numeric(ordered["any"], errors="coerce")})
+    duplicated = key.duplicated(keep="last")
+    return ordered[~duplicated].sort_index().reset_index(drop=True), int(duplicated.sum())
+
+
+def load_records(conn, records, transaction_rows=TRANSACTION_ROWS, batch_size=edv_db.UPSERT_BATCH_SIZE):
+    """Upsert en transacciones de `transaction_rows` filas; devuelve filas afectadas"""
+    affected = 0
+    for start in range(0, len(records), transaction_rows):
+        affected += edv_db.upsert_records(conn, records.iloc[start:start + transaction_rows], batch_size=batch_size)
+    return affected
+
+
+def open_connection(args):
+    if args.sqlite:
+        import edv_sqlite
+        return edv_sqlite.connect(args.sqlite)
+    return edv_db.connect_from_secrets(args.secrets)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Carrega llibres Excel de fitxes EDV a edv_fitxes")
+    parser.add_argument("inputs", nargs="+", help="fitxers, directoris o patrons (*.xlsx)")
+    parser.add_argument("--workers", type=int, default=None, help="processos de lectura (per defecte: un per CPU)")
+    parser.add_argument("--transaction-rows", type=int, default=TRANSACTION_ROWS,
+                        help="files per transacció (per defecte: 5000)")
+    parser.add_argument("--batch-size", type=int, default=edv_db.UPSERT_BATCH_SIZE,
+                        help="files per INSERT multi-VALUES")
+    parser.add_argument("--dictionary", default=DICTIONARY_PATH, help="diccionari de dades (.md)")
+    parser.add_argument("--secrets", default=edv_db.SECRETS_PATH, help="secrets.toml amb la secció [mysql]")
+    parser.add_argument("--sqlite", default=None, help="BD SQLite substituta en lloc de MySQL")
+    parser.add_argument("--dry-run", action="store_true", help="només llegeix i valida, no carrega")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # pandas avisa con cualquier conexión DB-API que no sea sqlite3 o SQLAlchemy (también con MySQL)
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    print("=" * 80)
+    print("📥 CÀRREGA DE LLIBRES EXCEL - EDV Comparator")
+    print("=" * 80)
+    paths = collect_paths(args.inputs)
+    if not paths:
+        print("❌ No s'ha trobat cap fitxer .xlsx/.xlsm")
+        return 1
+
+    wall_start = time.perf_counter()
+    parts, failed = [], 0
+    workers = args.workers or min(len(paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(args.dictionary,)) as executor:
+        futures = [executor.submit(parse_workbook, path) for path in paths]
+        for future in as_completed(futures):
+            path, records, messages, seconds = future.result()
+            for message in messages:
+                print(f"  ⚠️  {os.path.basename(path)}: {message}")
+            if records.empty:
+                failed += 1
+                continue
+            parts.append(records)
+    parse_seconds = time.perf_counter() - wall_start
+    if not parts:
+        print("❌ Cap llibre amb fitxes")
+        return 1
+
+    records = pd.concat(parts, ignore_index=True)
+    parsed = len(records)
+    print(f"✓ {len(paths) - failed}/{len(paths)} llibres, {parsed:,} fitxes llegides en {parse_seconds:.2f} s "
+          f"({parsed / parse_seconds:,.0f} files/s)")
+
+    records = edv_db.normalize_records(records.drop(columns=["_fitxer"]))
+    records, duplicates = deduplicate(records)
+    records = records.drop(columns=["_modificat"])
+    if duplicates:
+        print(f"✓ {duplicates:,} fitxes repetides (codigo_actuacion, any): es manté la del llibre més recent")
+
+    errors = edv_db.validate_records(records)
+    if errors:
+        print(f"❌ {len(errors)} errors de validació:")
+        for error in errors[:20]:
+            print(f"  {error}")
+        if len(errors) > 20:
+            print(f"  ... i {len(errors) - 20} més")
+        return 1
+    if args.dry_run:
+        print(f"✅ {len(records):,} fitxes vàlides (--dry-run: no s'ha carregat res)")
+        return 0
+
+    load_start = time.perf_counter()
+    conn = open_connection(args)
+    try:
+        affected = load_records(conn, records, args.transaction_rows, args.batch_size)
+    except Exception as e:
+        print(f"❌ Error carregant a la BD: {e}")
+        return 1
+    finally:
+        conn.close()
+    load_seconds = time.perf_counter() - load_start
+    wall_seconds = time.perf_counter() - wall_start
+
+    print(f"✓ {len(records):,} fitxes carregades en {load_seconds:.2f} s "
+          f"({len(records) / load_seconds:,.0f} files/s, {affected:,} files afectades)")
+    print(f"⏱️  Temps total: {wall_seconds:.2f} s ({len(records) / wall_seconds:,.0f} files/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+INSTRUMENTACIÓN DE RENDIMIENTO - EDV Comparator
+Tramos de tiempo y contadores por rerun de Streamlit, historial en memoria
+para percentiles y registro rotativo en JSON lines.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import numpy as np
+
+_current = contextvars.ContextVar("edv_perf_recorder", default=None)
+
+
+# ============================================================================
+# REGISTRO POR RERUN
+# ============================================================================
+
+class RerunRecorder:
+    """Tramos (span) y contadores de una ejecución del script"""
+
+    def __init__(self, **meta):
+        self.meta = meta
+        self.spans = []
+        self.counters = Counter()
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, time.perf_counter() - start))
+
+    def record(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def totals(self):
+        """{tramo: (llamadas, segundos totales)} en orden de primera aparición"""
+        totals = {}
+        for name, seconds in self.spans:
+            calls, total = totals.get(name, (0, 0.0))
+            totals[name] = (calls + 1, total + seconds)
+        return totals
+
+    def to_record(self):
+        return {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            **self.meta,
+            "total_ms": round(self.elapsed() * 1000, 2),
+            "spans": {name: {"calls": calls, "ms": round(total * 1000, 2)}
+                      for name, (calls, total) in self.totals().items()},
+            "counters": dict(self.counters),
+        }
+
+
+def start_rerun(**meta):
+    """Crea el registro de este rerun y lo deja activo en el hilo actual"""
+    recorder = RerunRecorder(**meta)
+    _current.set(recorder)
+    return recorder
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Tramo sobre el registro activo (no hace nada fuera de un rerun, p.ej. en hilos de fondo)"""
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    with recorder.span(name):
+        yield
+
+
+def count(name, n=1):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+# ============================================================================
+# HISTORIAL (PERCENTILES) Y LOG ROTATIVO
+# ============================================================================
+
+class PerfHistory:
+    """Últimos `maxlen` reruns del proceso para calcular p50/p95 por tramo"""
+
+    def __init__(self, maxlen=500):
+        self._records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def percentiles(self):
+        """{tramo: {"n", "p50_ms", "p95_ms", "max_ms"}} incluyendo el total del rerun"""
+        with self._lock:
+            records = list(self._records)
+        samples = defaultdict(list)
+        for record in records:
+            samples["total"].append(record["total_ms"])
+            for name, values in record["spans"].items():
+                samples[name].append(values["ms"])
+        return {
+            name: {
+                "n": len(values),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "max_ms": float(np.max(values)),
+            }
+            for name, values in samples.items()
+        }
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def get_logger(path, max_bytes=5 * 1024 * 1024, backup_count=5):
+    """Logger que escribe un JSON por línea y rota al llegar a `max_bytes`"""
+    path = os.path.abspath(path)
+    with _loggers_lock:
+        if path not in _loggers:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            logger = logging.getLogger(f"edv_perf.{path}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(_JsonLineFormatter())
+            logger.addHandler(handler)
+            _loggers[path] = logger
+        return _loggers[path]
+
+
+def finish_rerun(recorder, history=None, logger=None):
+    """Cierra el rerun: lo añade al historial y al log"""
+    record = recorder.to_record()
+    if history is not None:
+        history.add(record)
+    if logger is not None:
+        try:
+            logger.info(record)
+        except Exception:
+            pass
+    _current.set(None)
+    return record
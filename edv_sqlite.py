@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+SUSTITUTO LOCAL DE MySQL (SQLite) - EDV Comparator
+Base de datos en un fichero (o en memoria) con la misma tabla edv_fitxes, para
+benchmarks y pruebas sin servidor. Traduce lo justo del dialecto MySQL que usa
+edv_db: placeholders %s, SHOW COLUMNS, START TRANSACTION y ON DUPLICATE KEY.
+"""
+
+import re
+import sqlite3
+from decimal import Decimal
+
+import edv_db
+
+# Los DECIMAL se devuelven como Decimal, igual que mysql.connector
+sqlite3.register_converter("DECIMAL", lambda raw: Decimal(raw.decode("ascii")))
+
+_SQLITE_TYPES = {
+    "INT": "INTEGER",
+    "DECIMAL": "DECIMAL(20,10)",
+    "VARCHAR": "TEXT",
+    "TIMESTAMP": "TIMESTAMP",
+}
+
+_SHOW_COLUMNS = re.compile(r"SHOW\s+COLUMNS\s+FROM\s+(\w+)\s+LIKE\s+'(\w+)'", re.IGNORECASE)
+_ON_DUPLICATE = re.compile(r"ON\s+DUPLICATE\s+KEY\s+UPDATE\s+(.*)$", re.IGNORECASE | re.DOTALL)
+_VALUES_REF = re.compile(r"VALUES\((\w+)\)", re.IGNORECASE)
+
+
+def translate(query):
+    """Adapta una consulta de edv_db (dialecto MySQL) a SQLite"""
+    match = _SHOW_COLUMNS.search(query)
+    if match:
+        table, column = match.groups()
+        return f"SELECT name FROM pragma_table_info('{table}') WHERE name = '{column}'"
+
+    match = _ON_DUPLICATE.search(query)
+    if match:
+        updates = _VALUES_REF.sub(r"excluded.\1", match.group(1))
+        conflict = f"ON CONFLICT({', '.join(edv_db.UPSERT_KEY)}) DO UPDATE SET {updates}"
+        query = query[:match.start()] + conflict
+    return query.replace("%s", "?")
+
+
+class StandInCursor:
+    """Cursor DB-API que traduce las consultas antes de ejecutarlas"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(translate(query), tuple(params or ()))
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(translate(query), [tuple(params) for params in seq_of_params])
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class StandInConnection:
+    """Conexión con la interfaz de mysql.connector que usa edv_db"""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+    def cursor(self):
+        return StandInCursor(self._conn.cursor())
+
+    def start_transaction(self):
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN")
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    def is_connected(self):
+        try:
+            self.ping()
+            return True
+        except sqlite3.Error:
+            return False
+
+
+def create_schema(conn, schema=None):
+    """Crea edv_fitxes a partir de create_edv_database.sql"""
+    schema = edv_db.load_schema() if schema is None else schema
+    definitions = []
+    for column, sql_type in schema.items():
+        if column == "id":
+            definitions.append("id INTEGER PRIMARY KEY AUTOINCREMENT")
+        elif column == edv_db.CHANGE_COLUMN:
+            definitions.append(f"{column} TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP")
+        elif column == "codigo_actuacion":
+            definitions.append(f"{column} TEXT NOT NULL")
+        else:
+            definitions.append(f"{column} {_SQLITE_TYPES[sql_type]}")
+
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS edv_fitxes ({', '.join(definitions)})")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_codigo_any ON edv_fitxes (codigo_actuacion, any)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sector_codigo_any ON edv_fitxes (sector, codigo_actuacion, any)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_municipi ON edv_fitxes (municipi)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_any ON edv_fitxes (any)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sector ON edv_fitxes (sector)")
+    if edv_db.CHANGE_COLUMN in schema:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_updated_at ON edv_fitxes ({edv_db.CHANGE_COLUMN})")
+        # Equivalente a ON UPDATE CURRENT_TIMESTAMP
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_edv_fitxes_updated_at
+            AFTER UPDATE ON edv_fitxes
+            BEGIN
+                UPDATE edv_fitxes SET {edv_db.CHANGE_COLUMN} = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        """)
+    cursor.close()
+    conn.commit()
+
+
+def connect(path=":memory:", create=True):
+    """Abre (y si hace falta crea) la base de datos sustituta"""
+    conn = StandInConnection(path)
+    if create:
+        create_schema(conn)
+    return conn
+
+
+def insert_frame(conn, df, batch_size=10_000):
+    """Carga un DataFrame de filas edv_fitxes (sin id) por bloques"""
+    columns = [column for column in df.columns if column != "id"]
+    query = f"INSERT INTO edv_fitxes ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+    cursor = conn.cursor()
+    try:
+        rows = list(values.itertuples(index=False, name=None))
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(query, rows[start:start + batch_size])
+        conn.commit()
+    finally:
+        cursor.close()
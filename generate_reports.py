@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+INFORMES POR SECTOR - EDV Comparator
+Genera sin Streamlit un informe HTML por sector (resumen, evolución temporal y
+gráfico de "🔍 Análisi Individual"), listo para imprimir a PDF desde el
+navegador. La tabla se carga una sola vez y se publica en un fichero Arrow que
+los procesos del pool mapean en memoria sin copiarla.
+
+Uso:
+    python generate_reports.py --output informes
+    python generate_reports.py --sqlite edv.sqlite --years 2023 2024 --workers 4
+    python generate_reports.py --snapshot data/edv_fitxes.arrow
+"""
+
+import argparse
+import html
+import os
+import re
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+
+import edv_analytics
+import edv_db
+
+try:
+    import plotly.express as px
+except ImportError:  # sin plotly el gráfico se dibuja como SVG estático
+    px = None
+
+# Mismas métricas que el "Gràfic d'Evolució" de Home.py
+KEY_METRICS = ["Total_Ingressos", "Despesa_total", "Aprofitament_privats", "Obres_durbanitzacio"]
+CHART_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728"]
+
+PAGE_STYLE = """
+body { font-family: -apple-system, "Segoe UI", Roboto, sans-serif; margin: 2em; color: #262730; }
+h1 { font-size: 1.6em; margin-bottom: 0.2em; }
+.meta { color: #808495; font-size: 0.85em; }
+.metrics { display: flex; gap: 2em; margin: 1.5em 0; }
+.metric .label { color: #808495; font-size: 0.85em; }
+.metric .value { font-size: 1.6em; }
+table { border-collapse: collapse; font-size: 0.8em; }
+th, td { border-bottom: 1px solid #e6e9ef; padding: 0.3em 0.6em; text-align: right; }
+th { background: #f0f2f6; }
+@media print { body { margin: 0; } .chart { page-break-inside: avoid; } }
+"""
+
+# Tabla de cada proceso del pool (se asigna en _init_worker)
+_DATASET = None
+_INDEX = None
+
+
+# ============================================================================
+# CARGA (UNA SOLA VEZ)
+# ============================================================================
+
+def open_connection(args):
+    """Conexión a MySQL (secrets.toml) o al sustituto SQLite"""
+    if args.sqlite:
+        import edv_sqlite
+        return edv_sqlite.connect(args.sqlite, create=False)
+    return edv_db.connect_from_secrets(args.secrets)
+
+
+def load_dataset(args):
+    """Devuelve (df ordenado por sector, any DESC; watermark)"""
+    if args.snapshot:
+        df, watermark = edv_db.read_snapshot(args.snapshot)
+        if df is None:
+            raise FileNotFoundError(f"❌ No s'ha pogut llegir el snapshot {args.snapshot}")
+        df = edv_db.filter_frame(df, args.sectors, args.years)
+        return edv_db.sort_edv_frame(df), watermark
+
+    conn = open_connection(args)
+    try:
+        watermark = edv_db.fetch_watermark(conn, edv_db.has_change_tracking(conn))
+        df = edv_db.load_edv_fitxes(conn, sectors=args.sectors, years=args.years, float_dtype=args.float_dtype)
+    finally:
+        conn.close()
+    return edv_db.sort_edv_frame(df), watermark
+
+
+def _init_worker(path, df):
+    """Abre la tabla compartida (mapeada) o recibe la copia si no hay pyarrow"""
+    global _DATASET, _INDEX
+    if path is not None:
+        df, _ = edv_db.read_snapshot(path)
+    _DATASET = df
+    _INDEX = edv_db.SectorYearIndex.from_frame(df)
+
+
+# ============================================================================
+# INFORME DE UN SECTOR
+# ============================================================================
+
+def report_filename(sector):
+    return re.sub(r"[^\w-]+", "_", str(sector)).strip("_") + ".html"
+
+
+def temporal_table(sector_data):
+    """Tabla "Evolució Temporal": any, hipòtesi y variables numéricas, del más reciente al más antiguo"""
+    numeric_cols = [col for col in sector_data.select_dtypes(include=[np.number]).columns
+                    if col not in ("id", "any")]
+    return sector_data[["any", "Hipotesis"] + numeric_cols].sort_values("any", ascending=False)
+
+
+def _svg_chart(data, metrics, width=900, height=360, margin=50):
+    """Gráfico de líneas estático (sin JavaScript) para cuando no hay plotly"""
+    data = data.groupby("any")[metrics].mean().sort_index()
+    values = data.to_numpy(dtype="float64")
+    if not len(data) or np.isnan(values).all():
+        return ""
+    x_min, x_max = data.index.min(), data.index.max()
+    y_min, y_max = min(np.nanmin(values), 0.0), np.nanmax(values)
+    x_span, y_span = (x_max - x_min) or 1, (y_max - y_min) or 1
+
+    def point(x, y):
+        return (margin + (x - x_min) / x_span * (width - 2 * margin),
+                height - margin - (y - y_min) / y_span * (height - 2 * margin))
+
+    parts = [f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg" font-size="11">',
+             f'<line x1="{margin}" y1="{height - margin}" x2="{width - margin}" y2="{height - margin}" stroke="#999"/>',
+             f'<text x="{margin}" y="{height - margin + 16}">{x_min}</text>',
+             f'<text x="{width - margin}" y="{height - margin + 16}" text-anchor="end">{x_max}</text>',
+             f'<text x="4" y="{margin}">{y_max:,.0f}</text>']
+    for i, metric in enumerate(metrics):
+        color = CHART_COLORS[i % len(CHART_COLORS)]
+        series = data[metric].dropna()
+        points = " ".join("%.1f,%.1f" % point(x, y) for x, y in series.items())
+        parts.append(f'<polyline points="{points}" fill="none" stroke="{color}" stroke-width="2"/>')
+        parts.append(f'<text x="{width - margin + 4}" y="{margin + 14 * i}" fill="{color}">{html.escape(metric)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def evolution_chart(sector_data, sector):
+    metrics = [m for m in KEY_METRICS if m in sector_data.columns]
+    if not metrics:
+        return ""
+    if px is None:
+        return _svg_chart(sector_data, metrics)
+    fig = px.line(sector_data.sort_values("any"), x="any", y=metrics,
+                  title=f"Evolució de Métriques - {sector}", markers=True,
+                  labels={"value": "Valor", "any": "Any", "variable": "Variable"})
+    return fig.to_html(full_html=False, include_plotlyjs="cdn")
+
+
+def render_report(sector, sector_data, summary, generated_at):
+    """HTML completo del informe de un sector"""
+    municipis = ", ".join(str(m) for m in sector_data["municipi"].dropna().unique())
+    metrics = [
+        ("Registres", f"{len(sector_data):,}"),
+        ("Anys", f"{sector_data['any'].min()} - {sector_data['any'].max()}"),
+        ("Municipis", municipis or "-"),
+        ("Ingressos Mitjans", f"{summary['Ingressos Mitjans']:,.2f} €"),
+        ("Despesa Mitjana", f"{summary['Despesa Mitjana']:,.2f} €"),
+    ]
+    metric_html = "".join(f'<div class="metric"><div class="label">{label}</div>'
+                          f'<div class="value">{html.escape(value)}</div></div>' for label, value in metrics)
+    table_html = temporal_table(sector_data).to_html(index=False, na_rep="-", float_format=lambda v: f"{v:,.2f}")
+    return f"""<!DOCTYPE html>
+<html lang="ca">
+<head><meta charset="utf-8"><title>Informe EDV - {html.escape(str(sector))}</title><style>{PAGE_STYLE}</style></head>
+<body>
+<h1>📊 Informe del Sector: {html.escape(str(sector))}</h1>
+<div class="meta">Generat el {generated_at}</div>
+<div class="metrics">{metric_html}</div>
+<h2>Gràfic d'Evolució</h2>
+<div class="chart">{evolution_chart(sector_data, sector)}</div>
+<h2>Evolució Temporal</h2>
+{table_html}
+</body>
+</html>
+"""
+
+
+def build_sector_report(sector, years, summary, output_dir, generated_at):
+    """Tarea del pool: filtra el sector de la tabla compartida y escribe su informe"""
+    start = time.perf_counter()
+    sector_data = _INDEX.take(_DATASET, [sector], years)
+    path = os.path.join(output_dir, report_filename(sector))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(render_report(sector, sector_data, summary, generated_at))
+    return sector, path, len(sector_data), time.perf_counter() - start
+
+
+def write_index(summary, output_dir, generated_at):
+    """index.html con la tabla de la Visió General y el enlace a cada informe"""
+    table = summary.round(2).reset_index()
+    table["sector"] = [f'<a href="{report_filename(s)}">{html.escape(str(s))}</a>' for s in table["sector"]]
+    path = os.path.join(output_dir, "index.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"""<!DOCTYPE html>
+<html lang="ca">
+<head><meta charset="utf-8"><title>Informes EDV</title><style>{PAGE_STYLE}</style></head>
+<body>
+<h1>📊 Informes EDV per Sector</h1>
+<div class="meta">Generat el {generated_at} · {len(table)} sectors</div>
+{table.to_html(index=False, escape=False, na_rep="-")}
+</body>
+</html>
+""")
+    return path
+
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def generate_reports(df, args):
+    """Genera todos los informes en paralelo; devuelve [(sector, ruta, filas, segundos)]"""
+    os.makedirs(args.output, exist_ok=True)
+    generated_at = datetime.now().strftime("%d/%m/%Y %H:%M")
+    # Misma agregación que la Visió General (cubo sector × any)
+    summary = edv_analytics.SectorYearCube.from_frame(df).sector_summary()
+    sectors = summary.index.tolist()
+    write_index(summary, args.output, generated_at)
+
+    shared_path = None
+    if edv_db.snapshot_available():
+        # Los procesos leen el mismo fichero mapeado (en /dev/shm si existe) en vez de recibir una copia
+        shared_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, shared_path = tempfile.mkstemp(prefix="edv_reports_", suffix=".arrow", dir=shared_dir)
+        os.close(fd)
+        edv_db.write_snapshot(df, args.watermark, shared_path)
+
+    results = []
+    try:
+        workers = args.workers or min(len(sectors), os.cpu_count() or 1) or 1
+        init_args = (shared_path, None if shared_path else df)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as executor:
+            futures = [executor.submit(build_sector_report, sector, args.years, summary.loc[sector].to_dict(),
+                                       args.output, generated_at) for sector in sectors]
+            for future in as_completed(futures):
+                sector, path, rows, seconds = future.result()
+                results.append((sector, path, rows, seconds))
+                print(f"  ✅ {sector:<30} {rows:>8,} files  {seconds * 1000:8.1f} ms")
+    finally:
+        if shared_path is not None:
+            os.remove(shared_path)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un informe HTML per sector de les fitxes EDV")
+    parser.add_argument("--output", default="informes", help="directori dels informes (per defecte: informes)")
+    parser.add_argument("--sectors", nargs="+", default=None, help="sectors a incloure (per defecte: tots)")
+    parser.add_argument("--years", type=int, nargs="+", default=None, help="anys a incloure (per defecte: tots)")
+    parser.add_argument("--workers", type=int, default=None, help="processos (per defecte: un per CPU)")
+    parser.add_argument("--secrets", default=edv_db.SECRETS_PATH, help="secrets.toml amb la secció [mysql]")
+    parser.add_argument("--sqlite", default=None, help="BD SQLite substituta en lloc de MySQL")
+    parser.add_argument("--snapshot", default=None, help="llegeix la taula d'un snapshot Arrow en lloc de la BD")
+    parser.add_argument("--float-dtype", default="float64", choices=["float64", "float32"])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # pandas avisa con cualquier conexión DB-API que no sea sqlite3 o SQLAlchemy (también con MySQL)
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    print("=" * 80)
+    print("📊 INFORMES PER SECTOR - EDV Comparator")
+    print("=" * 80)
+    wall_start = time.perf_counter()
+    try:
+        df, args.watermark = load_dataset(args)
+    except Exception as e:
+        print(f"❌ Error carregant les dades: {e}")
+        return 1
+    load_seconds = time.perf_counter() - wall_start
+    if df.empty:
+        print("⚠️  No hi ha dades per als filtres indicats")
+        return 1
+    print(f"✓ {len(df):,} fitxes carregades en {load_seconds:.2f} s")
+
+    results = generate_reports(df, args)
+
+    wall_seconds = time.perf_counter() - wall_start
+    render_seconds = sum(seconds for *_, seconds in results)
+    print()
+    print(f"✅ {len(results)} informes a {os.path.abspath(args.output)} (index.html)")
+    print(f"⏱️  Temps total: {wall_seconds:.2f} s (càrrega {load_seconds:.2f} s, "
+          f"informes {render_seconds:.2f} s de CPU en {wall_seconds - load_seconds:.2f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
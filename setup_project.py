@@ -34,6 +34,8 @@ host = "localhost"
 user = "root"
 password = ""
 database = "gestio_de_projectes"
+pool_size = 5
+pool_timeout = 10
 """
     
     try: